@@ -12,8 +12,10 @@ from pathlib import Path
 # 添加 src 到 Python 路徑
 sys.path.append(str(Path(__file__).parent / "src"))
 
+from sync.control import ControlServer
 from sync.engine import SyncEngine
-from utils.config import load_config
+from sync.tenants import MultiTenantRunner
+from utils.config import load_config, load_tenants
 from utils.logger import setup_logging
 
 
@@ -24,14 +26,26 @@ async def main():
     parser.add_argument("--once", action="store_true",
                        help="Run sync once and exit")
     parser.add_argument("--force", action="store_true",
-                       help="Force full sync (ignore cache)")
+                       help="Reconcile against Google Calendar and apply only the needed changes")
     parser.add_argument("--dry-run", action="store_true",
                        help="Show what would be synced without making changes")
+    parser.add_argument("--failures", action="store_true",
+                       help="Report events that keep failing to sync and exit")
+    parser.add_argument("--dedupe", action="store_true",
+                       help="Remove duplicate Google events, keeping the mapped one (use with --dry-run to only report)")
+    parser.add_argument("--state-backend", choices=["sqlite", "memory"],
+                       help="Override the state store backend (memory keeps nothing on disk, dry runs only)")
     
     args = parser.parse_args()
     
     # 載入設定
     config = load_config(args.config)
+    if args.state_backend:
+        config.database.backend = args.state_backend
+    if config.database.backend.lower() == "memory" and not (args.dry_run and (args.once or args.dedupe)):
+        # 記憶體後端不保留映射，實際寫入時每次啟動都會重新建立所有事件
+        parser.error("the memory state backend (database.backend or --state-backend) "
+                     "only works with --dry-run together with --once or --dedupe")
     
     # 設定日誌
     setup_logging(config.logging)
@@ -41,17 +55,36 @@ async def main():
     logger.info(f"Config file: {args.config}")
     
     try:
+        tenants = load_tenants(config)
+        if tenants:
+            await run_tenants(config, tenants, args, logger)
+            logger.info("Calendar Sync Tool stopped")
+            return
+        
         # 建立同步引擎
         sync_engine = SyncEngine(config)
         
-        if args.once:
+        if args.failures:
+            report_failures(sync_engine)
+        elif args.dedupe:
+            report_dedupe(sync_engine, args.dry_run)
+        elif args.once:
             # 執行一次同步
             logger.info("Running one-time sync")
             await sync_engine.sync_once(force=args.force, dry_run=args.dry_run)
         else:
             # 持續同步模式
             logger.info(f"Starting continuous sync (interval: {config.sync.interval_minutes} minutes)")
-            await sync_engine.start_continuous_sync()
+            control_server = None
+            if config.control.enabled:
+                # 本機控制端點：外部系統可主動觸發同步
+                control_server = ControlServer(sync_engine, config.control)
+                await control_server.start()
+            try:
+                await sync_engine.start_continuous_sync()
+            finally:
+                if control_server is not None:
+                    await control_server.close()
             
     except KeyboardInterrupt:
         logger.info("Received interrupt signal, shutting down...")
@@ -62,5 +95,60 @@ async def main():
     logger.info("Calendar Sync Tool stopped")
 
 
+def report_failures(sync_engine):
+    """列出持續同步失敗的事件"""
+    failures = sync_engine.get_failure_report()
+    if not failures:
+        print("No failing events")
+        return
+    
+    print(f"{len(failures)} failing events:")
+    for failure in failures:
+        print(f"  {failure['original_uid']} [{failure['operation']}] "
+              f"attempts={failure['attempts']} since {failure['first_failed_at']}")
+        print(f"    last error: {failure['last_error']}")
+
+
+def report_dedupe(sync_engine, dry_run):
+    """清理重複事件並列出結果"""
+    report = sync_engine.remove_duplicates(dry_run=dry_run)
+    if not report['duplicates']:
+        print("No duplicate events")
+        return
+    
+    action = "Would remove" if dry_run else "Removed"
+    removed = report['duplicates'] if dry_run else report['deleted']
+    print(f"{action} {removed} duplicate events across {report['groups']} source events:")
+    for detail in report['details']:
+        print(f"  {detail['unique_id']}: keep {detail['kept']}, remove {', '.join(detail['removed'])}")
+    for google_event_id, error in report['failed'].items():
+        print(f"  failed to delete {google_event_id}: {error}")
+
+
+async def run_tenants(config, tenants, args, logger):
+    """多租戶模式：單一程序同步多組來源與行事曆"""
+    runner = MultiTenantRunner(config, tenants)
+    try:
+        if args.failures or args.dedupe:
+            # 報告與清理模式逐一處理每個租戶，不啟動同步
+            for tenant_id, engine in runner.engines.items():
+                print(f"[{tenant_id}]")
+                if args.failures:
+                    report_failures(engine)
+                else:
+                    report_dedupe(engine, args.dry_run)
+        elif args.once:
+            logger.info(f"Running one-time sync for {len(tenants)} tenants")
+            results = await runner.run_once(force=args.force, dry_run=args.dry_run)
+            failed = [tenant_id for tenant_id, stats in results.items() if stats is None]
+            if failed:
+                logger.error(f"Sync failed for tenants: {', '.join(failed)}")
+        else:
+            logger.info(f"Starting continuous sync for {len(tenants)} tenants")
+            await runner.start()
+    finally:
+        runner.close()
+
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -4,8 +4,10 @@ Google Calendar API 客戶端
 """
 import logging
 import pickle
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, timedelta, timezone
+from typing import Iterator, List, Dict, Optional, Any, Tuple
 from pathlib import Path
 
 from google.auth.transport.requests import Request
@@ -17,6 +19,8 @@ from googleapiclient.errors import HttpError
 
 from src.utils.config import GoogleCalendarConfig
 from src.parsers.ics_parser import EventData
+from src.parsers.recurrence import google_recurrence_rules
+from src.parsers.timezones import timezone_name
 
 
 logger = logging.getLogger(__name__)
@@ -24,17 +28,59 @@ logger = logging.getLogger(__name__)
 # Google Calendar API 權限範圍
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# 比對受管理事件時只讀取的欄位
+MANAGED_EVENT_FIELDS = 'id,status,updated,summary,start,end,recurrence,recurringEventId,extendedProperties/private'
+
+# 單一批次請求可包含的最大呼叫數（Calendar API 限制）
+BATCH_LIMIT = 50
+
+# 事件 payload 快取的項目數上限
+PAYLOAD_CACHE_SIZE = 2048
+
 
 class GoogleCalendarClient:
     """Google Calendar API 客戶端"""
     
-    def __init__(self, config: GoogleCalendarConfig):
+    def __init__(self, config: GoogleCalendarConfig, credentials=None):
         self.config = config
-        self.service = None
-        self.credentials = None
+        # httplib2 連線不是執行緒安全的，每個執行緒使用各自的 service 物件
+        self._local = threading.local()
+        # 多租戶模式下由執行器共用的認證資料，設定後不再各自讀取憑證檔
+        self._shared_credentials = credentials
+        self.credentials = credentials
+        # 以指紋為鍵的事件 payload 快取（LRU），重試與備援請求不重複轉換
+        self._payloads: 'OrderedDict[Tuple, Dict[str, Any]]' = OrderedDict()
+        self._payload_lock = threading.Lock()
         
+    @property
+    def service(self):
+        """取得目前執行緒的 Calendar service，已認證時自動為新執行緒建立"""
+        service = getattr(self._local, 'service', None)
+        if service is None and self.credentials is not None:
+            service = build('calendar', 'v3', credentials=self.credentials, cache_discovery=False)
+            self._local.service = service
+        return service
+    
+    @service.setter
+    def service(self, value) -> None:
+        self._local.service = value
+    
+    def release_service(self) -> None:
+        """釋放目前執行緒的 service 物件，下次使用時重新建立"""
+        self._local.service = None
+    
+    def share_credentials(self, credentials) -> None:
+        """使用其他客戶端已取得的認證資料"""
+        self._shared_credentials = credentials
+        self.credentials = credentials
+    
     def authenticate(self) -> None:
         """執行 Google 認證（OAuth 或服務帳號）"""
+        if self._shared_credentials is not None:
+            # 共用認證由 google-auth 在請求時自動更新權杖
+            self.credentials = self._shared_credentials
+            return
+        
         if self.config.auth_type == "service_account":
             self._authenticate_service_account()
         else:
@@ -224,6 +270,39 @@ class GoogleCalendarClient:
                 logger.error(f"Failed to delete event {google_event_id}: {e}")
                 raise
     
+    def batch_delete_events(self, google_event_ids: List[str],
+                            calendar_id: str = None) -> Tuple[List[str], Dict[str, str]]:
+        """
+        以批次請求刪除多個事件，每個 HTTP 請求最多包含 BATCH_LIMIT 個刪除
+        已不存在的事件視為刪除成功，返回 (已刪除的 ID, 失敗的 ID -> 錯誤訊息)
+        """
+        if not self.service:
+            self.authenticate()
+
+        calendar_id = calendar_id or self.config.calendar_id
+        deleted: List[str] = []
+        failed: Dict[str, str] = {}
+
+        def on_response(request_id: str, response, exception) -> None:
+            if exception is None:
+                deleted.append(request_id)
+            elif isinstance(exception, HttpError) and exception.resp.status in (404, 410):
+                deleted.append(request_id)
+            else:
+                failed[request_id] = str(exception)
+
+        for offset in range(0, len(google_event_ids), BATCH_LIMIT):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for google_event_id in google_event_ids[offset:offset + BATCH_LIMIT]:
+                batch.add(
+                    self.service.events().delete(calendarId=calendar_id, eventId=google_event_id),
+                    request_id=google_event_id
+                )
+            batch.execute()
+
+        logger.info(f"Batch deleted {len(deleted)} out of {len(google_event_ids)} events")
+        return deleted, failed
+    
     def batch_create_events(self, events: List[EventData], 
                           calendar_id: str = None) -> List[Dict[str, Any]]:
         """批次建立事件"""
@@ -246,6 +325,28 @@ class GoogleCalendarClient:
         return created_events
     
     def _convert_to_google_event(self, event_data: EventData) -> Dict[str, Any]:
+        """
+        將 EventData 轉換為 Google Calendar 事件格式（以指紋快取結果，呼叫端不可修改）
+        指紋未涵蓋參與者，因此參與者也納入快取鍵
+        """
+        key = (
+            event_data.fingerprint,
+            tuple(tuple(attendee.values()) for attendee in event_data.attendees or ())
+        )
+        with self._payload_lock:
+            body = self._payloads.get(key)
+            if body is not None:
+                self._payloads.move_to_end(key)
+                return body
+        
+        body = self._build_google_event(event_data)
+        with self._payload_lock:
+            self._payloads[key] = body
+            if len(self._payloads) > PAYLOAD_CACHE_SIZE:
+                self._payloads.popitem(last=False)
+        return body
+    
+    def _build_google_event(self, event_data: EventData) -> Dict[str, Any]:
         """將 EventData 轉換為 Google Calendar 事件格式"""
         google_event = {
             'summary': event_data.summary,
@@ -265,24 +366,21 @@ class GoogleCalendarClient:
         else:
             google_event['start'] = {
                 'dateTime': event_data.start_datetime.isoformat(),
-                'timeZone': self._get_valid_timezone(event_data.start_datetime)
+                'timeZone': timezone_name(event_data.start_datetime)
             }
             google_event['end'] = {
                 'dateTime': event_data.end_datetime.isoformat(),
-                'timeZone': self._get_valid_timezone(event_data.end_datetime)
+                'timeZone': timezone_name(event_data.end_datetime)
             }
         
         # 處理週期規則
         if event_data.rrule:
             try:
-                # 轉換 RRULE 為 Google Calendar 格式
-                rrule_str = str(event_data.rrule)
-                
-                # 檢查並修正 RRULE 格式
-                rrule_str = self._fix_rrule_for_google(rrule_str)
+                # 轉換 RRULE 為 Google Calendar 格式（已驗證，依規則快取）
+                recurrence = google_recurrence_rules(event_data)
                 
-                if rrule_str:  # 只有有效的 RRULE 才添加
-                    google_event['recurrence'] = [f'RRULE:{rrule_str}']
+                if recurrence:  # 只有有效的 RRULE 才添加
+                    google_event['recurrence'] = recurrence
                     
                     # 處理例外日期
                     if event_data.exdate:
@@ -302,7 +400,6 @@ class GoogleCalendarClient:
 
                                 # 格式化為 Google Calendar 接受的格式
                                 # 關鍵：EXDATE 必須與 DTSTART 的時間精確匹配
-                                from datetime import datetime, date, timezone as dt_timezone
                                 if isinstance(exdate_dt, datetime):
                                     # Google Calendar 接受兩種 EXDATE 格式：
                                     # 1. UTC 時間格式：EXDATE:20251113T020000Z
@@ -314,15 +411,15 @@ class GoogleCalendarClient:
 
                                     if exdate_dt.tzinfo:
                                         # 轉換為 UTC 並格式化
-                                        exdate_utc = exdate_dt.astimezone(dt_timezone.utc)
+                                        exdate_utc = exdate_dt.astimezone(timezone.utc)
                                         exdate_str = exdate_utc.strftime('%Y%m%dT%H%M%SZ')
                                         google_event['recurrence'].append(f'EXDATE:{exdate_str}')
-                                        logger.info(f"Added EXDATE (UTC): {exdate_str} (original: {exdate_dt})")
+                                        logger.debug(f"Added EXDATE (UTC): {exdate_str} (original: {exdate_dt})")
                                     else:
                                         # 無時區，使用本地時間格式
                                         exdate_str = exdate_dt.strftime('%Y%m%dT%H%M%S')
                                         google_event['recurrence'].append(f'EXDATE:{exdate_str}')
-                                        logger.info(f"Added EXDATE (local): {exdate_str}")
+                                        logger.debug(f"Added EXDATE (local): {exdate_str}")
                                 elif isinstance(exdate_dt, date):
                                     # 只有日期的 EXDATE（全天事件）
                                     exdate_str = exdate_dt.strftime('%Y%m%d')
@@ -352,6 +449,7 @@ class GoogleCalendarClient:
         google_event['extendedProperties'] = {
             'private': {
                 'originalUID': event_data.uid,
+                'syncUniqueID': event_data.get_unique_event_id(),
                 'originalSequence': str(event_data.sequence),
                 'syncFingerprint': event_data.fingerprint
             }
@@ -359,51 +457,6 @@ class GoogleCalendarClient:
         
         return google_event
     
-    def _get_valid_timezone(self, dt: datetime) -> str:
-        """取得有效的 IANA 時區名稱"""
-        if not dt or not dt.tzinfo:
-            return 'UTC'
-
-        # 如果是 ZoneInfo，直接使用 key
-        if hasattr(dt.tzinfo, 'key'):
-            return dt.tzinfo.key
-
-        # 如果 tzinfo 的字串表示包含 "Customized Time Zone"
-        # 或其他無效的時區名稱，使用 UTC offset 來判斷
-        tz_str = str(dt.tzinfo)
-
-        # 檢查是否為 UTC
-        if 'UTC' in tz_str or tz_str == 'timezone.utc':
-            return 'UTC'
-
-        # 對於 Outlook 的自定義時區，根據 offset 映射到標準時區
-        utc_offset = dt.utcoffset()
-        if utc_offset:
-            total_seconds = int(utc_offset.total_seconds())
-
-            # UTC+8 (台北時間)
-            if total_seconds == 28800:
-                return 'Asia/Taipei'
-            # UTC+9 (東京時間)
-            elif total_seconds == 32400:
-                return 'Asia/Tokyo'
-            # UTC+0 (UTC)
-            elif total_seconds == 0:
-                return 'UTC'
-            # 其他常見時區...
-            else:
-                # 如果無法映射，返回 UTC offset 格式 (RFC3339)
-                # Google Calendar 接受這種格式
-                hours = total_seconds // 3600
-                minutes = abs(total_seconds % 3600) // 60
-                if minutes:
-                    return f'Etc/GMT{-hours:+d}:{minutes:02d}'
-                else:
-                    return f'Etc/GMT{-hours:+d}'
-
-        # 預設返回 UTC
-        return 'UTC'
-
     def _convert_status(self, ics_status: str) -> str:
         """轉換事件狀態"""
         status_map = {
@@ -445,6 +498,79 @@ class GoogleCalendarClient:
             logger.error(f"Failed to find events by UID {original_uid}: {e}")
             return []
 
+    def list_managed_events_page(self, page_token: Optional[str] = None,
+                                 fields: str = MANAGED_EVENT_FIELDS,
+                                 calendar_id: str = None,
+                                 time_min: Optional[datetime] = None,
+                                 time_max: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        列出一頁由本工具建立的事件（帶有 originalUID 私有屬性），只讀取指定欄位
+        週期事件只返回主事件本身；time_min/time_max 限定與該時段重疊的事件，返回 (事件列表, 下一頁 token)
+        """
+        if not self.service:
+            self.authenticate()
+
+        calendar_id = calendar_id or self.config.calendar_id
+
+        time_range = {}
+        if time_min is not None:
+            time_range['timeMin'] = time_min.isoformat()
+        if time_max is not None:
+            time_range['timeMax'] = time_max.isoformat()
+
+        try:
+            result = self.service.events().list(
+                calendarId=calendar_id,
+                pageToken=page_token,
+                maxResults=2500,
+                singleEvents=False,
+                showDeleted=False,
+                fields=f'nextPageToken,items({fields})',
+                **time_range
+            ).execute()
+        except HttpError as e:
+            logger.error(f"Failed to list managed events: {e}")
+            raise
+
+        items = [
+            item for item in result.get('items', [])
+            if item.get('extendedProperties', {}).get('private', {}).get('originalUID')
+        ]
+        return items, result.get('nextPageToken')
+
+    def list_managed_events(self, fields: str = MANAGED_EVENT_FIELDS, calendar_id: str = None,
+                            time_min: Optional[datetime] = None,
+                            time_max: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        """逐頁列出由本工具建立的事件（可限定時段）"""
+        page_token = None
+        while True:
+            items, page_token = self.list_managed_events_page(page_token, fields, calendar_id,
+                                                              time_min, time_max)
+            yield from items
+            if not page_token:
+                break
+
+    def find_events_by_unique_id(self, unique_id: str,
+                                 calendar_id: str = None) -> List[Dict[str, Any]]:
+        """根據同步唯一 ID（區分修改過的週期實例）尋找事件"""
+        if not self.service:
+            self.authenticate()
+
+        calendar_id = calendar_id or self.config.calendar_id
+
+        try:
+            events_result = self.service.events().list(
+                calendarId=calendar_id,
+                privateExtendedProperty=f'syncUniqueID={unique_id}',
+                maxResults=10
+            ).execute()
+
+            return events_result.get('items', [])
+
+        except HttpError as e:
+            logger.error(f"Failed to find events by unique ID {unique_id}: {e}")
+            return []
+
     def find_recurring_instances(self, recurring_event_id: str,
                                 start_time: datetime, end_time: datetime,
                                 calendar_id: str = None) -> List[Dict[str, Any]]:
@@ -473,116 +599,107 @@ class GoogleCalendarClient:
             logger.error(f"Failed to get recurring event instances: {e}")
             return []
     
-    def _fix_rrule_for_google(self, rrule_str: str) -> Optional[str]:
-        """修正 RRULE 格式以符合 Google Calendar 要求"""
-        if not rrule_str:
-            return None
-        
-        try:
-            # 處理 icalendar vRecur 物件
-            if 'vRecur(' in str(rrule_str):
-                # 這是 vRecur 物件，需要轉換為標準格式
-                return self._convert_vrecur_to_rrule(rrule_str)
-            
-            # 移除常見的問題格式
-            rrule_str = rrule_str.strip()
-            
-            # 檢查是否包含 Google Calendar 不支援的規則
-            unsupported_patterns = [
-                'BYSETPOS',  # Google Calendar 不完全支援
-                'RSCALE',    # 非標準屬性
-                'SKIP',      # 非標準屬性
-            ]
-            
-            for pattern in unsupported_patterns:
-                if pattern in rrule_str.upper():
-                    logger.warning(f"RRULE contains unsupported pattern {pattern}, skipping recurrence")
-                    return None
-            
-            # 基本驗證 - 確保包含必要的 FREQ
-            if 'FREQ=' not in rrule_str.upper():
-                logger.warning(f"Invalid RRULE format (no FREQ): {rrule_str}")
-                return None
-            
-            # 限制過於複雜的規則
-            if rrule_str.count(';') > 10:  # 過於複雜的規則
-                logger.warning(f"RRULE too complex, skipping: {rrule_str}")
-                return None
-            
-            return rrule_str
-            
-        except Exception as e:
-            logger.warning(f"Error processing RRULE: {e}")
-            return None
-    
-    def _convert_vrecur_to_rrule(self, vrecur_obj) -> Optional[str]:
-        """將 vRecur 物件轉換為標準 RRULE 字串"""
+    @staticmethod
+    def instance_event_id(master_event_id: str, original_start, all_day: bool) -> str:
+        """
+        推算週期事件單一實例的 Google 事件 ID：
+        {主事件 ID}_{原始開始時間 UTC，YYYYMMDDTHHMMSSZ}，全天事件為 {主事件 ID}_{YYYYMMDD}
+        """
+        if all_day or not isinstance(original_start, datetime):
+            day = original_start.date() if isinstance(original_start, datetime) else original_start
+            return f"{master_event_id}_{day.strftime('%Y%m%d')}"
+        return f"{master_event_id}_{original_start.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+    def patch_instance(self, master_event_id: str, event_data: EventData,
+                       original_start, calendar_id: str = None) -> Dict[str, Any]:
+        """
+        修改週期事件的單一實例（RECURRENCE-ID 例外），主事件不變
+        先以推算的實例 ID 修改，找不到時再列出原始日期附近的實例比對
+        """
+        if not self.service:
+            self.authenticate()
+
+        calendar_id = calendar_id or self.config.calendar_id
+        body = self._convert_to_google_event(event_data)
+        instance_id = self.instance_event_id(master_event_id, original_start, event_data.all_day)
+
         try:
-            # 如果是字串形式的 vRecur，解析它
-            if isinstance(vrecur_obj, str) and 'vRecur(' in vrecur_obj:
-                # 嘗試從字串中提取資訊
-                import re
-                
-                # 提取 FREQ
-                freq_match = re.search(r"'FREQ':\s*\['(\w+)'\]", str(vrecur_obj))
-                if not freq_match:
-                    return None
-                
-                freq = freq_match.group(1)
-                rrule_parts = [f"FREQ={freq}"]
-                
-                # 提取 INTERVAL
-                interval_match = re.search(r"'INTERVAL':\s*\[(\d+)\]", str(vrecur_obj))
-                if interval_match:
-                    rrule_parts.append(f"INTERVAL={interval_match.group(1)}")
-                
-                # 提取 BYDAY
-                byday_match = re.search(r"'BYDAY':\s*\['(\w+)'\]", str(vrecur_obj))
-                if byday_match:
-                    rrule_parts.append(f"BYDAY={byday_match.group(1)}")
-                
-                # 提取 BYMONTHDAY
-                monthday_match = re.search(r"'BYMONTHDAY':\s*\[(\d+)\]", str(vrecur_obj))
-                if monthday_match:
-                    rrule_parts.append(f"BYMONTHDAY={monthday_match.group(1)}")
-                
-                # 提取 UNTIL（需要格式化日期）
-                until_match = re.search(r"'UNTIL':\s*\[datetime\.datetime\(([^)]+)\)\]", str(vrecur_obj))
-                if until_match:
-                    try:
-                        # 解析 datetime 參數
-                        datetime_args = until_match.group(1)
-                        # 嘗試提取年、月、日、時、分
-                        parts = [part.strip() for part in datetime_args.split(',')]
-                        
-                        if len(parts) >= 5:  # 至少有年月日時分
-                            year = int(parts[0])
-                            month = int(parts[1])
-                            day = int(parts[2])
-                            hour = int(parts[3])
-                            minute = int(parts[4])
-                            
-                            # 格式化為 Google Calendar 接受的 UTC 時間格式
-                            until_str = f"{year:04d}{month:02d}{day:02d}T{hour:02d}{minute:02d}00Z"
-                            rrule_parts.append(f"UNTIL={until_str}")
-                            logger.debug(f"Added UNTIL to RRULE: {until_str}")
-                        else:
-                            logger.warning("Could not parse UNTIL datetime, skipping")
-                    except Exception as e:
-                        logger.warning(f"Error parsing UNTIL date: {e}, skipping")
-                
-                if len(rrule_parts) > 1:  # 至少有 FREQ 和其他參數
-                    return ";".join(rrule_parts)
-                else:
-                    return f"FREQ={freq}"  # 只有基本頻率
-            
-            # 如果有 to_ical 方法，使用它
-            elif hasattr(vrecur_obj, 'to_ical'):
-                return vrecur_obj.to_ical().decode('utf-8')
-            
-            # 其他情況，返回 None
-            return None
-            
-        except Exception as e:
-            logger.warning(f"Failed to convert vRecur to RRULE: {e}")
-            return None
\ No newline at end of file
+            patched = self.service.events().patch(
+                calendarId=calendar_id, eventId=instance_id, body=body
+            ).execute()
+        except HttpError as e:
+            if e.resp.status != 404:
+                logger.error(f"Failed to patch instance {instance_id}: {e}")
+                raise
+            instance_id = self._find_instance_id(master_event_id, original_start, calendar_id)
+            if instance_id is None:
+                raise
+            patched = self.service.events().patch(
+                calendarId=calendar_id, eventId=instance_id, body=body
+            ).execute()
+
+        logger.info(f"Patched instance: {patched.get('id')} - {event_data.summary}")
+        return patched
+
+    def _find_instance_id(self, master_event_id: str, original_start,
+                          calendar_id: str) -> Optional[str]:
+        """
+        列出原始日期前後一天的實例，找出原始開始時間（以 UTC 比較）完全相符者
+        沒有相符的實例時返回 None，不以日期猜測（同一天可能有多個實例）
+        """
+        if isinstance(original_start, datetime):
+            target = original_start.astimezone(timezone.utc)
+            window_start = target - timedelta(days=1)
+        else:
+            target = original_start
+            window_start = datetime.combine(original_start, datetime.min.time(), timezone.utc) - timedelta(days=1)
+        instances = self.find_recurring_instances(
+            master_event_id, window_start, window_start + timedelta(days=3), calendar_id
+        )
+        for instance in instances:
+            original = instance.get('originalStartTime', {})
+            if isinstance(target, datetime):
+                if 'dateTime' not in original:
+                    continue
+                instance_start = datetime.fromisoformat(original['dateTime'].replace('Z', '+00:00'))
+                if instance_start.astimezone(timezone.utc) == target:
+                    return instance['id']
+            elif original.get('date') == target.isoformat():
+                return instance['id']
+        return None
+
+    def reset_instance(self, master_event_id: str, instance_event_id: str,
+                       calendar_id: str = None) -> None:
+        """將修改過的實例還原為主事件的內容與原始時間（來源移除例外時使用）"""
+        if not self.service:
+            self.authenticate()
+
+        calendar_id = calendar_id or self.config.calendar_id
+        events = self.service.events()
+        master = events.get(calendarId=calendar_id, eventId=master_event_id).execute()
+        instance = events.get(calendarId=calendar_id, eventId=instance_event_id).execute()
+
+        original = instance['originalStartTime']
+        if 'date' in original:
+            start_day = date.fromisoformat(original['date'])
+            length = date.fromisoformat(master['end']['date']) - date.fromisoformat(master['start']['date'])
+            start = {'date': start_day.isoformat()}
+            end = {'date': (start_day + length).isoformat()}
+        else:
+            start_at = datetime.fromisoformat(original['dateTime'].replace('Z', '+00:00'))
+            length = (datetime.fromisoformat(master['end']['dateTime'].replace('Z', '+00:00')) -
+                      datetime.fromisoformat(master['start']['dateTime'].replace('Z', '+00:00')))
+            time_zone = master['start'].get('timeZone', 'UTC')
+            start = {'dateTime': start_at.isoformat(), 'timeZone': time_zone}
+            end = {'dateTime': (start_at + length).isoformat(), 'timeZone': time_zone}
+
+        events.patch(calendarId=calendar_id, eventId=instance_event_id, body={
+            'summary': master.get('summary', ''),
+            'description': master.get('description', ''),
+            'location': master.get('location', ''),
+            'status': master.get('status', 'confirmed'),
+            'start': start,
+            'end': end,
+            'extendedProperties': master.get('extendedProperties', {})
+        }).execute()
+        logger.info(f"Reset instance {instance_event_id} to its series")
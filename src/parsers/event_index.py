@@ -0,0 +1,130 @@
+"""
+事件時間索引
+將整份行事曆降為 UTC epoch 陣列（開始、結束、旗標），同步窗口篩選、過期判斷與重疊查詢
+以整批向量運算完成，不再逐一比較有時區的 datetime。
+有安裝 NumPy 時使用 NumPy；未安裝時退回標準函式庫 array 與迴圈，結果相同。
+NumPy 為選用相依（不在 requirements.txt 中），另外執行 pip install numpy 即可啟用
+"""
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, TYPE_CHECKING
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 為選用相依
+    np = None
+
+if TYPE_CHECKING:
+    from src.parsers.ics_parser import EventData
+
+
+# 缺少開始時間與無界系列結束時間的哨兵值
+MISSING_EPOCH = -(2 ** 62)
+UNBOUNDED_EPOCH = 2 ** 62
+
+# 旗標位元
+FLAG_ALL_DAY = 1
+FLAG_RECURRING = 2   # 週期系列：結束時間為最後一次發生的結束時間
+FLAG_MISSING = 4     # 無法取得開始時間，任何窗口都不包含
+
+
+class EpochIndex:
+    """
+    以平行陣列保存的事件時間範圍，索引與建立時的事件順序相同
+    查詢方法返回符合條件的索引列表
+    """
+
+    def __init__(self, starts: Sequence[Optional[int]], ends: Sequence[Optional[int]],
+                 flags: Sequence[int]):
+        flag_values = array('q', flags)
+        start_values = array('q')
+        end_values = array('q')
+        for position, (start, end) in enumerate(zip(starts, ends)):
+            if start is None:
+                flag_values[position] |= FLAG_MISSING
+                start = MISSING_EPOCH
+            if end is None:
+                # 週期系列結束時間未知表示無界；單次事件缺少結束時間時以開始時間計
+                end = UNBOUNDED_EPOCH if flag_values[position] & FLAG_RECURRING else start
+            start_values.append(start)
+            end_values.append(end)
+
+        if np is not None:
+            self.starts = np.frombuffer(start_values, dtype=np.int64)
+            self.ends = np.frombuffer(end_values, dtype=np.int64)
+            self.flags = np.frombuffer(flag_values, dtype=np.int64)
+        else:
+            self.starts, self.ends, self.flags = start_values, end_values, flag_values
+
+    @classmethod
+    def from_events(cls, events: Iterable['EventData']) -> 'EpochIndex':
+        """由解析後的事件建立索引（週期事件需先設定 series_end_epoch）"""
+        starts, ends, flags = [], [], []
+        for event in events:
+            start_epoch, end_epoch = event.get_epoch_range()
+            starts.append(start_epoch)
+            ends.append(end_epoch)
+            flags.append((FLAG_ALL_DAY if event.all_day else 0) |
+                         (FLAG_RECURRING if event.is_recurring() else 0))
+        return cls(starts, ends, flags)
+
+    @classmethod
+    def from_snapshots(cls, snapshots: Iterable[Dict[str, Any]]) -> 'EpochIndex':
+        """由事件快照建立索引（有 series_uid 的快照視為週期系列）"""
+        starts, ends, flags = [], [], []
+        for snapshot in snapshots:
+            starts.append(snapshot.get('start_epoch'))
+            ends.append(snapshot.get('end_epoch'))
+            flags.append(FLAG_RECURRING if snapshot.get('series_uid') else 0)
+        return cls(starts, ends, flags)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def in_window(self, window_start: int, window_end: int) -> List[int]:
+        """
+        同步窗口篩選：單次事件看開始時間是否在窗口內，
+        週期系列看是否在窗口結束前開始、且最後一次發生不早於窗口開始
+        """
+        if np is not None:
+            valid = (self.flags & FLAG_MISSING) == 0
+            recurring = (self.flags & FLAG_RECURRING) != 0
+            starts_before_end = self.starts <= window_end
+            mask = valid & starts_before_end & np.where(
+                recurring, self.ends >= window_start, self.starts >= window_start
+            )
+            return np.flatnonzero(mask).tolist()
+
+        return [
+            position for position, (start, end, flags) in enumerate(zip(self.starts, self.ends, self.flags))
+            if not flags & FLAG_MISSING and start <= window_end and
+            (end if flags & FLAG_RECURRING else start) >= window_start
+        ]
+
+    def overlapping(self, range_start: int, range_end: int) -> List[int]:
+        """與時間範圍有交集的事件（開始不晚於範圍結束，結束不早於範圍開始）"""
+        if np is not None:
+            mask = (((self.flags & FLAG_MISSING) == 0) &
+                    (self.starts <= range_end) & (self.ends >= range_start))
+            return np.flatnonzero(mask).tolist()
+
+        return [
+            position for position, (start, end, flags) in enumerate(zip(self.starts, self.ends, self.flags))
+            if not flags & FLAG_MISSING and start <= range_end and end >= range_start
+        ]
+
+    def expired(self, cutoff_epoch: int) -> List[int]:
+        """
+        已滑出同步窗口的事件（與 StateStore._is_expired 相同的規則）：
+        開始時間早於截止時間，週期系列還需最後一次發生也早於截止時間
+        """
+        if np is not None:
+            recurring = (self.flags & FLAG_RECURRING) != 0
+            mask = (((self.flags & FLAG_MISSING) == 0) & (self.starts < cutoff_epoch) &
+                    (~recurring | (self.ends < cutoff_epoch)))
+            return np.flatnonzero(mask).tolist()
+
+        return [
+            position for position, (start, end, flags) in enumerate(zip(self.starts, self.ends, self.flags))
+            if not flags & FLAG_MISSING and start < cutoff_epoch and
+            (not flags & FLAG_RECURRING or end < cutoff_epoch)
+        ]
@@ -4,24 +4,34 @@ ICS 精準解析器
 """
 import hashlib
 import logging
-from datetime import datetime, timedelta, date
-from typing import List, Dict, Optional, Tuple, Any
+from datetime import datetime, timedelta
+from typing import List, Dict, Iterator, Optional, Set, Tuple, Any, TYPE_CHECKING
 from zoneinfo import ZoneInfo
 import requests
 from icalendar import Calendar, Event as ICalEvent
-from dateutil.rrule import rrulestr
-import recurring_ical_events
 
+from src.parsers.event_index import EpochIndex
+from src.parsers.recurrence import (
+    Occurrence, RecurrenceExpander, serialize_date_values, series_cache_key, series_end_epoch
+)
+from src.parsers.timezones import TimezoneResolver
 from src.utils.config import SourceConfig, ProcessingConfig
 
+if TYPE_CHECKING:
+    from src.storage.state_store import StateStore
+
 
 logger = logging.getLogger(__name__)
 
+# 串流解析時整批篩選的事件數
+WINDOW_CHUNK_SIZE = 1024
+
 
 class EventData:
     """事件資料結構"""
     
-    def __init__(self, vevent: ICalEvent, processing_config: ProcessingConfig):
+    def __init__(self, vevent: ICalEvent, processing_config: ProcessingConfig,
+                 timezones: Optional[TimezoneResolver] = None):
         self.uid = str(vevent.get('UID', ''))
         self.sequence = int(vevent.get('SEQUENCE', 0))
         self.last_modified = vevent.get('LAST-MODIFIED')
@@ -39,9 +49,11 @@ class EventData:
         self.dtend = vevent.get('DTEND')
         self.duration = vevent.get('DURATION')
         self.all_day = False
+        self.timezone = processing_config.timezone
+        self._time_epochs: Optional[Tuple[Optional[int], Optional[int]]] = None
         
         # 處理時間資訊
-        self._process_time_info()
+        self._process_time_info(timezones)
         
         # 週期規則
         self.rrule = vevent.get('RRULE')
@@ -49,6 +61,8 @@ class EventData:
         self.exdate = vevent.get('EXDATE')
         self.exrule = vevent.get('EXRULE')
         self.recurrence_id = vevent.get('RECURRENCE-ID')
+        # 週期系列最後一次發生的結束時間（UTC epoch），由解析器計算，None 表示無界或未知
+        self.series_end_epoch: Optional[int] = None
         
         # 其他屬性
         self.categories = vevent.get('CATEGORIES')
@@ -61,8 +75,8 @@ class EventData:
         # 計算事件指紋
         self.fingerprint = self._calculate_fingerprint()
         
-    def _process_time_info(self):
-        """處理時間資訊，確保時區正確性"""
+    def _process_time_info(self, timezones: Optional[TimezoneResolver] = None):
+        """處理時間資訊，以 feed 的時區對照表統一為 IANA 時區"""
         if self.dtstart:
             dt_value = self.dtstart.dt
 
@@ -79,12 +93,14 @@ class EventData:
                     # 預設1小時
                     self.end_datetime = self.start_datetime + timedelta(hours=1)
 
-                # 確保時區資訊
-                if self.start_datetime.tzinfo is None:
-                    logger.warning(f"Event {self.uid} has no timezone info, assuming Asia/Taipei")
-                    taipei_tz = ZoneInfo("Asia/Taipei")
-                    self.start_datetime = self.start_datetime.replace(tzinfo=taipei_tz)
-                    self.end_datetime = self.end_datetime.replace(tzinfo=taipei_tz)
+                # 統一為 IANA 時區；浮動時間使用 feed 宣告或設定的時區
+                if timezones is not None:
+                    self.start_datetime = timezones.localize(self.start_datetime)
+                    self.end_datetime = timezones.localize(self.end_datetime)
+                elif self.start_datetime.tzinfo is None:
+                    local_tz = ZoneInfo(self.timezone)
+                    self.start_datetime = self.start_datetime.replace(tzinfo=local_tz)
+                    self.end_datetime = self.end_datetime.replace(tzinfo=local_tz)
             else:
                 # 全天事件（date 物件）
                 self.all_day = True
@@ -139,9 +155,8 @@ class EventData:
 
         # 包含 EXDATE 以偵測週期事件的例外變更
         if self.exdate:
-            # 將 EXDATE 序列化為字串
-            exdate_str = str(self.exdate)
-            content += f"|{exdate_str}"
+            # 排序後的 ISO 字串，與屬性物件的記憶體位址無關
+            content += f"|{serialize_date_values(self.exdate)}"
 
         # 如果是週期事件的特定實例，添加實例標識
         if self.recurrence_id:
@@ -180,6 +195,26 @@ class EventData:
         """判斷是否為修改的週期實例"""
         return self.recurrence_id is not None
     
+    def get_epoch_range(self) -> Tuple[Optional[int], Optional[int]]:
+        """取得事件的 UTC epoch 時間範圍，週期事件系列的結束時間未知時為 None"""
+        if self._time_epochs is None:
+            # 開始/結束時間解析後不再變動，轉換結果供時間索引、排程與快照共用
+            self._time_epochs = (self._to_epoch(self.start_datetime), self._to_epoch(self.end_datetime))
+        start_epoch, end_epoch = self._time_epochs
+        if self.is_recurring():
+            return start_epoch, self.series_end_epoch
+        return start_epoch, end_epoch
+    
+    def _to_epoch(self, value) -> Optional[int]:
+        """將 date/datetime 轉換為 UTC epoch 秒數，全天事件以設定時區的午夜計算"""
+        if value is None:
+            return None
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, datetime.min.time())
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=ZoneInfo(self.timezone))
+        return int(value.timestamp())
+    
     def to_dict(self) -> Dict[str, Any]:
         """轉換為字典格式"""
         # 序列化 EXDATE
@@ -230,11 +265,23 @@ class EventData:
 class ICSParser:
     """ICS 精準解析器"""
     
-    def __init__(self, source_config: SourceConfig, processing_config: ProcessingConfig):
+    def __init__(self, source_config: SourceConfig, processing_config: ProcessingConfig,
+                 session: Optional[requests.Session] = None,
+                 state_store: Optional['StateStore'] = None):
         self.source_config = source_config
         self.processing_config = processing_config
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': source_config.user_agent})
+        # 多租戶模式下共用同一個連線池
+        self.session = session or requests.Session()
+        # 週期系列結束時間的持久化快取（可選），以系列規則的雜湊為鍵
+        self.state_store = state_store
+        self._series_ends: Optional[Dict[str, Optional[int]]] = None
+        self._marked_series: Set[str] = set()
+        # 最近一次解析中已結束而未產出的系列 {UID: 結束 epoch}
+        self.ended_series: Dict[str, int] = {}
+        # 週期系列的實例展開（跨同步週期快取）
+        self.expander = RecurrenceExpander()
+        # feed 的 VTIMEZONE 對照表（定義的解析結果持久化快取）
+        self.timezones = TimezoneResolver(processing_config.timezone, state_store)
     
     def fetch_ics_content(self) -> str:
         """從 URL 獲取 ICS 內容"""
@@ -244,6 +291,7 @@ class ICSParser:
             try:
                 response = self.session.get(
                     self.source_config.url,
+                    headers={'User-Agent': self.source_config.user_agent},
                     timeout=self.source_config.timeout
                 )
                 response.raise_for_status()
@@ -271,13 +319,14 @@ class ICSParser:
             logger.error(f"Failed to parse ICS content: {e}")
             raise
         
+        self.timezones.load_calendar(calendar)
         main_events = []
         modified_instances = []
         
         for component in calendar.walk():
             if component.name == "VEVENT":
                 try:
-                    event_data = EventData(component, self.processing_config)
+                    event_data = EventData(component, self.processing_config, self.timezones)
                     
                     if event_data.is_modified_instance():
                         modified_instances.append(event_data)
@@ -292,62 +341,16 @@ class ICSParser:
         return main_events, modified_instances
     
     def expand_recurring_events(self, events: List[EventData], 
-                              start_date: datetime, end_date: datetime) -> List[EventData]:
+                              start_date: datetime, end_date: datetime) -> List[Occurrence]:
         """
-        展開週期事件到指定時間範圍
-        這個方法會處理複雜的週期規則和例外情況
+        展開事件到指定時間範圍內的實例（輕量的 Occurrence 紀錄，依開始時間排序）
+        週期系列的展開結果會被快取，窗口向後滑動時只展開新增的部分
         """
         logger.info(f"Expanding recurring events from {start_date} to {end_date}")
-        
-        expanded_events = []
-        
-        for event in events:
-            if not event.is_recurring():
-                # 非週期事件，直接檢查是否在範圍內
-                if (event.start_datetime >= start_date and event.start_datetime <= end_date):
-                    expanded_events.append(event)
-            else:
-                # 週期事件，使用 recurring-ical-events 套件展開
-                try:
-                    # 重新建立 iCalendar 事件物件
-                    cal = Calendar()
-                    vevent = ICalEvent()
-                    
-                    # 設定必要屬性
-                    vevent.add('uid', event.uid)
-                    vevent.add('dtstart', event.start_datetime)
-                    vevent.add('dtend', event.end_datetime)
-                    vevent.add('summary', event.summary)
-                    vevent.add('description', event.description)
-                    vevent.add('location', event.location)
-                    
-                    if event.rrule:
-                        vevent.add('rrule', event.rrule)
-                    if event.exdate:
-                        vevent.add('exdate', event.exdate)
-                    
-                    cal.add_component(vevent)
-                    
-                    # 使用 recurring_ical_events 展開
-                    occurrences = recurring_ical_events.of(cal).between(start_date, end_date)
-                    
-                    for occurrence in occurrences:
-                        # 為每個實例創建新的 EventData
-                        instance_event = EventData(vevent, self.processing_config)
-                        instance_event.start_datetime = occurrence['DTSTART'].dt
-                        instance_event.end_datetime = occurrence['DTEND'].dt
-                        # 重新計算指紋
-                        instance_event.fingerprint = instance_event._calculate_fingerprint()
-                        expanded_events.append(instance_event)
-                        
-                except Exception as e:
-                    logger.warning(f"Failed to expand recurring event {event.uid}: {e}")
-                    # 如果展開失敗，至少添加原始事件
-                    if (event.start_datetime >= start_date and event.start_datetime <= end_date):
-                        expanded_events.append(event)
-        
-        logger.info(f"Expanded to {len(expanded_events)} event instances")
-        return expanded_events
+        occurrences = self.expander.expand_all(events, start_date, end_date)
+        occurrences.sort(key=lambda occurrence: occurrence.start_epoch)
+        logger.info(f"Expanded to {len(occurrences)} event instances")
+        return occurrences
     
     def parse_and_expand(self, start_date: datetime, end_date: datetime) -> Tuple[List[EventData], List[EventData]]:
         """
@@ -355,10 +358,107 @@ class ICSParser:
         對於週期事件：不展開，保持原始事件以避免重複建立
         返回: (所有事件列表, 修改實例列表)
         """
-        ics_content = self.fetch_ics_content()
-        main_events, modified_instances = self.parse_ics_content(ics_content)
+        filtered_events = list(self.iter_events(start_date, end_date))
+        filtered_modified_instances = [
+            event for event in filtered_events if event.is_modified_instance()
+        ]
+
+        logger.info(f"Filtered to {len(filtered_events)} events (recurring events not expanded)")
+        logger.info(f"Including {len(filtered_modified_instances)} modified recurring instances")
+        return filtered_events, filtered_modified_instances
+
+    def iter_events(self, start_date: datetime, end_date: datetime,
+                    ics_content: Optional[str] = None) -> Iterator[EventData]:
+        """
+        串流解析：逐一產出在時間範圍內的事件
+        單次事件與修改實例每解析 WINDOW_CHUNK_SIZE 個即以 epoch 索引整批篩選後產出；
+        週期事件需等所有修改實例解析完成、補上 EXDATE 後才整批篩選產出
+        """
+        if ics_content is None:
+            ics_content = self.fetch_ics_content()
+
+        logger.info("Parsing ICS content")
+        try:
+            calendar = Calendar.from_ical(ics_content)
+        except Exception as e:
+            logger.error(f"Failed to parse ICS content: {e}")
+            raise
+
+        self.timezones.load_calendar(calendar)
+        window_start, window_end = int(start_date.timestamp()), int(end_date.timestamp())
+        main_events = []
+        modified_instances = []
+        pending: List[EventData] = []
+        self.ended_series = {}
+
+        for component in calendar.walk('VEVENT'):
+            try:
+                event = EventData(component, self.processing_config, self.timezones)
+            except Exception as e:
+                logger.warning(f"Failed to parse event {component.get('UID', 'unknown')}: {e}")
+                continue
+
+            if event.is_modified_instance():
+                modified_instances.append(event)
+                # 修改實例作為獨立的單次事件（不是週期事件）
+                event.rrule = None
+                event.rdate = None
+                pending.append(event)
+            elif event.is_recurring():
+                main_events.append(event)
+            else:
+                main_events.append(event)
+                pending.append(event)
+
+            if len(pending) >= WINDOW_CHUNK_SIZE:
+                yield from self._filter_window(pending, window_start, window_end)
+                pending = []
+
+        yield from self._filter_window(pending, window_start, window_end)
+
+        logger.info(f"Parsed {len(main_events)} main events and {len(modified_instances)} modified instances")
+
+        # 週期事件：將修改實例的日期加入 EXDATE 後產出
+        # instance 模式下修改實例直接修改 Google 端的對應實例，主事件不需排除
+        if self.processing_config.exception_mode == "instance":
+            modified_instances_map = {}
+        else:
+            modified_instances_map = self._build_modified_instance_exdates(main_events, modified_instances)
 
-        # 為週期事件建立修改實例的映射（用於添加 EXDATE）
+        recurring_events = [event for event in main_events if event.is_recurring()]
+        for event in recurring_events:
+            if event.uid in modified_instances_map:
+                # 將修改實例的日期加入 EXDATE
+                if event.exdate is None:
+                    event.exdate = modified_instances_map[event.uid]
+                else:
+                    # 如果已有 EXDATE，合併
+                    existing_exdates = event.exdate if isinstance(event.exdate, list) else [event.exdate]
+                    event.exdate = existing_exdates + modified_instances_map[event.uid]
+                # 修改實例需要在 Google 端排除，EXDATE 變更也要反映在指紋上
+                event.fingerprint = event._calculate_fingerprint()
+                logger.info(f"Added {len(modified_instances_map[event.uid])} EXDATE(s) to recurring event {event.uid}")
+
+            event.series_end_epoch = self._get_series_end(event)
+
+        # 週期事件：與範圍有交集者產出，已結束者記錄結束時間
+        in_window = set(EpochIndex.from_events(recurring_events).in_window(window_start, window_end))
+        for position, event in enumerate(recurring_events):
+            if position in in_window:
+                yield event
+            elif event.series_end_epoch is not None:
+                self._mark_series_ended(event)
+
+    @staticmethod
+    def _filter_window(events: List[EventData], window_start: int, window_end: int) -> List[EventData]:
+        """以 epoch 索引整批篩選開始時間在窗口內的事件"""
+        if not events:
+            return []
+        return [events[position] for position in EpochIndex.from_events(events).in_window(window_start, window_end)]
+
+    def _build_modified_instance_exdates(self, main_events: List[EventData],
+                                         modified_instances: List[EventData]) -> Dict[str, list]:
+        """為週期事件建立修改實例的 EXDATE 映射"""
         # 同時建立原始事件的時間映射
         main_events_map = {event.uid: event for event in main_events}
         modified_instances_map = {}
@@ -407,73 +507,31 @@ class ICSParser:
                     # 找不到原始事件，保持 RECURRENCE-ID 原樣
                     modified_instances_map[instance.uid].append(instance.recurrence_id)
 
-        # 篩選在時間範圍內的事件
-        filtered_events = []
+        return modified_instances_map
 
-        for event in main_events:
-            if not event.is_recurring():
-                # 非週期事件，檢查是否在範圍內
-                if self._is_event_in_range(event, start_date, end_date):
-                    filtered_events.append(event)
-            else:
-                # 週期事件：檢查是否有修改實例需要排除
-                if event.uid in modified_instances_map:
-                    # 將修改實例的日期加入 EXDATE
-                    if event.exdate is None:
-                        event.exdate = modified_instances_map[event.uid]
-                    else:
-                        # 如果已有 EXDATE，合併
-                        existing_exdates = event.exdate if isinstance(event.exdate, list) else [event.exdate]
-                        event.exdate = existing_exdates + modified_instances_map[event.uid]
-                    logger.info(f"Added {len(modified_instances_map[event.uid])} EXDATE(s) to recurring event {event.uid}")
-
-                # 檢查週期事件是否與範圍有交集
-                if self._recurring_event_overlaps_range(event, start_date, end_date):
-                    filtered_events.append(event)
-
-        # 處理修改實例
-        filtered_modified_instances = []
-        if modified_instances:
-            logger.info(f"Adding {len(modified_instances)} modified instances")
-            # 修改實例作為獨立的單次事件（不是週期事件）
-            for instance in modified_instances:
-                if self._is_event_in_range(instance, start_date, end_date):
-                    # 確保修改實例沒有週期規則（應該是單次事件）
-                    instance.rrule = None
-                    instance.rdate = None
-                    filtered_events.append(instance)
-                    filtered_modified_instances.append(instance)
+    def _get_series_end(self, event: EventData) -> Optional[int]:
+        """取得週期系列的結束時間，先查快取，未命中時計算並寫回"""
+        if self._series_ends is None:
+            self._series_ends = self.state_store.get_recurrence_ends() if self.state_store else {}
 
-        logger.info(f"Filtered to {len(filtered_events)} events (recurring events not expanded)")
-        logger.info(f"Including {len(filtered_modified_instances)} modified recurring instances")
-        return filtered_events, filtered_modified_instances
+        key = series_cache_key(event)
+        if key in self._series_ends:
+            return self._series_ends[key]
 
-    def _is_event_in_range(self, event: EventData, start_date: datetime, end_date: datetime) -> bool:
-        """檢查事件是否在指定範圍內，處理 date 和 datetime 的比較"""
-        event_start = event.start_datetime
+        end_epoch = series_end_epoch(event)
+        self._series_ends[key] = end_epoch
+        if self.state_store is not None:
+            self.state_store.save_recurrence_end(key, end_epoch)
+        return end_epoch
 
-        # 將 date 轉換為 datetime 以便比較
-        if isinstance(event_start, date) and not isinstance(event_start, datetime):
-            # 全天事件使用 date，將其轉為當天開始的 datetime
-            event_start = datetime.combine(event_start, datetime.min.time())
-            # 添加時區資訊以匹配 start_date 和 end_date
-            if start_date.tzinfo:
-                event_start = event_start.replace(tzinfo=start_date.tzinfo)
-
-        return event_start >= start_date and event_start <= end_date
-    
-    def _recurring_event_overlaps_range(self, event: EventData, start_date: datetime, end_date: datetime) -> bool:
-        """檢查週期事件是否與指定範圍有重疊"""
-        # 簡單檢查：如果事件開始時間在範圍前，且有RRULE，假設有重疊
-        if event.start_datetime <= end_date:
-            # 如果有結束規則，檢查是否已結束
-            if event.rrule and 'UNTIL' in str(event.rrule):
-                # 這裡應該解析UNTIL，但暫時簡化處理
-                return True
-            elif event.rrule and 'COUNT' in str(event.rrule):
-                # 這裡應該計算COUNT，但暫時簡化處理
-                return True
-            else:
-                # 無限重複的週期事件
-                return True
-        return False
\ No newline at end of file
+    def _mark_series_ended(self, event: EventData) -> None:
+        """
+        已結束的系列不再產出；舊快照若尚未記錄結束時間，補上後才會被判定為過期而非刪除
+        """
+        unique_id = event.get_unique_event_id()
+        self.ended_series[unique_id] = event.series_end_epoch
+        if self.state_store is None or unique_id in self._marked_series:
+            return
+        self._marked_series.add(unique_id)
+        self.state_store.mark_series_ended(unique_id, event.series_end_epoch)
+        logger.debug(f"Recurring series {event.uid} ended before the sync window")
@@ -0,0 +1,408 @@
+"""
+週期規則計算
+以 dateutil 建立 rruleset（RRULE、RDATE、EXDATE、EXRULE），計算週期系列的最後一次發生時間，
+並提供可快取、可隨窗口滑動增量延伸的實例展開
+"""
+import bisect
+import hashlib
+import logging
+import re
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TYPE_CHECKING
+from zoneinfo import ZoneInfo
+
+from dateutil.rrule import rruleset, rrulestr
+from icalendar import vRecur
+
+from src.parsers.event_index import EpochIndex
+
+if TYPE_CHECKING:
+    from src.parsers.ics_parser import EventData
+
+
+logger = logging.getLogger(__name__)
+
+# 展開有界系列時的安全上限，超過視為無界
+MAX_BOUNDED_OCCURRENCES = 100000
+
+# Google Calendar 接受的 RRULE 頻率與欄位（RFC 5545 的子集）
+GOOGLE_FREQUENCIES = {'DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY'}
+GOOGLE_RULE_PARTS = {
+    'FREQ', 'UNTIL', 'COUNT', 'INTERVAL', 'BYSECOND', 'BYMINUTE', 'BYHOUR', 'BYDAY',
+    'BYMONTHDAY', 'BYYEARDAY', 'BYWEEKNO', 'BYMONTH', 'BYSETPOS', 'WKST'
+}
+_WEEKDAY_PATTERN = re.compile(r'^[+-]?([1-9]|[1-4][0-9]|5[0-3])?(MO|TU|WE|TH|FR|SA|SU)$')
+
+
+def iter_date_values(prop) -> Iterator:
+    """
+    逐一取出 EXDATE/RDATE 屬性中的 date/datetime 值
+    屬性可能是單一 vDDDLists、多行的列表，或已展開的 vDDDTypes 列表；PERIOD 取開始時間
+    """
+    if prop is None:
+        return
+    for item in prop if isinstance(prop, list) else [prop]:
+        values = item.dts if hasattr(item, 'dts') else [item]
+        for value in values:
+            value = value.dt if hasattr(value, 'dt') else value
+            if isinstance(value, tuple):
+                value = value[0]
+            yield value
+
+
+def serialize_date_values(prop) -> str:
+    """將 EXDATE/RDATE 序列化為穩定的字串（排序後的 ISO 格式），用於指紋與快取鍵"""
+    return ','.join(sorted(value.isoformat() for value in iter_date_values(prop)))
+
+
+def _rules(prop) -> List[vRecur]:
+    """RRULE/EXRULE 可能出現多行"""
+    if prop is None:
+        return []
+    return list(prop) if isinstance(prop, list) else [prop]
+
+
+def _until_as_utc(until, local_tz: tzinfo) -> datetime:
+    """有時區系列的 UNTIL 以 UTC 表示；無時區值視為系列時區，日期形式包含當天整天"""
+    if not isinstance(until, datetime):
+        until = datetime.combine(until, time(23, 59, 59))
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=local_tz)
+    return until.astimezone(timezone.utc)
+
+
+def series_cache_key(event: 'EventData') -> str:
+    """以決定系列發生時間的欄位計算快取鍵"""
+    content = '|'.join([
+        ';'.join(rule.to_ical().decode() for rule in _rules(event.rrule)),
+        ';'.join(rule.to_ical().decode() for rule in _rules(event.exrule)),
+        event.start_datetime.isoformat(),
+        event.end_datetime.isoformat() if event.end_datetime else '',
+        serialize_date_values(event.exdate),
+        serialize_date_values(event.rdate)
+    ])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class SeriesRules:
+    """將單一週期事件的規則轉換為 dateutil rruleset，統一 dtstart 與各值的時區型態"""
+
+    def __init__(self, event: 'EventData'):
+        self.event = event
+        start = event.start_datetime
+        if isinstance(start, datetime):
+            self.dtstart = start
+            self.local_tz = start.tzinfo
+        else:
+            # 全天事件：以無時區的午夜展開
+            self.dtstart = datetime.combine(start, time.min)
+            self.local_tz = None
+        self.fallback_tz = ZoneInfo(event.timezone)
+
+    def _normalize(self, value) -> datetime:
+        """將 EXDATE/RDATE 值轉換為與 dtstart 相同的型態"""
+        if not isinstance(value, datetime):
+            # 日期值對應當天與 dtstart 相同的時刻
+            value = datetime.combine(value, self.dtstart.timetz() if self.local_tz else self.dtstart.time())
+        if self.local_tz is None:
+            if value.tzinfo is not None:
+                value = value.astimezone(self.fallback_tz).replace(tzinfo=None)
+            return value
+        if value.tzinfo is None:
+            return value.replace(tzinfo=self.local_tz)
+        return value
+
+    def _rule_string(self, rule: vRecur) -> str:
+        """
+        轉為 RRULE 字串；UNTIL 須與 dtstart 型態一致（有時區時以 UTC 表示），否則 dateutil 會拒絕
+        日期形式的 UNTIL 包含當天整天
+        """
+        rule = vRecur(rule)
+        until_values = rule.get('UNTIL')
+        if until_values:
+            until = until_values[0]
+            if self.local_tz is not None:
+                until = _until_as_utc(until, self.local_tz)
+            else:
+                if not isinstance(until, datetime):
+                    until = datetime.combine(until, time(23, 59, 59))
+                if until.tzinfo is not None:
+                    until = until.astimezone(self.fallback_tz).replace(tzinfo=None)
+            rule['UNTIL'] = [until]
+        return rule.to_ical().decode()
+
+    def to_rule_time(self, value: datetime) -> datetime:
+        """將同步窗口的時間轉換為與 dtstart 相同的型態"""
+        if self.local_tz is None:
+            return value.astimezone(self.fallback_tz).replace(tzinfo=None) if value.tzinfo else value
+        return value if value.tzinfo else value.replace(tzinfo=self.local_tz)
+
+    def to_epoch(self, value: datetime) -> int:
+        """將展開結果轉換為 UTC epoch 秒數（全天事件以設定時區計算）"""
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=self.fallback_tz)
+        return int(value.timestamp())
+
+    def is_bounded(self) -> bool:
+        """所有 RRULE 都有 UNTIL 或 COUNT（或只有 RDATE）時系列才會結束"""
+        return all('UNTIL' in rule or 'COUNT' in rule for rule in _rules(self.event.rrule))
+
+    def build(self) -> rruleset:
+        """建立 rruleset"""
+        ruleset = rruleset()
+        for rule in _rules(self.event.rrule):
+            ruleset.rrule(rrulestr(self._rule_string(rule), dtstart=self.dtstart))
+        for rule in _rules(self.event.exrule):
+            ruleset.exrule(rrulestr(self._rule_string(rule), dtstart=self.dtstart))
+        for value in iter_date_values(self.event.rdate):
+            ruleset.rdate(self._normalize(value))
+        for value in iter_date_values(self.event.exdate):
+            ruleset.exdate(self._normalize(value))
+        return ruleset
+
+    def last_occurrence(self) -> Optional[datetime]:
+        """最後一次發生的開始時間；無界系列返回 None，沒有任何發生時返回 dtstart"""
+        if not self.is_bounded():
+            return None
+        last = None
+        for count, occurrence in enumerate(self.build()):
+            if count >= MAX_BOUNDED_OCCURRENCES:
+                return None
+            last = occurrence
+        return last if last is not None else self.dtstart
+
+
+def google_recurrence_rules(event: 'EventData') -> List[str]:
+    """
+    將事件的 RRULE 轉換為 Google Calendar 的 recurrence 字串（不含 EXDATE）
+    任一規則不被 Google 接受時返回空列表，事件改以單次事件同步
+    """
+    start = event.start_datetime
+    if isinstance(start, datetime):
+        local_tz = start.tzinfo or ZoneInfo(event.timezone)
+    else:
+        local_tz = None
+    fallback_tz = ZoneInfo(event.timezone)
+
+    converted = []
+    for rule in _rules(event.rrule):
+        google_rule = _google_rrule(rule.to_ical().decode(), local_tz, fallback_tz)
+        if google_rule is None:
+            return []
+        converted.append(f'RRULE:{google_rule}')
+    return converted
+
+
+@lru_cache(maxsize=4096)
+def _google_rrule(rule_string: str, local_tz: Optional[tzinfo], fallback_tz: tzinfo) -> Optional[str]:
+    """
+    以 vRecur 的欄位轉換單一 RRULE（依規則字串與時區快取）
+    local_tz 為 None 表示全天事件：UNTIL 以日期表示；否則 UNTIL 以 UTC 表示
+    """
+    try:
+        rule = vRecur(vRecur.from_ical(rule_string))
+    except Exception as e:
+        logger.warning(f"Unparseable RRULE {rule_string!r}: {e}")
+        return None
+
+    for part in list(rule):
+        if part.startswith('X-'):
+            # 非標準擴充欄位不影響發生時間
+            del rule[part]
+        elif part not in GOOGLE_RULE_PARTS:
+            logger.warning(f"RRULE part {part} is not supported by Google Calendar, syncing as a single event: "
+                           f"{rule_string}")
+            return None
+
+    frequencies = rule.get('FREQ', [])
+    if len(frequencies) != 1 or str(frequencies[0]).upper() not in GOOGLE_FREQUENCIES:
+        logger.warning(f"RRULE frequency {frequencies} is not supported by Google Calendar: {rule_string}")
+        return None
+    if 'UNTIL' in rule and 'COUNT' in rule:
+        logger.warning(f"RRULE has both UNTIL and COUNT: {rule_string}")
+        return None
+    if any(int(value) < 1 for part in ('COUNT', 'INTERVAL') for value in rule.get(part, [])):
+        logger.warning(f"RRULE COUNT/INTERVAL must be positive: {rule_string}")
+        return None
+    invalid_days = [day for day in rule.get('BYDAY', []) if not _WEEKDAY_PATTERN.match(str(day).upper())]
+    if invalid_days:
+        logger.warning(f"RRULE has invalid BYDAY values {invalid_days}: {rule_string}")
+        return None
+
+    if rule.get('UNTIL'):
+        until = rule['UNTIL'][0]
+        if local_tz is not None:
+            until = _until_as_utc(until, local_tz)
+        elif isinstance(until, datetime):
+            until = (until.astimezone(fallback_tz) if until.tzinfo else until).date()
+        rule['UNTIL'] = [until]
+
+    return rule.to_ical().decode()
+
+
+def series_end_epoch(event: 'EventData') -> Optional[int]:
+    """
+    計算週期系列最後一次發生的結束時間（UTC epoch 秒數）
+    無界系列或規則無法解析時返回 None（視為仍在進行）
+    """
+    try:
+        rules = SeriesRules(event)
+        last = rules.last_occurrence()
+    except Exception as e:
+        logger.warning(f"Failed to evaluate recurrence of {event.uid}: {e}")
+        return None
+    if last is None:
+        return None
+
+    duration = event.end_datetime - event.start_datetime if event.end_datetime else timedelta(0)
+    end = last + duration
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=rules.fallback_tz)
+    return int(end.timestamp())
+
+
+class Occurrence(NamedTuple):
+    """單一發生實例（不建立完整的 EventData）"""
+    uid: str
+    start_epoch: int
+    end_epoch: int
+    all_day: bool
+
+
+class _Expansion:
+    """
+    單一系列已展開的區間與結果
+    保留 rruleset 的迭代器，窗口向後延伸時從上次停下的位置繼續，不必從 DTSTART 重新迭代
+    """
+
+    __slots__ = ('rules', 'ruleset', 'duration', 'start', 'end', 'occurrences', 'starts',
+                 '_iterator', '_pending')
+
+    def __init__(self, rules: SeriesRules, duration: timedelta):
+        self.rules = rules
+        self.ruleset = rules.build()
+        self.duration = duration
+        self.start: Optional[datetime] = None  # 已展開區間 [start, end)，以規則時間表示
+        self.end: Optional[datetime] = None
+        self.occurrences: List[Occurrence] = []
+        self.starts: List[int] = []  # 與 occurrences 對應的開始 epoch，供二分搜尋
+        self._iterator: Optional[Iterator[datetime]] = None
+        self._pending: Optional[datetime] = None  # 已從迭代器取出、尚未展開的下一個實例
+
+    def _restart(self, start: datetime) -> None:
+        """重新建立迭代器並跳到 start"""
+        self._iterator = iter(self.ruleset)
+        self._pending = next(self._iterator, None)
+        while self._pending is not None and self._pending < start:
+            self._pending = next(self._iterator, None)
+
+    def _take_until(self, end: datetime) -> List[Occurrence]:
+        """從迭代器取出開始時間早於 end 的實例"""
+        event = self.rules.event
+        result = []
+        while self._pending is not None and self._pending < end:
+            result.append(Occurrence(
+                event.uid,
+                self.rules.to_epoch(self._pending),
+                self.rules.to_epoch(self._pending + self.duration),
+                event.all_day
+            ))
+            self._pending = next(self._iterator, None)
+        return result
+
+    def cover(self, start: datetime, end: datetime) -> None:
+        """確保 [start, end) 已展開；窗口向後滑動時只展開新增的部分"""
+        if self.start is not None and self.start <= start and end <= self.end:
+            return
+        if self.start is not None and self.start <= start <= self.end:
+            # 增量延伸：丟棄窗口前的實例，只展開新的尾端
+            cutoff = bisect.bisect_left(self.starts, self.rules.to_epoch(start))
+            tail = self._take_until(end)
+            self.occurrences = self.occurrences[cutoff:] + tail
+            self.starts = self.starts[cutoff:] + [occurrence.start_epoch for occurrence in tail]
+        else:
+            self._restart(start)
+            self.occurrences = self._take_until(end)
+            self.starts = [occurrence.start_epoch for occurrence in self.occurrences]
+        self.start = start
+        self.end = end
+
+    def between(self, start_epoch: int, end_epoch: int) -> List[Occurrence]:
+        """取出與 [start_epoch, end_epoch] 重疊的實例"""
+        low = bisect.bisect_left(self.starts, start_epoch - int(self.duration.total_seconds()))
+        high = bisect.bisect_right(self.starts, end_epoch)
+        return [
+            occurrence for occurrence in self.occurrences[low:high]
+            if occurrence.end_epoch > start_epoch or occurrence.start_epoch >= start_epoch
+        ]
+
+
+class RecurrenceExpander:
+    """
+    週期系列的實例展開
+    每個系列的 rruleset 與展開結果以 UID 與規則雜湊快取，規則不變時重複使用；
+    同步窗口每天向後滑動時只展開新增的尾端
+    """
+
+    def __init__(self):
+        self._cache: Dict[str, _Expansion] = {}
+
+    def expand(self, event: 'EventData', start_date: datetime, end_date: datetime) -> List[Occurrence]:
+        """展開單一事件在窗口內的實例（非週期事件返回自身）"""
+        if not event.is_recurring():
+            start_epoch, end_epoch = event.get_epoch_range()
+            end_epoch = end_epoch if end_epoch is not None else start_epoch
+            if start_epoch is None or start_epoch > end_date.timestamp() or end_epoch < start_date.timestamp():
+                return []
+            return [Occurrence(event.uid, start_epoch, end_epoch, event.all_day)]
+        return self._expand_series(self._cache_key(event), event, start_date, end_date)
+
+    def expand_all(self, events: Iterable['EventData'], start_date: datetime,
+                   end_date: datetime) -> List[Occurrence]:
+        """批次展開，並移除本次未出現的系列快取"""
+        occurrences: List[Occurrence] = []
+        single_events: List['EventData'] = []
+        used_keys = set()
+        for event in events:
+            if not event.is_recurring():
+                single_events.append(event)
+                continue
+            try:
+                key = self._cache_key(event)
+                used_keys.add(key)
+                occurrences.extend(self._expand_series(key, event, start_date, end_date))
+            except Exception as e:
+                logger.warning(f"Failed to expand recurring event {event.uid}: {e}")
+
+        # 非週期事件以 epoch 索引整批查詢與窗口的交集
+        index = EpochIndex.from_events(single_events)
+        for position in index.overlapping(int(start_date.timestamp()), int(end_date.timestamp())):
+            event = single_events[position]
+            occurrences.append(Occurrence(
+                event.uid, int(index.starts[position]), int(index.ends[position]), event.all_day
+            ))
+
+        for key in set(self._cache) - used_keys:
+            del self._cache[key]
+        return occurrences
+
+    @staticmethod
+    def _cache_key(event: 'EventData') -> str:
+        return f"{event.uid}|{series_cache_key(event)}"
+
+    def _expand_series(self, key: str, event: 'EventData', start_date: datetime,
+                       end_date: datetime) -> List[Occurrence]:
+        expansion = self._cache.get(key)
+        if expansion is None:
+            duration = event.end_datetime - event.start_datetime if event.end_datetime else timedelta(0)
+            expansion = _Expansion(SeriesRules(event), duration)
+            self._cache[key] = expansion
+
+        # 往前多展開一個實例長度，包含在窗口開始前開始、窗口內結束的實例
+        rules = expansion.rules
+        expansion.cover(
+            rules.to_rule_time(start_date) - expansion.duration,
+            rules.to_rule_time(end_date) + timedelta(seconds=1)
+        )
+        return expansion.between(int(start_date.timestamp()), int(end_date.timestamp()))
@@ -0,0 +1,223 @@
+"""
+時區解析
+將 ICS 的時區定義（IANA 名稱、Windows 時區名稱、Outlook 的 "Customized Time Zone" 等 VTIMEZONE）
+對應到 IANA 時區。每個 feed 的 VTIMEZONE 只解析一次，結果以定義內容的雜湊持久化快取，
+事件的時區處理只需查表
+"""
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple, TYPE_CHECKING
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+from icalendar import Calendar
+from icalendar.windows_to_olson import WINDOWS_TO_OLSON
+
+if TYPE_CHECKING:
+    from src.storage.state_store import StateStore
+
+
+logger = logging.getLogger(__name__)
+
+# 比對 UTC 偏移時取樣的年份與間隔（涵蓋夏令時間的起訖）
+_SAMPLE_YEAR = 2026
+_SAMPLE_STEP = timedelta(days=1)
+
+# 參與偏移比對的 IANA 區域（排除 Etc/ 與舊式別名）
+_CANONICAL_AREAS = ('Africa/', 'America/', 'Antarctica/', 'Asia/', 'Atlantic/',
+                    'Australia/', 'Europe/', 'Indian/', 'Pacific/')
+
+
+@lru_cache(maxsize=None)
+def is_iana_name(name: str) -> bool:
+    """是否為可載入的 IANA 時區名稱"""
+    if not name or name != name.strip():
+        return False
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def _name_candidates(tzid: str) -> Iterator[str]:
+    """
+    從 TZID 取出可能的 IANA 名稱
+    部分產生器會加上路徑前綴，例如 /citadel.org/20190101_1/Europe/Berlin
+    """
+    tzid = tzid.strip().strip('"')
+    yield tzid
+    parts = tzid.strip('/').split('/')
+    for index in range(1, len(parts) - 1):
+        yield '/'.join(parts[index:])
+
+
+def iana_from_name(tzid: Optional[str]) -> Optional[str]:
+    """只依名稱解析：IANA 名稱（含路徑前綴）或 Windows 時區名稱，無法解析時返回 None"""
+    if not tzid:
+        return None
+    for candidate in _name_candidates(tzid):
+        if is_iana_name(candidate):
+            return candidate
+    return WINDOWS_TO_OLSON.get(tzid.strip().strip('"'))
+
+
+def fixed_offset_name(offset: timedelta) -> Optional[str]:
+    """整點的固定偏移對應 Etc/GMT 時區（符號與 UTC 偏移相反），其餘返回 None"""
+    seconds = int(offset.total_seconds())
+    if seconds == 0:
+        return 'UTC'
+    if seconds % 3600:
+        return None
+    return f'Etc/GMT{-seconds // 3600:+d}'
+
+
+def _sample_instants() -> Tuple[datetime, ...]:
+    start = datetime(_SAMPLE_YEAR, 1, 1, 12, tzinfo=timezone.utc)
+    end = datetime(_SAMPLE_YEAR + 1, 1, 1, tzinfo=timezone.utc)
+    instants = []
+    while start < end:
+        instants.append(start)
+        start += _SAMPLE_STEP
+    return tuple(instants)
+
+
+_SAMPLES = _sample_instants()
+
+
+def offset_signature(zone: tzinfo) -> Tuple[timedelta, ...]:
+    """時區在取樣時間點的 UTC 偏移序列，用於比對等價的時區"""
+    return tuple(instant.astimezone(zone).utcoffset() for instant in _SAMPLES)
+
+
+@lru_cache(maxsize=None)
+def _zone_signature(name: str) -> Tuple[timedelta, ...]:
+    return offset_signature(ZoneInfo(name))
+
+
+@lru_cache(maxsize=None)
+def _candidate_zones(preferred: str) -> Tuple[str, ...]:
+    """偏移比對的候選順序：設定的預設時區、Windows 對照表中的代表城市、其餘 IANA 時區"""
+    ordered = [preferred] if is_iana_name(preferred) else []
+    ordered.extend(WINDOWS_TO_OLSON[name] for name in sorted(WINDOWS_TO_OLSON))
+    ordered.extend(sorted(name for name in available_timezones() if name.startswith(_CANONICAL_AREAS)))
+    return tuple(dict.fromkeys(name for name in ordered if is_iana_name(name)))
+
+
+def match_offsets(zone: tzinfo, preferred: str) -> Optional[str]:
+    """找出與時區定義的 UTC 偏移（含夏令時間規則）完全一致的 IANA 時區"""
+    signature = offset_signature(zone)
+    for name in _candidate_zones(preferred):
+        if _zone_signature(name) == signature:
+            return name
+    if len(set(signature)) == 1:
+        return fixed_offset_name(signature[0])
+    return None
+
+
+def timezone_name(value: datetime) -> str:
+    """取得 datetime 的 IANA 時區名稱（Google Calendar 的 timeZone 欄位）"""
+    zone = value.tzinfo if value else None
+    if zone is None:
+        return 'UTC'
+    name = getattr(zone, 'key', None) or getattr(zone, 'zone', None)
+    if name and is_iana_name(name):
+        return name
+    offset = value.utcoffset()
+    if offset is None:
+        return 'UTC'
+    return fixed_offset_name(offset) or 'UTC'
+
+
+class TimezoneResolver:
+    """
+    以 feed 的 VTIMEZONE 建立 TZID → IANA 對照表
+    解析順序：IANA 名稱、Windows 時區名稱、UTC 偏移與夏令時間規則比對、整點固定偏移；
+    都無法對應時保留 feed 解析出的時區（不改標為預設時區，避免事件移到不同的時間點）
+    """
+
+    def __init__(self, default_timezone: str, state_store: Optional['StateStore'] = None):
+        self.default_timezone = default_timezone
+        self.state_store = state_store
+        # TZID → IANA 名稱（目前 feed 的對照表），None 表示無法對應、保留原時區
+        self.mapping: Dict[str, Optional[str]] = {}
+        # 浮動時間（無時區）使用的時區：feed 的 X-WR-TIMEZONE，否則為設定的預設時區
+        self.floating_zone = ZoneInfo(default_timezone)
+        self._persisted: Optional[Dict[str, str]] = None
+        self._zones: Dict[str, ZoneInfo] = {}
+
+    def load_calendar(self, calendar: Calendar) -> None:
+        """解析 feed 中所有 VTIMEZONE，每個定義只比對一次"""
+        if self._persisted is None:
+            self._persisted = self.state_store.get_timezone_mappings() if self.state_store else {}
+
+        self.mapping = {}
+        for component in calendar.walk('VTIMEZONE'):
+            tzid = str(component.get('TZID', ''))
+            if tzid:
+                self.mapping[tzid] = self._resolve_definition(tzid, component)
+
+        declared = str(calendar.get('X-WR-TIMEZONE', ''))
+        floating = self.mapping.get(declared) or iana_from_name(declared) or self.default_timezone
+        self.floating_zone = self._zone(floating)
+        if self.mapping:
+            logger.debug(f"Resolved time zones: {self.mapping}")
+
+    def _resolve_definition(self, tzid: str, component) -> Optional[str]:
+        """解析單一 VTIMEZONE，結果以定義內容的雜湊快取（無法對應者記為空字串）"""
+        name = iana_from_name(tzid)
+        if name:
+            return name
+
+        key = hashlib.sha1(
+            f"{self.default_timezone}|".encode('utf-8') + component.to_ical()
+        ).hexdigest()
+        if key in self._persisted:
+            return self._persisted[key] or None
+
+        try:
+            name = match_offsets(component.to_tz(), self.default_timezone)
+        except Exception as e:
+            logger.warning(f"Failed to evaluate VTIMEZONE {tzid}: {e}")
+            name = None
+        if name is None:
+            logger.warning(f"No IANA time zone matches {tzid}; keeping the UTC offsets defined in the feed")
+        else:
+            logger.info(f"Mapped time zone {tzid} to {name}")
+
+        self._persisted[key] = name or ''
+        if self.state_store is not None:
+            self.state_store.save_timezone_mapping(key, name or '')
+        return name
+
+    def _zone(self, name: str) -> ZoneInfo:
+        zone = self._zones.get(name)
+        if zone is None:
+            zone = self._zones[name] = ZoneInfo(name)
+        return zone
+
+    def zone_for(self, value: datetime) -> tzinfo:
+        """
+        取得 datetime 對應的 IANA 時區；浮動時間使用 floating_zone
+        無法對應到 IANA 時區時返回原本的 tzinfo
+        """
+        zone = value.tzinfo
+        if zone is None:
+            return self.floating_zone
+        if isinstance(zone, ZoneInfo):
+            return zone
+        tzid = getattr(zone, 'zone', None) or str(zone)
+        if tzid not in self.mapping:
+            # 不在 VTIMEZONE 中的 TZID（例如 UTC 或直接引用的 IANA/Windows 名稱）
+            name = iana_from_name(tzid) or fixed_offset_name(value.utcoffset())
+            if name is None:
+                logger.warning(f"No IANA time zone matches {tzid}; keeping its UTC offset")
+            self.mapping[tzid] = name
+        name = self.mapping[tzid]
+        return self._zone(name) if name else zone
+
+    def localize(self, value: datetime) -> datetime:
+        """以對應的 IANA 時區表示（保留當地時間）；無法對應時不變，時間點維持不變"""
+        zone = self.zone_for(value)
+        return value if zone is value.tzinfo else value.replace(tzinfo=zone)
@@ -2,34 +2,53 @@
 本地狀態管理資料庫
 用於追蹤同步狀態、事件變更和映射關係
 """
+import asyncio
 import sqlite3
 import logging
 import json
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict, Optional, Any, Tuple
+from zoneinfo import ZoneInfo
 from contextlib import contextmanager
 
 from src.utils.config import DatabaseConfig
 from src.parsers.ics_parser import EventData
+from src.storage.state_store import StateStore, SESSION_FIELDS
+from src.storage.writer import GroupCommitWriter
 
 
 logger = logging.getLogger(__name__)
 
 
-class SyncDatabase:
-    """同步狀態資料庫"""
+class SyncDatabase(StateStore):
+    """同步狀態資料庫（SQLite 實作）"""
     
-    def __init__(self, config: DatabaseConfig):
+    def __init__(self, config: DatabaseConfig, timezone: str = 'UTC'):
         self.config = config
+        # 無時區的時間（全天事件與浮動時間）以此時區換算，與 EventData._to_epoch 一致
+        self.timezone = timezone
         self.db_path = Path(config.path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
         
         self._initialize_database()
+        
+        # 映射與會話狀態的寫入交由單一寫入執行緒群組提交
+        self.writer = GroupCommitWriter(
+            self.db_path,
+            batch_size=config.write_batch_size,
+            flush_interval_ms=config.write_flush_interval_ms
+        )
     
     def _initialize_database(self):
         """初始化資料庫結構"""
         with self._get_connection() as conn:
+            # 啟用增量 VACUUM，讓維護作業可分段回收空間
+            self._enable_incremental_vacuum(conn)
+            
+            # WAL 模式讓讀取不會被寫入執行緒阻塞
+            conn.execute('PRAGMA journal_mode=WAL')
+            
             # 事件快照表
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS event_snapshots (
@@ -39,6 +58,8 @@ class SyncDatabase:
                     sequence INTEGER NOT NULL DEFAULT 0,
                     fingerprint TEXT NOT NULL,
                     event_data TEXT NOT NULL,  -- JSON 格式的事件資料
+                    start_epoch INTEGER,  -- UTC epoch 秒數
+                    end_epoch INTEGER,  -- UTC epoch 秒數，週期系列未知結束時為 NULL
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     UNIQUE(original_uid)
@@ -75,14 +96,106 @@ class SyncDatabase:
                 )
             ''')
             
+            # 同步操作 outbox：記錄每個操作的進度，中斷的週期可據此接續
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_outbox (
+                    original_uid TEXT PRIMARY KEY,
+                    operation TEXT NOT NULL,  -- create, update, delete
+                    status TEXT NOT NULL DEFAULT 'pending',  -- pending, in_flight, failed
+                    error_message TEXT,
+                    updated_at TIMESTAMP
+                )
+            ''')
+            
+            # 事件失敗紀錄：重試次數與下次可重試時間
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS event_failures (
+                    original_uid TEXT PRIMARY KEY,
+                    operation TEXT NOT NULL,
+                    fingerprint TEXT,  -- 失敗時的事件指紋，來源變更後立即重試
+                    attempts INTEGER NOT NULL DEFAULT 1,
+                    last_error TEXT,
+                    first_failed_at TIMESTAMP,
+                    last_failed_at TIMESTAMP,
+                    next_attempt_at REAL  -- UTC epoch 秒數
+                )
+            ''')
+            
+            # 週期系列結束時間快取：以規則、DTSTART 與 EXDATE/RDATE 的雜湊為鍵
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS recurrence_ends (
+                    series_key TEXT PRIMARY KEY,
+                    end_epoch INTEGER,  -- UTC epoch 秒數，無界系列為 NULL
+                    computed_at TIMESTAMP
+                )
+            ''')
+            
+            # VTIMEZONE 定義對應的 IANA 時區：以定義內容的雜湊為鍵
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS timezone_mappings (
+                    definition_key TEXT PRIMARY KEY,
+                    iana_name TEXT NOT NULL,
+                    computed_at TIMESTAMP
+                )
+            ''')
+            
+            # 舊資料庫升級：補上時間窗口欄位
+            self._migrate_time_window_columns(conn)
+            
             # 建立索引
             conn.execute('CREATE INDEX IF NOT EXISTS idx_event_snapshots_uid ON event_snapshots(original_uid)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_event_snapshots_window ON event_snapshots(start_epoch, end_epoch)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_event_mappings_uid ON event_mappings(original_uid)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_event_mappings_google_id ON event_mappings(google_event_id)')
             
             conn.commit()
             logger.info("Database initialized successfully")
     
+    def _enable_incremental_vacuum(self, conn: sqlite3.Connection) -> None:
+        """將 auto_vacuum 設為 INCREMENTAL，既有資料庫需一次性 VACUUM 才會生效"""
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return
+        
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        has_tables = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'"
+        ).fetchone()[0]
+        if has_tables:
+            logger.info("Converting database to incremental auto-vacuum (one-time VACUUM)")
+            conn.execute('VACUUM')
+    
+    def _migrate_time_window_columns(self, conn: sqlite3.Connection) -> None:
+        """為舊版 event_snapshots 加入 start_epoch/end_epoch 欄位並從 JSON 回填"""
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(event_snapshots)')}
+        if 'start_epoch' in columns:
+            return
+        
+        conn.execute('ALTER TABLE event_snapshots ADD COLUMN start_epoch INTEGER')
+        conn.execute('ALTER TABLE event_snapshots ADD COLUMN end_epoch INTEGER')
+        
+        rows = conn.execute('SELECT id, series_uid, event_data FROM event_snapshots').fetchall()
+        for row in rows:
+            data = json.loads(row[2])
+            start_epoch = self._iso_to_epoch(data.get('start_datetime'))
+            end_epoch = None if row[1] else self._iso_to_epoch(data.get('end_datetime'))
+            conn.execute(
+                'UPDATE event_snapshots SET start_epoch = ?, end_epoch = ? WHERE id = ?',
+                (start_epoch, end_epoch, row[0])
+            )
+        logger.info(f"Migrated {len(rows)} event snapshots to time-window columns")
+    
+    def _iso_to_epoch(self, value: Optional[str]) -> Optional[int]:
+        """將 ISO 格式時間字串轉換為 UTC epoch，日期與無時區的時間以設定時區的當地時間計算"""
+        if not value:
+            return None
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=ZoneInfo(self.timezone))
+        return int(dt.timestamp())
+    
     @contextmanager
     def _get_connection(self):
         """取得資料庫連線的 context manager"""
@@ -94,30 +207,44 @@ class SyncDatabase:
             conn.close()
     
     def save_event_snapshot(self, event_data: EventData) -> None:
-        """儲存事件快照"""
-        with self._get_connection() as conn:
-            event_json = json.dumps(event_data.to_dict(), ensure_ascii=False)
-            
-            # 使用唯一事件ID作為索引
-            unique_id = event_data.get_unique_event_id()
-            series_id = event_data.get_series_id() if event_data.is_recurring() else None
-            
-            conn.execute('''
-                INSERT OR REPLACE INTO event_snapshots 
-                (original_uid, series_uid, sequence, fingerprint, event_data, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                unique_id,
-                series_id,
-                event_data.sequence,
-                event_data.fingerprint,
-                event_json,
-                datetime.now().isoformat()
-            ))
-            conn.commit()
+        """儲存事件快照（經由寫入佇列，與同一操作的映射依序提交）"""
+        event_json = json.dumps(event_data.to_dict(), ensure_ascii=False)
+        
+        # 使用唯一事件ID作為索引
+        unique_id = event_data.get_unique_event_id()
+        series_id = event_data.get_series_id() if event_data.is_recurring() else None
+        start_epoch, end_epoch = event_data.get_epoch_range()
+        
+        self.writer.submit('''
+            INSERT OR REPLACE INTO event_snapshots 
+            (original_uid, series_uid, sequence, fingerprint, event_data,
+             start_epoch, end_epoch, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            unique_id,
+            series_id,
+            event_data.sequence,
+            event_data.fingerprint,
+            event_json,
+            start_epoch,
+            end_epoch,
+            datetime.now().isoformat()
+        ))
+    
+    def delete_event_snapshot(self, original_uid: str) -> None:
+        """刪除事件快照"""
+        self.writer.submit('DELETE FROM event_snapshots WHERE original_uid = ?', (original_uid,))
+    
+    def invalidate_event_snapshot(self, original_uid: str) -> None:
+        """清除快照指紋，下次同步會重新送出該事件"""
+        self.writer.submit(
+            "UPDATE event_snapshots SET fingerprint = '' WHERE original_uid = ?",
+            (original_uid,)
+        )
     
     def get_event_snapshot(self, original_uid: str) -> Optional[Dict[str, Any]]:
         """取得事件快照"""
+        self.flush()
         with self._get_connection() as conn:
             cursor = conn.execute(
                 'SELECT * FROM event_snapshots WHERE original_uid = ?',
@@ -126,48 +253,53 @@ class SyncDatabase:
             row = cursor.fetchone()
             
             if row:
-                return {
-                    'original_uid': row['original_uid'],
-                    'sequence': row['sequence'],
-                    'fingerprint': row['fingerprint'],
-                    'event_data': json.loads(row['event_data']),
-                    'updated_at': row['updated_at']
-                }
+                return self._snapshot_from_row(row)
             return None
     
     def get_all_event_snapshots(self) -> List[Dict[str, Any]]:
         """取得所有事件快照"""
+        self.flush()
         with self._get_connection() as conn:
             cursor = conn.execute('SELECT * FROM event_snapshots ORDER BY updated_at DESC')
             rows = cursor.fetchall()
             
-            return [
-                {
-                    'original_uid': row['original_uid'],
-                    'sequence': row['sequence'],
-                    'fingerprint': row['fingerprint'],
-                    'event_data': json.loads(row['event_data']),
-                    'updated_at': row['updated_at']
-                }
-                for row in rows
-            ]
+            return [self._snapshot_from_row(row) for row in rows]
+    
+    def _snapshot_from_row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """將快照資料列轉換為字典"""
+        return {
+            'original_uid': row['original_uid'],
+            'series_uid': row['series_uid'],
+            'sequence': row['sequence'],
+            'fingerprint': row['fingerprint'],
+            'event_data': json.loads(row['event_data']),
+            'start_epoch': row['start_epoch'],
+            'end_epoch': row['end_epoch'],
+            'updated_at': row['updated_at']
+        }
+    
+    def flush(self) -> None:
+        """等待所有排隊中的寫入操作提交（同步週期結束時的屏障）"""
+        self.writer.flush()
+    
+    def close(self) -> None:
+        """提交剩餘寫入並關閉寫入執行緒"""
+        self.writer.close()
     
     def save_event_mapping(self, original_uid: str, google_event_id: str, 
                           google_calendar_id: str, sync_status: str = 'synced') -> None:
-        """儲存事件映射"""
-        with self._get_connection() as conn:
-            conn.execute('''
-                INSERT OR REPLACE INTO event_mappings 
-                (original_uid, google_event_id, google_calendar_id, last_sync_at, sync_status)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                original_uid,
-                google_event_id,
-                google_calendar_id,
-                datetime.now().isoformat(),
-                sync_status
-            ))
-            conn.commit()
+        """儲存事件映射（經由寫入佇列群組提交）"""
+        self.writer.submit('''
+            INSERT OR REPLACE INTO event_mappings 
+            (original_uid, google_event_id, google_calendar_id, last_sync_at, sync_status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (
+            original_uid,
+            google_event_id,
+            google_calendar_id,
+            datetime.now().isoformat(),
+            sync_status
+        ))
     
     def get_event_mapping(self, original_uid: str, 
                          google_calendar_id: str) -> Optional[Dict[str, Any]]:
@@ -196,22 +328,129 @@ class SyncDatabase:
             return [dict(row) for row in rows]
     
     def delete_event_mapping(self, original_uid: str, google_calendar_id: str) -> None:
-        """刪除事件映射"""
+        """刪除事件映射（經由寫入佇列群組提交）"""
+        self.writer.submit('''
+            DELETE FROM event_mappings 
+            WHERE original_uid = ? AND google_calendar_id = ?
+        ''', (original_uid, google_calendar_id))
+    
+    def delete_event_mapping_by_google_id(self, google_event_id: str, google_calendar_id: str) -> None:
+        """根據 Google Event ID 刪除事件映射（經由寫入佇列群組提交）"""
+        self.writer.submit('''
+            DELETE FROM event_mappings 
+            WHERE google_event_id = ? AND google_calendar_id = ?
+        ''', (google_event_id, google_calendar_id))
+    
+    def plan_operations(self, operations: List[Tuple[str, str]]) -> None:
+        """記錄本次週期預計執行的操作 (操作, UID)，已在進行中或失敗的操作保留原狀態"""
+        now = datetime.now().isoformat()
+        for operation, original_uid in operations:
+            self.writer.submit('''
+                INSERT INTO sync_outbox (original_uid, operation, status, updated_at)
+                VALUES (?, ?, 'pending', ?)
+                ON CONFLICT(original_uid) DO UPDATE SET operation = excluded.operation
+            ''', (original_uid, operation, now))
+    
+    def begin_operation(self, operation: str, original_uid: str) -> None:
+        """在呼叫 Google API 前將操作標記為進行中，並等待提交落地"""
+        self.writer.submit('''
+            INSERT OR REPLACE INTO sync_outbox (original_uid, operation, status, updated_at)
+            VALUES (?, ?, 'in_flight', ?)
+        ''', (original_uid, operation, datetime.now().isoformat()))
+        self.flush()
+    
+    def finish_operation(self, original_uid: str, success: bool,
+                         error_message: Optional[str] = None) -> None:
+        """操作完成：成功時移除紀錄，失敗時標記為 failed"""
+        if success:
+            self.writer.submit('DELETE FROM sync_outbox WHERE original_uid = ?', (original_uid,))
+        else:
+            self.writer.submit('''
+                UPDATE sync_outbox SET status = 'failed', error_message = ?, updated_at = ?
+                WHERE original_uid = ?
+            ''', (error_message, datetime.now().isoformat(), original_uid))
+    
+    def get_outbox(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有未完成的操作"""
+        self.flush()
         with self._get_connection() as conn:
-            conn.execute('''
-                DELETE FROM event_mappings 
+            rows = conn.execute('SELECT * FROM sync_outbox').fetchall()
+            return {row['original_uid']: dict(row) for row in rows}
+    
+    def discard_operations(self, original_uids: List[str]) -> None:
+        """移除已不需要的操作紀錄"""
+        for original_uid in original_uids:
+            self.writer.submit('DELETE FROM sync_outbox WHERE original_uid = ?', (original_uid,))
+    
+    def save_event_failure(self, failure: Dict[str, Any],
+                           google_calendar_id: Optional[str] = None) -> None:
+        """記錄事件失敗，並將既有映射標記為 failed"""
+        self.writer.submit('''
+            INSERT OR REPLACE INTO event_failures
+            (original_uid, operation, fingerprint, attempts, last_error,
+             first_failed_at, last_failed_at, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            failure['original_uid'],
+            failure['operation'],
+            failure.get('fingerprint'),
+            failure['attempts'],
+            failure.get('last_error'),
+            failure['first_failed_at'],
+            failure['last_failed_at'],
+            failure['next_attempt_at']
+        ))
+        if google_calendar_id:
+            self.writer.submit('''
+                UPDATE event_mappings SET sync_status = 'failed', error_message = ?
                 WHERE original_uid = ? AND google_calendar_id = ?
-            ''', (original_uid, google_calendar_id))
-            conn.commit()
+            ''', (failure.get('last_error'), failure['original_uid'], google_calendar_id))
     
-    def delete_event_mapping_by_google_id(self, google_event_id: str, google_calendar_id: str) -> None:
-        """根據 Google Event ID 刪除事件映射"""
+    def clear_event_failure(self, original_uid: str) -> None:
+        """清除事件的失敗紀錄（同步成功或事件已從來源移除時）"""
+        self.writer.submit('DELETE FROM event_failures WHERE original_uid = ?', (original_uid,))
+    
+    def get_event_failures(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有事件失敗紀錄 {UID: 紀錄}"""
+        self.flush()
         with self._get_connection() as conn:
-            conn.execute('''
-                DELETE FROM event_mappings 
-                WHERE google_event_id = ? AND google_calendar_id = ?
-            ''', (google_event_id, google_calendar_id))
-            conn.commit()
+            rows = conn.execute('SELECT * FROM event_failures').fetchall()
+            return {row['original_uid']: dict(row) for row in rows}
+    
+    def get_recurrence_ends(self) -> Dict[str, Optional[int]]:
+        """取得已計算的週期系列結束時間 {規則雜湊: 結束 epoch，無界為 None}"""
+        self.flush()
+        with self._get_connection() as conn:
+            rows = conn.execute('SELECT series_key, end_epoch FROM recurrence_ends').fetchall()
+            return {row['series_key']: row['end_epoch'] for row in rows}
+    
+    def save_recurrence_end(self, series_key: str, end_epoch: Optional[int]) -> None:
+        """記錄週期系列結束時間（經由寫入佇列群組提交）"""
+        self.writer.submit('''
+            INSERT OR REPLACE INTO recurrence_ends (series_key, end_epoch, computed_at)
+            VALUES (?, ?, ?)
+        ''', (series_key, end_epoch, datetime.now().isoformat()))
+    
+    def mark_series_ended(self, original_uid: str, end_epoch: int) -> None:
+        """為尚未記錄結束時間的系列快照補上結束時間（經由寫入佇列群組提交）"""
+        self.writer.submit('''
+            UPDATE event_snapshots SET end_epoch = ?
+            WHERE original_uid = ? AND series_uid IS NOT NULL AND end_epoch IS NULL
+        ''', (end_epoch, original_uid))
+    
+    def get_timezone_mappings(self) -> Dict[str, str]:
+        """取得已解析的時區定義 {VTIMEZONE 雜湊: IANA 名稱}"""
+        self.flush()
+        with self._get_connection() as conn:
+            rows = conn.execute('SELECT definition_key, iana_name FROM timezone_mappings').fetchall()
+            return {row['definition_key']: row['iana_name'] for row in rows}
+    
+    def save_timezone_mapping(self, definition_key: str, iana_name: str) -> None:
+        """記錄時區定義對應的 IANA 名稱（經由寫入佇列群組提交）"""
+        self.writer.submit('''
+            INSERT OR REPLACE INTO timezone_mappings (definition_key, iana_name, computed_at)
+            VALUES (?, ?, ?)
+        ''', (definition_key, iana_name, datetime.now().isoformat()))
     
     def start_sync_session(self) -> int:
         """開始同步會話，返回會話 ID"""
@@ -224,7 +463,7 @@ class SyncDatabase:
             return cursor.lastrowid
     
     def update_sync_session(self, session_id: int, **kwargs) -> None:
-        """更新同步會話"""
+        """更新同步會話（經由寫入佇列群組提交）"""
         if not kwargs:
             return
         
@@ -233,8 +472,7 @@ class SyncDatabase:
         values = []
         
         for key, value in kwargs.items():
-            if key in ['events_processed', 'events_created', 'events_updated', 
-                      'events_deleted', 'errors_count', 'status', 'error_message']:
+            if key in SESSION_FIELDS:
                 set_clauses.append(f'{key} = ?')
                 values.append(value)
         
@@ -246,12 +484,11 @@ class SyncDatabase:
             values.append(session_id)
             sql = f'UPDATE sync_history SET {", ".join(set_clauses)} WHERE id = ?'
             
-            with self._get_connection() as conn:
-                conn.execute(sql, values)
-                conn.commit()
+            self.writer.submit(sql, values)
     
     def get_sync_history(self, limit: int = 10) -> List[Dict[str, Any]]:
         """取得同步歷史"""
+        self.flush()
         with self._get_connection() as conn:
             cursor = conn.execute('''
                 SELECT * FROM sync_history 
@@ -262,49 +499,19 @@ class SyncDatabase:
             
             return [dict(row) for row in rows]
     
-    def detect_changes(self, current_events: List[EventData]) -> Tuple[List[EventData], List[EventData], List[str]]:
-        """
-        偵測事件變更
-        返回: (新事件列表, 更新事件列表, 刪除事件 UID 列表)
-        """
-        new_events = []
-        updated_events = []
-        
-        # 建立當前事件的唯一ID集合
-        current_unique_ids = {event.get_unique_event_id() for event in current_events}
-        
-        # 取得所有現有快照
-        existing_snapshots = {
-            snapshot['original_uid']: snapshot 
-            for snapshot in self.get_all_event_snapshots()
-        }
-        existing_unique_ids = set(existing_snapshots.keys())
-        
-        # 檢查每個當前事件
-        for event in current_events:
-            unique_id = event.get_unique_event_id()
-            
-            if unique_id not in existing_snapshots:
-                # 新事件
-                new_events.append(event)
-            else:
-                # 檢查是否有變更
-                snapshot = existing_snapshots[unique_id]
-                if (event.sequence > snapshot['sequence'] or 
-                    event.fingerprint != snapshot['fingerprint']):
-                    updated_events.append(event)
-        
-        # 找出已刪除的事件
-        deleted_uids = list(existing_unique_ids - current_unique_ids)
-        
-        logger.info(f"Change detection: {len(new_events)} new, {len(updated_events)} updated, {len(deleted_uids)} deleted")
-        
-        return new_events, updated_events, deleted_uids
-    
-    def get_orphaned_series_events(self, current_events: List[EventData]) -> List[str]:
-        """檢測週期事件系列變更後的孤兒事件"""
+    def get_orphaned_series_events(self, current_events: List[EventData],
+                                   window_start: Optional[datetime] = None) -> List[str]:
+        """檢測週期事件系列變更後的孤兒事件（已結束並滑出同步窗口的系列不算）"""
         orphaned_uids = []
         
+        # 已過期的系列快照不列入
+        active_condition = ''
+        params: Tuple = ()
+        if window_start is not None:
+            cutoff_epoch = int(window_start.timestamp())
+            active_condition = 'AND NOT (IFNULL(start_epoch < ?, 0) AND IFNULL(end_epoch < ?, 0))'
+            params = (cutoff_epoch, cutoff_epoch)
+        
         # 建立當前週期事件系列的映射
         current_series = {}
         for event in current_events:
@@ -314,6 +521,7 @@ class SyncDatabase:
                     current_series[series_id] = []
                 current_series[series_id].append(event.get_unique_event_id())
         
+        self.flush()
         with self._get_connection() as conn:
             # 查找所有已知的週期事件系列
             cursor = conn.execute('''
@@ -329,10 +537,10 @@ class SyncDatabase:
                     current_uids = set(current_series[series_uid])
                     
                     # 查找資料庫中這個系列的所有事件
-                    series_cursor = conn.execute('''
+                    series_cursor = conn.execute(f'''
                         SELECT original_uid FROM event_snapshots 
-                        WHERE series_uid = ?
-                    ''', (series_uid,))
+                        WHERE series_uid = ? {active_condition}
+                    ''', (series_uid, *params))
                     
                     existing_uids = {row[0] for row in series_cursor.fetchall()}
                     
@@ -341,10 +549,10 @@ class SyncDatabase:
                     orphaned_uids.extend(orphans)
                 else:
                     # 整個系列已不存在，所有事件都是孤兒
-                    series_cursor = conn.execute('''
+                    series_cursor = conn.execute(f'''
                         SELECT original_uid FROM event_snapshots 
-                        WHERE series_uid = ?
-                    ''', (series_uid,))
+                        WHERE series_uid = ? {active_condition}
+                    ''', (series_uid, *params))
                     
                     orphaned_uids.extend([row[0] for row in series_cursor.fetchall()])
         
@@ -353,10 +561,36 @@ class SyncDatabase:
         
         return orphaned_uids
     
-    def cleanup_old_data(self, days: int = 90) -> None:
-        """清理舊資料"""
+    def prune_expired_snapshots(self, window_start: datetime) -> int:
+        """壓縮已滑出同步窗口的快照及其映射，返回刪除的快照數量"""
+        cutoff_epoch = int(window_start.timestamp())
+        
+        self.flush()
+        with self._get_connection() as conn:
+            expired_condition = '''
+                start_epoch < ? AND (series_uid IS NULL OR end_epoch < ?)
+            '''
+            conn.execute(f'''
+                DELETE FROM event_mappings WHERE original_uid IN (
+                    SELECT original_uid FROM event_snapshots WHERE {expired_condition}
+                )
+            ''', (cutoff_epoch, cutoff_epoch))
+            cursor = conn.execute(
+                f'DELETE FROM event_snapshots WHERE {expired_condition}',
+                (cutoff_epoch, cutoff_epoch)
+            )
+            pruned = cursor.rowcount
+            conn.commit()
+        
+        if pruned > 0:
+            logger.info(f"Pruned {pruned} expired event snapshots")
+        return pruned
+    
+    def cleanup_old_data(self, days: int = 90) -> int:
+        """清理舊資料，返回刪除的同步歷史筆數"""
         cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
         
+        self.flush()
         with self._get_connection() as conn:
             # 清理舊的同步歷史
             cursor = conn.execute(
@@ -365,13 +599,58 @@ class SyncDatabase:
             )
             deleted_history = cursor.rowcount
             
+            # 舊的系列結束時間快取（規則變更後不再使用的鍵），需要時會重新計算
+            conn.execute('DELETE FROM recurrence_ends WHERE computed_at < ?', (cutoff_date,))
+            
             conn.commit()
             
             if deleted_history > 0:
                 logger.info(f"Cleaned up {deleted_history} old sync history records")
+            
+            return deleted_history
+    
+    def incremental_vacuum(self, max_pages: int) -> int:
+        """回收最多 max_pages 個空閒頁面，返回剩餘的空閒頁面數"""
+        with self._get_connection() as conn:
+            # executescript 會一路執行到完成；execute 每次只回收一頁
+            conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});')
+            return conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    def optimize(self) -> None:
+        """更新查詢規劃器統計資訊"""
+        with self._get_connection() as conn:
+            conn.execute('PRAGMA optimize')
+    
+    def _backup_name(self, timestamp: str) -> str:
+        """備份檔名以資料庫檔名為前綴，同一目錄下的多個資料庫（例如各租戶）各自輪替"""
+        return f"{self.db_path.stem}_backup_{timestamp}.db"
+    
+    def rotate_backups(self, keep: Optional[int] = None) -> int:
+        """只保留最新的 keep 份備份（預設為 backup_count），返回刪除的檔案數"""
+        keep = self.config.backup_count if keep is None else keep
+        backups = sorted(
+            self.db_path.parent.glob(self._backup_name('[0-9]' * 8 + '_' + '[0-9]' * 6)),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        )
+        
+        removed = 0
+        for old_backup in backups[max(keep, 0):]:
+            try:
+                old_backup.unlink()
+                for suffix in ('-wal', '-shm'):
+                    old_backup.with_name(old_backup.name + suffix).unlink(missing_ok=True)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Failed to remove old backup {old_backup}: {e}")
+        
+        if removed:
+            logger.info(f"Removed {removed} old database backups (keeping {keep})")
+        return removed
     
     def get_database_stats(self) -> Dict[str, Any]:
         """取得資料庫統計資訊"""
+        self.flush()
         with self._get_connection() as conn:
             stats = {}
             
@@ -387,6 +666,10 @@ class SyncDatabase:
             cursor = conn.execute('SELECT COUNT(*) FROM sync_history')
             stats['sync_history_count'] = cursor.fetchone()[0]
             
+            # 失敗中的事件數量
+            cursor = conn.execute('SELECT COUNT(*) FROM event_failures')
+            stats['failing_events_count'] = cursor.fetchone()[0]
+            
             # 最後同步時間
             cursor = conn.execute('''
                 SELECT sync_started_at FROM sync_history 
@@ -399,16 +682,37 @@ class SyncDatabase:
             
             return stats
     
-    def backup_database(self, backup_path: Optional[Path] = None) -> Path:
-        """備份資料庫"""
+    def backup_database(self, backup_path: Optional[Path] = None,
+                        pages: int = -1, step_sleep: float = 0.0) -> Path:
+        """備份資料庫；pages > 0 時以線上增量方式每步複製固定頁數"""
         if backup_path is None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_path = self.db_path.parent / f"sync_state_backup_{timestamp}.db"
+            backup_path = self.db_path.parent / self._backup_name(timestamp)
+        backup_path = Path(backup_path)
+        
+        # 先寫入暫存檔，完成後再改名，避免留下不完整的備份
+        partial_path = backup_path.with_name(backup_path.name + '.partial')
         
+        self.flush()
         with self._get_connection() as source_conn:
-            backup_conn = sqlite3.connect(backup_path)
-            source_conn.backup(backup_conn)
-            backup_conn.close()
+            backup_conn = sqlite3.connect(partial_path)
+            try:
+                # 每步之間釋放鎖，寫入執行緒可以穿插提交
+                source_conn.backup(backup_conn, pages=pages, sleep=step_sleep)
+            finally:
+                backup_conn.close()
+        partial_path.replace(backup_path)
         
         logger.info(f"Database backed up to: {backup_path}")
-        return backup_path
\ No newline at end of file
+        return backup_path
+    
+    async def backup_database_async(self, backup_path: Optional[Path] = None) -> Path:
+        """在背景執行緒進行線上增量備份並輪替舊備份，不阻塞事件迴圈"""
+        backup_path = await asyncio.to_thread(
+            self.backup_database,
+            backup_path,
+            self.config.backup_pages_per_step,
+            self.config.backup_step_sleep_ms / 1000.0
+        )
+        self.rotate_backups()
+        return backup_path
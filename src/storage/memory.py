@@ -0,0 +1,302 @@
+"""
+記憶體狀態儲存
+不落地的狀態後端，用於效能量測、剖析與不觸碰磁碟的 dry-run
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Any, Tuple
+
+from src.utils.config import DatabaseConfig
+from src.parsers.event_index import EpochIndex
+from src.parsers.ics_parser import EventData
+from src.storage.state_store import StateStore, SESSION_FIELDS
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStateStore(StateStore):
+    """純記憶體的同步狀態儲存"""
+
+    def __init__(self, config: DatabaseConfig):
+        self.config = config
+        self._lock = threading.RLock()
+
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._mappings: Dict[tuple, Dict[str, Any]] = {}  # (original_uid, calendar_id) -> mapping
+        self._sessions: Dict[int, Dict[str, Any]] = {}
+        self._outbox: Dict[str, Dict[str, Any]] = {}
+        self._failures: Dict[str, Dict[str, Any]] = {}
+        self._recurrence_ends: Dict[str, Optional[int]] = {}
+        self._timezone_mappings: Dict[str, str] = {}
+        self._next_session_id = 1
+
+        logger.info("In-memory state store initialized")
+
+    def save_event_snapshot(self, event_data: EventData) -> None:
+        """儲存事件快照"""
+        start_epoch, end_epoch = event_data.get_epoch_range()
+        unique_id = event_data.get_unique_event_id()
+        snapshot = {
+            'original_uid': unique_id,
+            'series_uid': event_data.get_series_id() if event_data.is_recurring() else None,
+            'sequence': event_data.sequence,
+            'fingerprint': event_data.fingerprint,
+            'event_data': event_data.to_dict(),
+            'start_epoch': start_epoch,
+            'end_epoch': end_epoch,
+            'updated_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            self._snapshots[unique_id] = snapshot
+
+    def get_event_snapshot(self, original_uid: str) -> Optional[Dict[str, Any]]:
+        """取得事件快照"""
+        with self._lock:
+            snapshot = self._snapshots.get(original_uid)
+            return dict(snapshot) if snapshot else None
+
+    def get_all_event_snapshots(self) -> List[Dict[str, Any]]:
+        """取得所有事件快照"""
+        with self._lock:
+            snapshots = [dict(snapshot) for snapshot in self._snapshots.values()]
+        return sorted(snapshots, key=lambda snapshot: snapshot['updated_at'], reverse=True)
+
+    def delete_event_snapshot(self, original_uid: str) -> None:
+        """刪除事件快照"""
+        with self._lock:
+            self._snapshots.pop(original_uid, None)
+
+    def invalidate_event_snapshot(self, original_uid: str) -> None:
+        """清除快照指紋，下次同步會重新送出該事件"""
+        with self._lock:
+            snapshot = self._snapshots.get(original_uid)
+            if snapshot:
+                snapshot['fingerprint'] = ''
+    
+    def prune_expired_snapshots(self, window_start: datetime) -> int:
+        """壓縮已滑出同步窗口的快照及其映射，返回刪除的快照數量"""
+        cutoff_epoch = int(window_start.timestamp())
+        with self._lock:
+            uids = list(self._snapshots)
+            expired_uids = [
+                uids[position] for position in
+                EpochIndex.from_snapshots(self._snapshots.values()).expired(cutoff_epoch)
+            ]
+            for uid in expired_uids:
+                del self._snapshots[uid]
+            expired_set = set(expired_uids)
+            for key in [key for key in self._mappings if key[0] in expired_set]:
+                del self._mappings[key]
+
+        if expired_uids:
+            logger.info(f"Pruned {len(expired_uids)} expired event snapshots")
+        return len(expired_uids)
+
+    def save_event_mapping(self, original_uid: str, google_event_id: str,
+                           google_calendar_id: str, sync_status: str = 'synced') -> None:
+        """儲存事件映射"""
+        with self._lock:
+            self._mappings[(original_uid, google_calendar_id)] = {
+                'original_uid': original_uid,
+                'google_event_id': google_event_id,
+                'google_calendar_id': google_calendar_id,
+                'last_sync_at': datetime.now().isoformat(),
+                'sync_status': sync_status,
+                'error_message': None
+            }
+
+    def get_event_mapping(self, original_uid: str,
+                          google_calendar_id: str) -> Optional[Dict[str, Any]]:
+        """取得事件映射"""
+        with self._lock:
+            mapping = self._mappings.get((original_uid, google_calendar_id))
+            return dict(mapping) if mapping else None
+
+    def get_all_event_mappings(self, google_calendar_id: str) -> List[Dict[str, Any]]:
+        """取得指定行事曆的所有事件映射"""
+        with self._lock:
+            mappings = [
+                dict(mapping) for (_, calendar_id), mapping in self._mappings.items()
+                if calendar_id == google_calendar_id
+            ]
+        return sorted(mappings, key=lambda mapping: mapping['last_sync_at'], reverse=True)
+
+    def delete_event_mapping(self, original_uid: str, google_calendar_id: str) -> None:
+        """刪除事件映射"""
+        with self._lock:
+            self._mappings.pop((original_uid, google_calendar_id), None)
+
+    def delete_event_mapping_by_google_id(self, google_event_id: str, google_calendar_id: str) -> None:
+        """根據 Google Event ID 刪除事件映射"""
+        with self._lock:
+            for key, mapping in list(self._mappings.items()):
+                if mapping['google_event_id'] == google_event_id and key[1] == google_calendar_id:
+                    del self._mappings[key]
+
+    def plan_operations(self, operations: List[Tuple[str, str]]) -> None:
+        """記錄本次週期預計執行的操作 (操作, UID)"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            for operation, original_uid in operations:
+                entry = self._outbox.setdefault(original_uid, {
+                    'original_uid': original_uid,
+                    'status': 'pending',
+                    'error_message': None,
+                    'updated_at': now
+                })
+                entry['operation'] = operation
+    
+    def begin_operation(self, operation: str, original_uid: str) -> None:
+        """將操作標記為進行中"""
+        with self._lock:
+            self._outbox[original_uid] = {
+                'original_uid': original_uid,
+                'operation': operation,
+                'status': 'in_flight',
+                'error_message': None,
+                'updated_at': datetime.now().isoformat()
+            }
+    
+    def finish_operation(self, original_uid: str, success: bool,
+                         error_message: Optional[str] = None) -> None:
+        """操作完成：成功時移除紀錄，失敗時標記為 failed"""
+        with self._lock:
+            if success:
+                self._outbox.pop(original_uid, None)
+            elif original_uid in self._outbox:
+                self._outbox[original_uid].update(
+                    status='failed',
+                    error_message=error_message,
+                    updated_at=datetime.now().isoformat()
+                )
+    
+    def get_outbox(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有未完成的操作"""
+        with self._lock:
+            return {uid: dict(entry) for uid, entry in self._outbox.items()}
+    
+    def discard_operations(self, original_uids: List[str]) -> None:
+        """移除已不需要的操作紀錄"""
+        with self._lock:
+            for original_uid in original_uids:
+                self._outbox.pop(original_uid, None)
+    
+    def save_event_failure(self, failure: Dict[str, Any],
+                           google_calendar_id: Optional[str] = None) -> None:
+        """記錄事件失敗，並將既有映射標記為 failed"""
+        with self._lock:
+            self._failures[failure['original_uid']] = dict(failure)
+            mapping = self._mappings.get((failure['original_uid'], google_calendar_id))
+            if mapping:
+                mapping['sync_status'] = 'failed'
+                mapping['error_message'] = failure.get('last_error')
+    
+    def clear_event_failure(self, original_uid: str) -> None:
+        """清除事件的失敗紀錄（同步成功或事件已從來源移除時）"""
+        with self._lock:
+            self._failures.pop(original_uid, None)
+    
+    def get_event_failures(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有事件失敗紀錄"""
+        with self._lock:
+            return {uid: dict(failure) for uid, failure in self._failures.items()}
+    
+    def get_recurrence_ends(self) -> Dict[str, Optional[int]]:
+        """取得已計算的週期系列結束時間 {規則雜湊: 結束 epoch，無界為 None}"""
+        with self._lock:
+            return dict(self._recurrence_ends)
+
+    def save_recurrence_end(self, series_key: str, end_epoch: Optional[int]) -> None:
+        """記錄週期系列結束時間"""
+        with self._lock:
+            self._recurrence_ends[series_key] = end_epoch
+
+    def mark_series_ended(self, original_uid: str, end_epoch: int) -> None:
+        """為尚未記錄結束時間的系列快照補上結束時間"""
+        with self._lock:
+            snapshot = self._snapshots.get(original_uid)
+            if snapshot and snapshot['series_uid'] and snapshot['end_epoch'] is None:
+                snapshot['end_epoch'] = end_epoch
+
+    def get_timezone_mappings(self) -> Dict[str, str]:
+        """取得已解析的時區定義 {VTIMEZONE 雜湊: IANA 名稱}"""
+        with self._lock:
+            return dict(self._timezone_mappings)
+
+    def save_timezone_mapping(self, definition_key: str, iana_name: str) -> None:
+        """記錄時區定義對應的 IANA 名稱"""
+        with self._lock:
+            self._timezone_mappings[definition_key] = iana_name
+
+    def start_sync_session(self) -> int:
+        """開始同步會話，返回會話 ID"""
+        with self._lock:
+            session_id = self._next_session_id
+            self._next_session_id += 1
+            self._sessions[session_id] = {
+                'id': session_id,
+                'sync_started_at': datetime.now().isoformat(),
+                'sync_completed_at': None,
+                'events_processed': 0,
+                'events_created': 0,
+                'events_updated': 0,
+                'events_deleted': 0,
+                'errors_count': 0,
+                'status': 'running',
+                'error_message': None
+            }
+            return session_id
+
+    def update_sync_session(self, session_id: int, **kwargs) -> None:
+        """更新同步會話"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            for key, value in kwargs.items():
+                if key in SESSION_FIELDS:
+                    session[key] = value
+            if kwargs.get('status') in ['completed', 'failed']:
+                session['sync_completed_at'] = datetime.now().isoformat()
+
+    def get_sync_history(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """取得同步歷史"""
+        with self._lock:
+            sessions = sorted(
+                self._sessions.values(),
+                key=lambda session: session['sync_started_at'],
+                reverse=True
+            )
+            return [dict(session) for session in sessions[:limit]]
+
+    def cleanup_old_data(self, days: int = 90) -> int:
+        """清理舊資料，返回刪除的同步歷史筆數"""
+        cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._lock:
+            old_ids = [
+                session_id for session_id, session in self._sessions.items()
+                if session['sync_started_at'] < cutoff_date
+            ]
+            for session_id in old_ids:
+                del self._sessions[session_id]
+
+        if old_ids:
+            logger.info(f"Cleaned up {len(old_ids)} old sync history records")
+        return len(old_ids)
+
+    def get_database_stats(self) -> Dict[str, Any]:
+        """取得資料庫統計資訊"""
+        with self._lock:
+            completed = [
+                session['sync_started_at'] for session in self._sessions.values()
+                if session['status'] == 'completed'
+            ]
+            return {
+                'event_snapshots_count': len(self._snapshots),
+                'event_mappings_count': len(self._mappings),
+                'sync_history_count': len(self._sessions),
+                'failing_events_count': len(self._failures),
+                'last_successful_sync': max(completed) if completed else None
+            }
@@ -0,0 +1,299 @@
+"""
+狀態儲存介面
+定義同步引擎所需的快照、映射、會話與變更偵測操作，可替換不同後端
+"""
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional, Any, Tuple
+
+from src.utils.config import DatabaseConfig
+from src.parsers.event_index import EpochIndex
+from src.parsers.ics_parser import EventData
+
+
+logger = logging.getLogger(__name__)
+
+# 同步會話允許更新的欄位
+SESSION_FIELDS = (
+    'events_processed', 'events_created', 'events_updated',
+    'events_deleted', 'errors_count', 'status', 'error_message'
+)
+
+
+class StateStore(ABC):
+    """同步狀態儲存介面"""
+    
+    # ---- 事件快照 ----
+    
+    @abstractmethod
+    def save_event_snapshot(self, event_data: EventData) -> None:
+        """儲存事件快照"""
+    
+    @abstractmethod
+    def get_event_snapshot(self, original_uid: str) -> Optional[Dict[str, Any]]:
+        """取得事件快照"""
+    
+    @abstractmethod
+    def get_all_event_snapshots(self) -> List[Dict[str, Any]]:
+        """取得所有事件快照"""
+    
+    @abstractmethod
+    def delete_event_snapshot(self, original_uid: str) -> None:
+        """刪除事件快照"""
+    
+    @abstractmethod
+    def invalidate_event_snapshot(self, original_uid: str) -> None:
+        """清除快照指紋，下次同步會重新送出該事件"""
+    
+    @abstractmethod
+    def prune_expired_snapshots(self, window_start: datetime) -> int:
+        """壓縮已滑出同步窗口的快照及其映射，返回刪除的快照數量"""
+    
+    # ---- 事件映射 ----
+    
+    @abstractmethod
+    def save_event_mapping(self, original_uid: str, google_event_id: str,
+                           google_calendar_id: str, sync_status: str = 'synced') -> None:
+        """儲存事件映射"""
+    
+    @abstractmethod
+    def get_event_mapping(self, original_uid: str,
+                          google_calendar_id: str) -> Optional[Dict[str, Any]]:
+        """取得事件映射"""
+    
+    @abstractmethod
+    def get_all_event_mappings(self, google_calendar_id: str) -> List[Dict[str, Any]]:
+        """取得指定行事曆的所有事件映射"""
+    
+    @abstractmethod
+    def delete_event_mapping(self, original_uid: str, google_calendar_id: str) -> None:
+        """刪除事件映射"""
+    
+    @abstractmethod
+    def delete_event_mapping_by_google_id(self, google_event_id: str, google_calendar_id: str) -> None:
+        """根據 Google Event ID 刪除事件映射"""
+    
+    # ---- 操作 outbox ----
+    
+    @abstractmethod
+    def plan_operations(self, operations: List[Tuple[str, str]]) -> None:
+        """記錄本次週期預計執行的操作 (操作, UID)"""
+    
+    @abstractmethod
+    def begin_operation(self, operation: str, original_uid: str) -> None:
+        """在呼叫 Google API 前將操作標記為進行中（需持久化後才返回）"""
+    
+    @abstractmethod
+    def finish_operation(self, original_uid: str, success: bool,
+                         error_message: Optional[str] = None) -> None:
+        """操作完成：成功時移除紀錄，失敗時標記為 failed"""
+    
+    @abstractmethod
+    def get_outbox(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有未完成的操作 {UID: 紀錄}"""
+    
+    @abstractmethod
+    def discard_operations(self, original_uids: List[str]) -> None:
+        """移除已不需要的操作紀錄"""
+    
+    # ---- 事件失敗紀錄 ----
+    
+    @abstractmethod
+    def save_event_failure(self, failure: Dict[str, Any],
+                           google_calendar_id: Optional[str] = None) -> None:
+        """記錄事件失敗，並將既有映射標記為 failed"""
+    
+    @abstractmethod
+    def clear_event_failure(self, original_uid: str) -> None:
+        """清除事件的失敗紀錄（同步成功或事件已從來源移除時）"""
+    
+    @abstractmethod
+    def get_event_failures(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有事件失敗紀錄 {UID: 紀錄}"""
+    
+    # ---- 週期系列結束時間 ----
+    
+    @abstractmethod
+    def get_recurrence_ends(self) -> Dict[str, Optional[int]]:
+        """取得已計算的週期系列結束時間 {規則雜湊: 結束 epoch，無界為 None}"""
+    
+    @abstractmethod
+    def save_recurrence_end(self, series_key: str, end_epoch: Optional[int]) -> None:
+        """記錄週期系列結束時間"""
+    
+    @abstractmethod
+    def mark_series_ended(self, original_uid: str, end_epoch: int) -> None:
+        """為尚未記錄結束時間的系列快照補上結束時間"""
+    
+    # ---- 時區對照 ----
+    
+    @abstractmethod
+    def get_timezone_mappings(self) -> Dict[str, str]:
+        """取得已解析的時區定義 {VTIMEZONE 雜湊: IANA 名稱}"""
+    
+    @abstractmethod
+    def save_timezone_mapping(self, definition_key: str, iana_name: str) -> None:
+        """記錄時區定義對應的 IANA 名稱"""
+    
+    # ---- 同步會話 ----
+    
+    @abstractmethod
+    def start_sync_session(self) -> int:
+        """開始同步會話，返回會話 ID"""
+    
+    @abstractmethod
+    def update_sync_session(self, session_id: int, **kwargs) -> None:
+        """更新同步會話"""
+    
+    @abstractmethod
+    def get_sync_history(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """取得同步歷史"""
+    
+    @abstractmethod
+    def cleanup_old_data(self, days: int = 90) -> int:
+        """清理舊資料，返回刪除的同步歷史筆數"""
+    
+    @abstractmethod
+    def get_database_stats(self) -> Dict[str, Any]:
+        """取得資料庫統計資訊"""
+    
+    # ---- 生命週期與維護（後端可選擇性實作）----
+    
+    def flush(self) -> None:
+        """等待所有排隊中的寫入操作完成"""
+    
+    def close(self) -> None:
+        """釋放後端資源"""
+    
+    def incremental_vacuum(self, max_pages: int) -> int:
+        """回收空閒空間，返回剩餘待回收量"""
+        return 0
+    
+    def optimize(self) -> None:
+        """更新查詢統計資訊"""
+    
+    def rotate_backups(self, keep: Optional[int] = None) -> int:
+        """輪替舊備份，返回刪除的備份數量"""
+        return 0
+    
+    async def backup_database_async(self, backup_path: Optional[Path] = None) -> Optional[Path]:
+        """線上備份，不支援備份的後端返回 None"""
+        return None
+    
+    # ---- 變更偵測（所有後端共用）----
+    
+    @staticmethod
+    def _is_expired(snapshot: Dict[str, Any], cutoff_epoch: int) -> bool:
+        """判斷快照是否已滑出同步窗口（單次事件看開始時間，週期系列看結束時間）"""
+        start_epoch = snapshot.get('start_epoch')
+        if start_epoch is None or start_epoch >= cutoff_epoch:
+            return False
+        if snapshot.get('series_uid'):
+            end_epoch = snapshot.get('end_epoch')
+            return end_epoch is not None and end_epoch < cutoff_epoch
+        return True
+    
+    @staticmethod
+    def classify_change(event: EventData, snapshot: Optional[Dict[str, Any]]) -> Optional[str]:
+        """依快照判斷單一事件的變更類型：'create'、'update' 或 None（未變更）"""
+        if snapshot is None:
+            return 'create'
+        if (event.sequence > snapshot['sequence'] or 
+            event.fingerprint != snapshot['fingerprint']):
+            return 'update'
+        return None
+    
+    def split_missing_snapshots(self, existing_snapshots: Dict[str, Dict[str, Any]],
+                                current_unique_ids: set,
+                                window_start: Optional[datetime] = None) -> Tuple[List[str], int]:
+        """找出來源中已消失的快照，區分為刪除與過期，返回 (刪除 UID 列表, 過期數量)"""
+        missing_uids = set(existing_snapshots.keys()) - current_unique_ids
+        if window_start is None:
+            return list(missing_uids), 0
+        
+        missing = list(missing_uids)
+        expired = set(EpochIndex.from_snapshots(
+            existing_snapshots[uid] for uid in missing
+        ).expired(int(window_start.timestamp())))
+        deleted_uids = [uid for position, uid in enumerate(missing) if position not in expired]
+        return deleted_uids, len(expired)
+    
+    def detect_changes(self, current_events: List[EventData],
+                       window_start: Optional[datetime] = None) -> Tuple[List[EventData], List[EventData], List[str]]:
+        """
+        偵測事件變更
+        若提供 window_start，已滑出同步窗口的事件視為過期而非刪除
+        返回: (新事件列表, 更新事件列表, 刪除事件 UID 列表)
+        """
+        new_events = []
+        updated_events = []
+        
+        # 建立當前事件的唯一ID集合
+        current_unique_ids = {event.get_unique_event_id() for event in current_events}
+        
+        # 取得所有現有快照
+        existing_snapshots = {
+            snapshot['original_uid']: snapshot 
+            for snapshot in self.get_all_event_snapshots()
+        }
+        
+        # 檢查每個當前事件
+        for event in current_events:
+            change = self.classify_change(event, existing_snapshots.get(event.get_unique_event_id()))
+            if change == 'create':
+                new_events.append(event)
+            elif change == 'update':
+                updated_events.append(event)
+        
+        # 找出已刪除的事件（排除已過期的事件）
+        deleted_uids, expired_count = self.split_missing_snapshots(
+            existing_snapshots, current_unique_ids, window_start
+        )
+        
+        logger.info(f"Change detection: {len(new_events)} new, {len(updated_events)} updated, "
+                    f"{len(deleted_uids)} deleted, {expired_count} expired")
+        
+        return new_events, updated_events, deleted_uids
+    
+    def get_orphaned_series_events(self, current_events: List[EventData],
+                                   window_start: Optional[datetime] = None) -> List[str]:
+        """檢測週期事件系列變更後的孤兒事件（已結束並滑出同步窗口的系列不算）"""
+        cutoff_epoch = int(window_start.timestamp()) if window_start is not None else None
+        current_series_uids: Dict[str, set] = {}
+        for event in current_events:
+            if event.is_recurring():
+                current_series_uids.setdefault(event.get_series_id(), set()).add(
+                    event.get_unique_event_id()
+                )
+        
+        series_snapshots = [
+            snapshot for snapshot in self.get_all_event_snapshots() if snapshot.get('series_uid')
+        ]
+        expired = (set(EpochIndex.from_snapshots(series_snapshots).expired(cutoff_epoch))
+                   if cutoff_epoch is not None else set())
+        orphaned_uids = [
+            snapshot['original_uid'] for position, snapshot in enumerate(series_snapshots)
+            if position not in expired and
+            snapshot['original_uid'] not in current_series_uids.get(snapshot['series_uid'], set())
+        ]
+        
+        if orphaned_uids:
+            logger.info(f"Found {len(orphaned_uids)} orphaned recurring event instances")
+        
+        return orphaned_uids
+
+
+def create_state_store(config: DatabaseConfig, timezone: str = 'UTC') -> StateStore:
+    """依設定建立狀態儲存後端（timezone 為處理設定的時區，用於遷移舊資料中無時區的時間）"""
+    backend = config.backend.lower()
+    
+    if backend == 'sqlite':
+        from src.storage.database import SyncDatabase
+        return SyncDatabase(config, timezone)
+    if backend == 'memory':
+        from src.storage.memory import MemoryStateStore
+        return MemoryStateStore(config)
+    
+    raise ValueError(f"Unsupported state store backend: {config.backend}")
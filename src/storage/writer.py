@@ -0,0 +1,130 @@
+"""
+SQLite 群組提交寫入器
+以單一專用執行緒處理寫入佇列，合併多筆操作為一次提交
+"""
+import queue
+import sqlite3
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+
+class _FlushBarrier:
+    """flush 屏障，寫入器提交完先前所有操作後喚醒等待者"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class GroupCommitWriter:
+    """單一寫入執行緒，每 N 筆操作或每隔數毫秒群組提交一次"""
+
+    def __init__(self, db_path: Path, batch_size: int = 100, flush_interval_ms: int = 50):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._closed = False
+        self.last_error: Optional[str] = None
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"sqlite-writer:{db_path.name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, sql: str, params: Sequence[Any] = ()) -> None:
+        """將寫入操作放入佇列（非阻塞）"""
+        if self._closed:
+            raise RuntimeError("GroupCommitWriter is closed")
+        self._queue.put((sql, tuple(params)))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待佇列中所有先前的操作都已提交"""
+        if self._closed or not self._thread.is_alive():
+            return True
+        barrier = _FlushBarrier()
+        self._queue.put(barrier)
+        return barrier.done.wait(timeout)
+
+    def close(self) -> None:
+        """提交剩餘操作並停止寫入執行緒"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        """寫入執行緒主迴圈"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                batch = []
+                barriers = []
+                deadline = time.monotonic() + self.flush_interval
+                stop = False
+
+                # 收集一批操作，直到達到批次大小、時間到或遇到 flush 屏障
+                while True:
+                    if isinstance(item, _FlushBarrier):
+                        barriers.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+
+                self._commit(conn, batch)
+
+                for barrier in barriers:
+                    barrier.done.set()
+
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: list) -> None:
+        """在單一交易中執行並提交一批操作"""
+        if not batch:
+            return
+        try:
+            for sql, params in batch:
+                conn.execute(sql, params)
+            conn.commit()
+            logger.debug(f"Group-committed {len(batch)} write operations")
+        except Exception as e:
+            conn.rollback()
+            self.last_error = str(e)
+            logger.error(f"Group commit of {len(batch)} operations failed: {e}")
+            # 逐筆重試，避免單筆錯誤拖累整批
+            for sql, params in batch:
+                try:
+                    conn.execute(sql, params)
+                    conn.commit()
+                except Exception as op_e:
+                    conn.rollback()
+                    logger.error(f"Write operation failed: {op_e} ({sql.split()[0]})")
@@ -0,0 +1,245 @@
+"""
+衝突偵測與處理
+以區間索引（依開始時間排序、記錄子樹最大結束時間的靜態區間樹）將 Google 端受管理事件的實際時間
+與來源事件比對，建立 O(n log n)、每次查詢 O(log n + k)，取代兩兩比較。
+偵測到的衝突依 sync.conflict_resolution 處理：
+- source: 一律以來源為準（預設）
+- latest: 以較新的版本為準
+- manual: 不自動處理，列入失敗報告待人工確認
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Generic, Iterable, List, NamedTuple, Optional, Sequence, Tuple, TypeVar, TYPE_CHECKING
+from zoneinfo import ZoneInfo
+
+from src.parsers.event_index import UNBOUNDED_EPOCH
+from src.parsers.ics_parser import EventData
+
+if TYPE_CHECKING:
+    from src.sync.engine import SyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+CONFLICT_POLICIES = ('latest', 'source', 'manual')
+
+T = TypeVar('T')
+
+
+class IntervalIndex(Generic[T]):
+    """
+    靜態區間索引，區間為半開區間 [start, end)；長度為 0 的區間視為佔用 1 秒
+    以排序後陣列的中點作為隱式平衡二元樹的節點，每個節點記錄其子樹的最大結束時間
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int, T]]):
+        ordered = sorted(
+            ((start, max(end, start + 1), item) for start, end, item in intervals),
+            key=lambda interval: interval[0]
+        )
+        self._starts = [interval[0] for interval in ordered]
+        self._ends = [interval[1] for interval in ordered]
+        self._items = [interval[2] for interval in ordered]
+        self._max_ends = list(self._ends)
+        self._build(0, len(ordered) - 1)
+
+    def _build(self, low: int, high: int) -> Optional[int]:
+        """計算子樹 [low, high] 的最大結束時間（遞迴深度 O(log n)）"""
+        if low > high:
+            return None
+        middle = (low + high) // 2
+        max_end = self._ends[middle]
+        for child_max in (self._build(low, middle - 1), self._build(middle + 1, high)):
+            if child_max is not None and child_max > max_end:
+                max_end = child_max
+        self._max_ends[middle] = max_end
+        return max_end
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def overlapping(self, start: int, end: int) -> List[T]:
+        """與 [start, end) 重疊的項目"""
+        end = max(end, start + 1)
+        found: List[T] = []
+        stack = [(0, len(self._items) - 1)]
+        while stack:
+            low, high = stack.pop()
+            if low > high:
+                continue
+            middle = (low + high) // 2
+            if self._max_ends[middle] <= start:
+                # 整個子樹都在查詢範圍開始前結束
+                continue
+            stack.append((low, middle - 1))
+            if self._starts[middle] < end:
+                if self._ends[middle] > start:
+                    found.append(self._items[middle])
+                # 右子樹的開始時間更晚，只有中點仍在範圍內時才需要檢查
+                stack.append((middle + 1, high))
+        return found
+
+
+def google_time_epoch(value: Dict[str, str], zone: ZoneInfo) -> Optional[int]:
+    """將 Google 事件的 start/end 轉換為 UTC epoch，全天事件以 zone 的午夜計算"""
+    try:
+        if 'dateTime' in value:
+            return int(datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).timestamp())
+        if 'date' in value:
+            return int(datetime.fromisoformat(value['date']).replace(tzinfo=zone).timestamp())
+    except ValueError:
+        pass
+    return None
+
+
+class RemoteEvent(NamedTuple):
+    """Google 端由本工具管理、但已不對應任何目前來源事件的事件（依 Google 端的實際時間）"""
+    unique_id: str
+    google_event_id: str
+    summary: str
+    start_epoch: Optional[int]
+    end_epoch: Optional[int]
+    recurring: bool
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any], unique_id: str, zone: ZoneInfo) -> 'RemoteEvent':
+        """由事件列表的項目建立（需要 summary、start、end、recurrence 欄位）"""
+        recurring = bool(item.get('recurrence'))
+        return cls(
+            unique_id,
+            item['id'],
+            item.get('summary', ''),
+            google_time_epoch(item.get('start', {}), zone),
+            # 週期主事件只帶第一個實例的時間，系列可能延續到之後
+            UNBOUNDED_EPOCH if recurring else google_time_epoch(item.get('end', {}), zone),
+            recurring
+        )
+
+
+class Replacement(NamedTuple):
+    """來源以新 UID 重新發出的事件：新事件與同一時段、同標題的 Google 端事件"""
+    event: EventData
+    remote: RemoteEvent
+
+
+def _title_key(summary: str) -> str:
+    return ' '.join(summary.split()).casefold()
+
+
+def find_replacements(new_events: Sequence[EventData],
+                      remote_events: Sequence[RemoteEvent]) -> List[Replacement]:
+    """
+    以 Google 端事件的區間索引配對新事件：時間重疊、標題相同、同為單次或週期事件
+    每個 Google 端事件最多配對一個新事件，開始時間相同者優先
+    """
+    index: IntervalIndex[RemoteEvent] = IntervalIndex(
+        (item.start_epoch, item.end_epoch if item.end_epoch is not None else item.start_epoch, item)
+        for item in remote_events if item.start_epoch is not None
+    )
+    if not len(index):
+        return []
+
+    replacements = []
+    claimed = set()
+    for event in new_events:
+        if event.is_modified_instance():
+            continue
+        start_epoch, end_epoch = event.get_epoch_range()
+        if start_epoch is None:
+            continue
+        title = _title_key(event.summary)
+        candidates = [
+            item for item in index.overlapping(start_epoch, end_epoch if end_epoch is not None else UNBOUNDED_EPOCH)
+            if item.google_event_id not in claimed and item.recurring == event.is_recurring()
+            and _title_key(item.summary) == title
+        ]
+        if not candidates:
+            continue
+        best = min(candidates, key=lambda item: (item.start_epoch != start_epoch, item.unique_id))
+        claimed.add(best.google_event_id)
+        replacements.append(Replacement(event, best))
+    return replacements
+
+
+class ConflictResolver:
+    """
+    依 conflict_resolution 處理衝突
+    - 重新發出的事件（新 UID 與 Google 端同一時段、同標題、已不在來源中的受管理事件）：
+      source 建立新事件，舊事件依一般流程刪除；latest 沿用既有 Google 事件，以最新內容更新並改對應到新 UID；
+      manual 兩者都不處理，列入失敗報告
+    - Google 端被手動修改的事件（漂移檢查發現）：
+      source 以來源覆蓋；latest 保留較新的 Google 修改；manual 保留並列入失敗報告
+    """
+
+    def __init__(self, engine: 'SyncEngine'):
+        self.engine = engine
+        self.database = engine.database
+        self.calendar_id = engine.config.google_calendar.calendar_id
+        self.policy = engine.config.sync.conflict_resolution
+        if self.policy not in CONFLICT_POLICIES:
+            logger.warning(f"Unknown conflict_resolution '{self.policy}', using 'source'")
+            self.policy = 'source'
+
+    def resolve_replacements(self, new_events: List[EventData], updated_events: List[EventData],
+                             deleted_uids: List[str], remote_events: Sequence[RemoteEvent],
+                             dry_run: bool = False) -> Tuple[List[EventData], List[EventData], List[str]]:
+        """
+        依策略調整本週期的建立、更新與刪除，返回 (建立, 更新, 刪除)
+        latest 會先改寫映射，再交由一般的更新流程送出
+        """
+        replacements = find_replacements(new_events, remote_events)
+        if not replacements:
+            return new_events, updated_events, deleted_uids
+
+        logger.info(f"Found {len(replacements)} re-issued events colliding with existing Google events "
+                    f"(conflict_resolution: {self.policy})")
+        if self.policy == 'source' or dry_run:
+            for replacement in replacements[:5]:
+                logger.info(f"    REPLACE: {replacement.remote.unique_id} -> "
+                            f"{replacement.event.get_unique_event_id()} ({replacement.event.summary})")
+            return new_events, updated_events, deleted_uids
+
+        replaced_events = {id(replacement.event) for replacement in replacements}
+        replaced_uids = {replacement.remote.unique_id for replacement in replacements}
+        new_events = [event for event in new_events if id(event) not in replaced_events]
+        deleted_uids = [uid for uid in deleted_uids if uid not in replaced_uids]
+
+        if self.policy == 'latest':
+            for replacement in replacements:
+                self.adopt(replacement.event.get_unique_event_id(), replacement.remote)
+            self.database.flush()
+            updated_events = updated_events + [replacement.event for replacement in replacements]
+        else:
+            for replacement in replacements:
+                self.report(replacement.event.get_unique_event_id(),
+                            f"Re-issued as a new event colliding with {replacement.remote.unique_id} "
+                            f"({replacement.remote.google_event_id})",
+                            replacement.event.fingerprint)
+                self.report(replacement.remote.unique_id,
+                            f"Replaced by {replacement.event.get_unique_event_id()} in the source")
+        return new_events, updated_events, deleted_uids
+
+    def adopt(self, unique_id: str, remote: RemoteEvent) -> None:
+        """將既有的 Google 事件改對應到新 UID"""
+        self.database.save_event_mapping(unique_id, remote.google_event_id, self.calendar_id)
+        self.database.delete_event_mapping(remote.unique_id, self.calendar_id)
+        self.database.delete_event_snapshot(remote.unique_id)
+        logger.debug(f"Google event {remote.google_event_id} now tracks {unique_id} (was {remote.unique_id})")
+
+    def report(self, unique_id: str, reason: str, fingerprint: Optional[str] = None) -> None:
+        """記錄待人工處理的衝突（出現在失敗報告中，並依失敗退避暫停處理該事件）"""
+        self.engine._record_failure('conflict', unique_id, ConflictError(reason), fingerprint)
+
+    def keep_remote_edit(self, unique_id: str) -> None:
+        """
+        保留 Google 端在最後一次同步後的手動修改（policy 不是 source 時由漂移檢查呼叫）
+        latest 不覆蓋，直到來源再次修改該事件；manual 另列入失敗報告，映射維持失敗狀態直到下次成功同步
+        """
+        if self.policy == 'manual':
+            self.report(unique_id, "Edited in Google Calendar after the last sync")
+            return
+        logger.debug(f"Keeping the Google Calendar edit of {unique_id} until the source changes it")
+
+
+class ConflictError(Exception):
+    """需要人工處理的同步衝突"""
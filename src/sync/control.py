@@ -0,0 +1,135 @@
+"""
+同步控制端點
+本機 HTTP（TCP 或 Unix socket）介面，讓外部系統主動觸發同步並查詢狀態
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple, TYPE_CHECKING
+from urllib.parse import parse_qs, urlsplit
+
+from src.utils.config import ControlConfig
+
+if TYPE_CHECKING:
+    from src.sync.engine import SyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error'
+}
+
+# 請求標頭大小上限，避免本機端點被塞爆
+_MAX_HEADER_LINES = 100
+
+
+class ControlServer:
+    """
+    同步控制端點
+    POST /sync      觸發立即同步（短時間內的連續觸發會合併）
+    GET  /status    同步狀態
+    GET  /history   同步歷史（?limit=N）
+    GET  /failures  持續失敗的事件（?min_attempts=N）
+    """
+
+    def __init__(self, engine: 'SyncEngine', config: ControlConfig):
+        self.engine = engine
+        self.config = config
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """開始監聽"""
+        if self.config.unix_socket:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.config.unix_socket)
+            logger.info(f"Control endpoint listening on unix:{self.config.unix_socket}")
+        else:
+            self._server = await asyncio.start_server(self._handle, self.config.host, self.config.port)
+            logger.info(f"Control endpoint listening on http://{self.config.host}:{self.config.port}")
+
+    async def close(self) -> None:
+        """停止監聽"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """處理單一連線（每個連線一個請求）"""
+        try:
+            status, body = await self._process(reader)
+        except Exception as e:
+            logger.error(f"Control request failed: {e}")
+            status, body = 500, {'error': str(e)}
+
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode('ascii') + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _process(self, reader: asyncio.StreamReader) -> Tuple[int, Any]:
+        """解析請求並分派到對應的處理方法"""
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            return 400, {'error': 'Malformed request line'}
+        method, target, _ = parts
+
+        headers: Dict[str, str] = {}
+        for _ in range(_MAX_HEADER_LINES):
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # 讀掉請求內容，觸發原因可放在 body 中
+        content_length = int(headers.get('content-length', 0) or 0)
+        body = await reader.readexactly(content_length) if content_length > 0 else b''
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == '/sync':
+            if method != 'POST':
+                return 405, {'error': 'Use POST'}
+            reason = query.get('reason', [body.decode('utf-8', errors='replace').strip()])[0]
+            accepted = self.engine.request_sync(reason[:200])
+            return 202, {'status': 'accepted', 'coalesced': not accepted}
+
+        if url.path == '/status':
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            return 200, await asyncio.to_thread(self.engine.get_sync_status)
+
+        if url.path == '/history':
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            try:
+                limit = int(query.get('limit', ['10'])[0])
+            except ValueError:
+                return 400, {'error': 'limit must be an integer'}
+            return 200, await asyncio.to_thread(self.engine.get_sync_history, max(1, min(limit, 1000)))
+
+        if url.path == '/failures':
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            try:
+                min_attempts = int(query.get('min_attempts', ['1'])[0])
+            except ValueError:
+                return 400, {'error': 'min_attempts must be an integer'}
+            return 200, await asyncio.to_thread(self.engine.get_failure_report, min_attempts)
+
+        return 404, {'error': f'Unknown path {url.path}'}
@@ -4,13 +4,21 @@
 """
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 
+import requests
+
 from src.parsers.ics_parser import ICSParser, EventData
 from src.clients.google_calendar import GoogleCalendarClient
-from src.storage.database import SyncDatabase
+from src.storage.state_store import create_state_store
+from src.sync.conflicts import ConflictResolver, google_time_epoch
+from src.sync.pipeline import SyncPipeline
+from src.sync.polling import AdaptivePollScheduler
+from src.sync.priority import prioritize_changes, prioritize_deletes
+from src.sync.reconcile import Deduplicator, DriftChecker, Reconciler, list_unmatched_remote_events
 from src.utils.config import Config
 
 
@@ -20,17 +28,37 @@ logger = logging.getLogger(__name__)
 class SyncEngine:
     """同步引擎主類別"""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, http_session: Optional[requests.Session] = None):
         self.config = config
         
         # 初始化組件
-        self.ics_parser = ICSParser(config.source, config.processing)
         self.google_client = GoogleCalendarClient(config.google_calendar)
-        self.database = SyncDatabase(config.database)
+        self.database = create_state_store(config.database, config.processing.timezone)
+        self.ics_parser = ICSParser(config.source, config.processing, session=http_session,
+                                    state_store=self.database)
         
         # 同步狀態
         self.is_running = False
         self.current_session_id = None
+        self.last_maintenance_at: Optional[datetime] = None
+        self.last_backup_at: Optional[datetime] = None
+        self.last_drift_check_at: Optional[datetime] = None
+        self.conflict_resolver = ConflictResolver(self)
+        self.drift_checker = DriftChecker(self)
+        self._backup_task: Optional[asyncio.Task] = None
+        
+        # 寫入前的檢查（分片模式下由租約提供，失去租約時拋出例外以停止寫入）
+        self.write_guard: Optional[Callable[[], None]] = None
+        
+        # 控制端點的即時同步觸發
+        self._sync_requested = asyncio.Event()
+        
+        # 目前週期的進度狀態（outbox 接續與時間預算）
+        self._unconfirmed_uids: set = set()
+        self._failures: Dict[str, Dict[str, Any]] = {}
+        self._touched_uids: set = set()
+        self._deadline: Optional[float] = None
+        self._budget_exhausted = False
     
     async def sync_once(self, force: bool = False, dry_run: bool = False) -> Dict[str, Any]:
         """執行一次同步"""
@@ -62,66 +90,24 @@ class SyncEngine:
             
             logger.info(f"Sync range: {start_date.date()} to {end_date.date()}")
             
-            # 3. 解析和展開 ICS 事件
-            logger.info("Fetching and parsing ICS events...")
-            current_events, modified_instances = self.ics_parser.parse_and_expand(start_date, end_date)
-            stats['events_processed'] = len(current_events)
-
-            # 4. 偵測變更
-            logger.info("Detecting changes...")
-            new_events, updated_events, deleted_uids = self.database.detect_changes(current_events)
-
-            # 4.3 處理修改的週期實例 - 需要刪除原始日期上的舊實例
-            modified_instance_cleanups = self._detect_modified_instance_cleanups(modified_instances)
-            if modified_instance_cleanups:
-                logger.info(f"Found {len(modified_instance_cleanups)} modified recurring instances that need cleanup")
-                deleted_uids.extend(modified_instance_cleanups)
-
-            # 4.5 偵測週期事件系列的孤兒事件
-            orphaned_uids = self.database.get_orphaned_series_events(current_events)
-            if orphaned_uids:
-                deleted_uids.extend(orphaned_uids)
+            # 載入上次未完成的操作，並設定本週期的時間預算
+            outbox = self._begin_cycle()
             
-            # 5. 執行同步操作
-            if not dry_run:
-                # 處理新事件
-                if new_events:
-                    logger.info(f"Creating {len(new_events)} new events...")
-                    created_count = await self._create_events(new_events)
-                    stats['events_created'] = created_count
-                
-                # 處理更新事件
-                if updated_events:
-                    logger.info(f"Updating {len(updated_events)} events...")
-                    updated_count = await self._update_events(updated_events)
-                    stats['events_updated'] = updated_count
-                
-                # 處理刪除事件
-                if deleted_uids and self.config.sync.enable_delete:
-                    logger.info(f"Deleting {len(deleted_uids)} events...")
-                    deleted_count = await self._delete_events(deleted_uids)
-                    stats['events_deleted'] = deleted_count
-                
-                # 更新事件快照
-                logger.info("Updating event snapshots...")
-                for event in current_events:
-                    self.database.save_event_snapshot(event)
+            if force:
+                # 3-5. 強制模式：與 Google 端實際狀態完整比對
+                await Reconciler(self).run(start_date, end_date, stats, dry_run)
+            elif self.config.sync.pipeline_enabled and not dry_run:
+                # 3-5. 管線模式：解析、變更偵測與 API 派送同時進行
+                logger.info("Running pipelined sync...")
+                stats.update(await SyncPipeline(self).run(start_date, end_date))
                 
+                # 壓縮已滑出同步窗口的快照
+                self.database.prune_expired_snapshots(start_date)
             else:
-                # Dry run - 只顯示會做什麼
-                logger.info("DRY RUN - Would perform the following actions:")
-                logger.info(f"  Create {len(new_events)} new events")
-                logger.info(f"  Update {len(updated_events)} events")
-                logger.info(f"  Delete {len(deleted_uids)} events")
-                
-                for event in new_events[:5]:  # 顯示前5個新事件
-                    logger.info(f"    NEW: {event.summary} ({event.start_datetime})")
-                
-                for event in updated_events[:5]:  # 顯示前5個更新事件
-                    logger.info(f"    UPDATE: {event.summary} ({event.start_datetime})")
-                
-                for uid in deleted_uids[:5]:  # 顯示前5個刪除事件
-                    logger.info(f"    DELETE: {uid}")
+                await self._sync_sequential(start_date, end_date, stats, dry_run)
+            
+            if not dry_run:
+                self._end_cycle(outbox)
             
             # 更新同步會話狀態
             self.database.update_sync_session(
@@ -149,159 +135,668 @@ class SyncEngine:
             raise
         
         finally:
+            # 週期結束屏障：確保映射與會話狀態都已提交
+            self.database.flush()
             self.current_session_id = None
     
+    async def _sync_sequential(self, start_date: datetime, end_date: datetime,
+                               stats: Dict[str, Any], dry_run: bool) -> None:
+        """依序執行解析、變更偵測與同步操作"""
+        # 3. 解析和展開 ICS 事件
+        logger.info("Fetching and parsing ICS events...")
+        current_events, modified_instances = self.ics_parser.parse_and_expand(start_date, end_date)
+        stats['events_processed'] = len(current_events)
+
+        # 4. 偵測變更
+        logger.info("Detecting changes...")
+        new_events, updated_events, deleted_uids = self.database.detect_changes(
+            current_events, window_start=start_date
+        )
+
+        # 4.3 處理修改的週期實例 - 需要刪除原始日期上的舊實例
+        modified_instance_cleanups = self._detect_modified_instance_cleanups(modified_instances)
+        if modified_instance_cleanups:
+            logger.info(f"Found {len(modified_instance_cleanups)} modified recurring instances that need cleanup")
+            deleted_uids.extend(modified_instance_cleanups)
+
+        # 4.5 偵測週期事件系列的孤兒事件
+        orphaned_uids = self.database.get_orphaned_series_events(current_events, window_start=start_date)
+        if orphaned_uids:
+            deleted_uids.extend(orphaned_uids)
+        
+        if not dry_run:
+            self._prune_failures({event.get_unique_event_id() for event in current_events})
+        
+        # 4.6 略過仍在重試退避期間的失敗事件（仍視為有變更，不更新快照）
+        changed_events = {id(event) for event in new_events + updated_events}
+        new_events, updated_events, deleted_uids = self._skip_backoff(
+            new_events, updated_events, deleted_uids
+        )
+        
+        # 4.7 與 Google 端已不在來源中的受管理事件衝突的新事件（來源以新 UID 重新發出），依 conflict_resolution 處理；
+        # source 的結果與一般流程相同，不需額外列出遠端事件
+        if new_events and not dry_run and self.conflict_resolver.policy != 'source':
+            remote_events = list_unmatched_remote_events(
+                self, new_events, {event.get_unique_event_id() for event in current_events}, start_date, end_date
+            )
+            new_events, updated_events, deleted_uids = self.conflict_resolver.resolve_replacements(
+                new_events, updated_events, deleted_uids, remote_events
+            )
+        
+        # 5. 執行同步操作
+        if not dry_run:
+            # 依緊急程度排序新增、更新與刪除，近期事件優先
+            now = datetime.now(ZoneInfo(self.config.processing.timezone))
+            scheduled, deferred = prioritize_changes(
+                [('create', event) for event in new_events] +
+                [('update', event) for event in updated_events],
+                now,
+                self.config.sync.priority_tiers_hours,
+                self.config.sync.max_far_future_changes_per_cycle
+            )
+            if deferred:
+                logger.info(f"Deferring {len(deferred)} far-future changes to later cycles")
+            deleted_uids = prioritize_deletes(
+                deleted_uids,
+                {uid: self.database.get_event_snapshot(uid) for uid in deleted_uids},
+                now,
+                self.config.sync.priority_tiers_hours
+            )
+            
+            # 記錄本週期的操作計畫，中斷後可由 outbox 接續
+            planned_deletes = deleted_uids if self.config.sync.enable_delete else []
+            self.database.plan_operations(
+                [(operation, event.get_unique_event_id()) for operation, event in scheduled] +
+                [('delete', uid) for uid in planned_deletes]
+            )
+            
+            if scheduled:
+                logger.info(f"Applying {len(scheduled)} changes (near-term first)...")
+                created_count, updated_count = await self._apply_changes(scheduled)
+                stats['events_created'] = created_count
+                stats['events_updated'] = updated_count
+            
+            # 處理刪除事件
+            if deleted_uids and self.config.sync.enable_delete:
+                logger.info(f"Deleting {len(deleted_uids)} events...")
+                deleted_count = await self._delete_events(deleted_uids)
+                stats['events_deleted'] = deleted_count
+            
+            # 更新未變更事件的快照；變更的事件在操作成功時已各自記錄，
+            # 失敗、延後或超出時間預算的變更下次同步會再次偵測
+            logger.info("Updating event snapshots...")
+            for event in current_events:
+                if id(event) not in changed_events:
+                    self.database.save_event_snapshot(event)
+            
+            # 壓縮已滑出同步窗口的快照
+            self.database.prune_expired_snapshots(start_date)
+            
+        else:
+            # Dry run - 只顯示會做什麼
+            logger.info("DRY RUN - Would perform the following actions:")
+            logger.info(f"  Create {len(new_events)} new events")
+            logger.info(f"  Update {len(updated_events)} events")
+            logger.info(f"  Delete {len(deleted_uids)} events")
+            
+            # 以實例層級預覽變更在同步窗口內涵蓋的發生次數（週期系列的展開結果會被快取）
+            occurrences = self.ics_parser.expand_recurring_events(
+                new_events + updated_events, start_date, end_date
+            )
+            logger.info(f"  Changes cover {len(occurrences)} event instances in the sync window")
+            
+            for event in new_events[:5]:  # 顯示前5個新事件
+                logger.info(f"    NEW: {event.summary} ({event.start_datetime}){self._preview_instances(event, start_date, end_date)}")
+            
+            for event in updated_events[:5]:  # 顯示前5個更新事件
+                logger.info(f"    UPDATE: {event.summary} ({event.start_datetime}){self._preview_instances(event, start_date, end_date)}")
+            
+            for uid in deleted_uids[:5]:  # 顯示前5個刪除事件
+                logger.info(f"    DELETE: {uid}")
+    
+    def _preview_instances(self, event: EventData, start_date: datetime, end_date: datetime) -> str:
+        """週期系列在同步窗口內的實例數（dry run 預覽用）"""
+        if not event.is_recurring():
+            return ""
+        try:
+            occurrences = self.ics_parser.expander.expand(event, start_date, end_date)
+        except Exception as e:
+            logger.debug(f"Failed to expand {event.uid} for preview: {e}")
+            return ""
+        return f", {len(occurrences)} instances in window"
+    
     async def start_continuous_sync(self) -> None:
         """開始持續同步模式"""
         self.is_running = True
         logger.info(f"Starting continuous sync (interval: {self.config.sync.interval_minutes} minutes)")
         
+        scheduler = AdaptivePollScheduler(self.config.sync)
+        
         while self.is_running:
             try:
-                await self.sync_once()
+                stats = await self.sync_once()
+                await self.run_housekeeping()
                 
-                # 等待下次同步
+                # 等待下次同步（依變更頻率調整間隔）
                 if self.is_running:
-                    await asyncio.sleep(self.config.sync.interval_minutes * 60)
+                    await self._wait_for_next_cycle(scheduler.next_delay(stats))
                     
             except Exception as e:
                 logger.error(f"Error in continuous sync: {e}")
-                # 等待較短時間後重試
+                # 以指數退避等待後重試
                 if self.is_running:
-                    await asyncio.sleep(300)  # 5分鐘後重試
+                    await self._wait_for_next_cycle(scheduler.failure_delay())
+    
+    def request_sync(self, reason: str = "") -> bool:
+        """
+        要求立即同步，取消目前的等待
+        返回 False 表示已有待處理的觸發，本次觸發已合併
+        """
+        if self._sync_requested.is_set():
+            return False
+        logger.info(f"Sync requested{f' ({reason})' if reason else ''}")
+        self._sync_requested.set()
+        return True
+    
+    async def _wait_for_next_cycle(self, delay: float) -> None:
+        """等待下次同步，收到觸發時提早結束"""
+        try:
+            await asyncio.wait_for(self._sync_requested.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            return
+        
+        if self.is_running:
+            # 去抖動：短時間內連續的觸發合併為一次同步
+            await asyncio.sleep(self.config.control.debounce_seconds)
+        # 同步開始前清除，同步期間收到的觸發會在完成後再執行一次
+        self._sync_requested.clear()
+    
+    async def run_housekeeping(self) -> None:
+        """同步週期之間的例行工作：資料庫維護、漂移檢查與線上備份"""
+        if self._maintenance_due():
+            await self.run_maintenance()
+        
+        # 低頻率檢查 Google 端的手動修改與刪除
+        if self._drift_check_due():
+            await self.run_drift_check()
+        
+        # 線上備份在背景進行，不延遲下一次同步
+        if self._backup_due():
+            self._backup_task = asyncio.create_task(self._run_backup())
+    
+    def _drift_check_due(self) -> bool:
+        """判斷是否到了執行漂移檢查的時間"""
+        interval_hours = self.config.sync.drift_check_interval_hours
+        if interval_hours <= 0:
+            return False
+        if self.last_drift_check_at is None:
+            return True
+        return datetime.now() - self.last_drift_check_at >= timedelta(hours=interval_hours)
+    
+    async def run_drift_check(self) -> None:
+        """執行一次有 API 預算限制的漂移檢查"""
+        try:
+            await asyncio.to_thread(self.drift_checker.run)
+        except Exception as e:
+            logger.error(f"Drift check failed: {e}")
+        finally:
+            self.last_drift_check_at = datetime.now()
+    
+    def _maintenance_due(self) -> bool:
+        """判斷是否到了執行資料庫維護的時間"""
+        if self.last_maintenance_at is None:
+            return True
+        interval = timedelta(hours=self.config.database.maintenance_interval_hours)
+        return datetime.now() - self.last_maintenance_at >= interval
+    
+    async def run_maintenance(self) -> None:
+        """執行資料庫維護：歷史保留、分段增量 VACUUM、optimize 與備份輪替"""
+        db_config = self.config.database
+        logger.info("Running database maintenance...")
+        
+        try:
+            self.database.cleanup_old_data(db_config.history_retention_days)
+            
+            # 分段回收空閒頁面，每步之間讓出事件迴圈
+            remaining = 0
+            for _ in range(db_config.vacuum_max_steps):
+                remaining = self.database.incremental_vacuum(db_config.vacuum_pages_per_step)
+                if remaining == 0:
+                    break
+                await asyncio.sleep(0)
+            if remaining:
+                logger.info(f"Incremental vacuum paused with {remaining} free pages left")
+            
+            self.database.optimize()
+            self.database.rotate_backups()
+            
+        except Exception as e:
+            logger.error(f"Database maintenance failed: {e}")
+        
+        finally:
+            self.last_maintenance_at = datetime.now()
+    
+    def _backup_due(self) -> bool:
+        """判斷是否需要啟動新的線上備份"""
+        interval_hours = self.config.database.backup_interval_hours
+        if interval_hours <= 0:
+            return False
+        if self._backup_task is not None and not self._backup_task.done():
+            return False
+        if self.last_backup_at is None:
+            return True
+        return datetime.now() - self.last_backup_at >= timedelta(hours=interval_hours)
+    
+    async def _run_backup(self) -> None:
+        """執行一次線上增量備份"""
+        self.last_backup_at = datetime.now()
+        try:
+            await self.database.backup_database_async()
+        except Exception as e:
+            logger.error(f"Online database backup failed: {e}")
     
     def stop_continuous_sync(self) -> None:
         """停止持續同步"""
         logger.info("Stopping continuous sync...")
         self.is_running = False
+        self._sync_requested.set()
     
-    async def _create_events(self, events: List[EventData]) -> int:
-        """建立新事件"""
+    async def _apply_changes(self, changes: List[Tuple[str, EventData]]) -> Tuple[int, int]:
+        """依序套用已排序的新增/更新變更，返回 (建立數量, 更新數量)"""
         created_count = 0
+        updated_count = 0
         
-        for event in events:
-            try:
-                # 建立 Google Calendar 事件
-                google_event = self.google_client.create_event(event)
+        for operation, event in changes:
+            if self._deadline_passed():
+                break
+            if self._run_operation(operation, event):
+                if operation == 'create':
+                    created_count += 1
+                else:
+                    updated_count += 1
+        
+        return created_count, updated_count
+    
+    async def _delete_events(self, deleted_uids: List[str]) -> int:
+        """刪除事件"""
+        deleted_count = 0
+        
+        for uid in deleted_uids:
+            if self._deadline_passed():
+                break
+            if self._run_operation('delete', uid):
+                deleted_count += 1
+        
+        return deleted_count
+    
+    def _begin_cycle(self) -> Dict[str, Dict[str, Any]]:
+        """載入 outbox 中未完成的操作並設定本週期的期限"""
+        outbox = self.database.get_outbox()
+        # 進行中或失敗的建立操作可能已在 Google 端生效，重試前需先尋找既有事件
+        self._unconfirmed_uids = {
+            uid for uid, entry in outbox.items() if entry['status'] != 'pending'
+        }
+        self._touched_uids = set()
+        self._budget_exhausted = False
+        self._failures = self.database.get_event_failures()
+        
+        budget = self.config.sync.cycle_time_budget_seconds
+        self._deadline = time.monotonic() + budget if budget > 0 else None
+        
+        if outbox:
+            logger.info(f"Resuming {len(outbox)} operations left by an earlier cycle "
+                        f"({len(self._unconfirmed_uids)} unconfirmed)")
+        return outbox
+    
+    def _end_cycle(self, outbox: Dict[str, Dict[str, Any]]) -> None:
+        """週期完整結束後，移除本週期未再出現的舊操作紀錄"""
+        if self._budget_exhausted:
+            return
+        stale_uids = [uid for uid in outbox if uid not in self._touched_uids]
+        if stale_uids:
+            self.database.discard_operations(stale_uids)
+    
+    def _deadline_passed(self) -> bool:
+        """檢查是否已用完本週期的時間預算"""
+        if self._deadline is None or time.monotonic() < self._deadline:
+            return False
+        if not self._budget_exhausted:
+            self._budget_exhausted = True
+            logger.info("Cycle time budget exhausted, remaining operations continue next cycle")
+        return True
+    
+    def _in_backoff(self, uid: str, fingerprint: Optional[str] = None) -> bool:
+        """判斷事件是否仍在失敗重試的退避期間（來源內容變更後立即重試）"""
+        failure = self._failures.get(uid)
+        if failure is None:
+            return False
+        if fingerprint is not None and failure.get('fingerprint') != fingerprint:
+            return False
+        return time.time() < failure['next_attempt_at']
+    
+    def _skip_backoff(self, new_events: List[EventData], updated_events: List[EventData],
+                      deleted_uids: List[str]) -> Tuple[List[EventData], List[EventData], List[str]]:
+        """從變更中移除仍在退避期間的事件"""
+        if not self._failures:
+            return new_events, updated_events, deleted_uids
+        
+        def eligible(event: EventData) -> bool:
+            return not self._in_backoff(event.get_unique_event_id(), event.fingerprint)
+        
+        kept_new = [event for event in new_events if eligible(event)]
+        kept_updated = [event for event in updated_events if eligible(event)]
+        kept_deleted = [uid for uid in deleted_uids if not self._in_backoff(uid)]
+        
+        skipped = (len(new_events) + len(updated_events) + len(deleted_uids) -
+                   len(kept_new) - len(kept_updated) - len(kept_deleted))
+        if skipped:
+            logger.info(f"Skipping {skipped} failing events still in retry backoff")
+        return kept_new, kept_updated, kept_deleted
+    
+    def _record_failure(self, operation: str, uid: str, error: Exception,
+                        fingerprint: Optional[str] = None) -> None:
+        """記錄事件失敗並以指數退避安排下次重試（可在工作執行緒中呼叫）"""
+        previous = self._failures.get(uid)
+        attempts = previous['attempts'] + 1 if previous else 1
+        delay = min(
+            self.config.sync.event_retry_backoff_minutes * 60 * 2 ** (attempts - 1),
+            self.config.sync.event_retry_max_hours * 3600
+        )
+        now = datetime.now().isoformat()
+        
+        failure = {
+            'original_uid': uid,
+            'operation': operation,
+            'fingerprint': fingerprint,
+            'attempts': attempts,
+            'last_error': str(error)[:1000],
+            'first_failed_at': previous['first_failed_at'] if previous else now,
+            'last_failed_at': now,
+            'next_attempt_at': time.time() + delay
+        }
+        self._failures[uid] = failure
+        self.database.save_event_failure(failure, self.config.google_calendar.calendar_id)
+        logger.info(f"Event {uid} failed {attempts} time(s), next attempt in {delay // 60} minutes")
+    
+    def _prune_failures(self, current_uids: Set[str]) -> None:
+        """
+        來源已完整解析後，移除已不在來源中的事件的失敗紀錄（可在工作執行緒中呼叫）
+        仍有快照的事件尚待刪除，保留其紀錄
+        """
+        stale_uids = [
+            uid for uid in self._failures
+            if uid not in current_uids and self.database.get_event_snapshot(uid) is None
+        ]
+        for uid in stale_uids:
+            self._failures.pop(uid, None)
+            self.database.clear_event_failure(uid)
+        if stale_uids:
+            logger.info(f"Dropped {len(stale_uids)} failure records of events no longer in the source")
+    
+    def get_failure_report(self, min_attempts: int = 1) -> List[Dict[str, Any]]:
+        """取得持續失敗事件的報告，依失敗次數排序"""
+        failures = [
+            failure for failure in self.database.get_event_failures().values()
+            if failure['attempts'] >= min_attempts
+        ]
+        return sorted(failures, key=lambda failure: (-failure['attempts'], failure['original_uid']))
+    
+    def remove_duplicates(self, dry_run: bool = False) -> Dict[str, Any]:
+        """清理 Google 端的重複事件，每個來源事件只保留映射指向的一筆"""
+        self.google_client.authenticate()
+        return Deduplicator(self).run(dry_run=dry_run)
+    
+    def _run_operation(self, operation: str, payload) -> bool:
+        """
+        套用單一變更並記錄於 outbox（可在工作執行緒中呼叫）
+        操作成功後映射、快照與 outbox 完成紀錄依序提交，中斷時不會重複已完成的工作
+        """
+        uid = payload if operation == 'delete' else payload.get_unique_event_id()
+        self.database.begin_operation(operation, uid)
+        self._touched_uids.add(uid)
+        
+        if operation == 'create':
+            applied = self._apply_create(payload, adopt=uid in self._unconfirmed_uids)
+        elif operation == 'update':
+            applied = self._apply_update(payload)
+        else:
+            applied = self._apply_delete(payload)
+        
+        if applied and operation != 'delete':
+            self.database.save_event_snapshot(payload)
+        if applied and uid in self._failures:
+            self._failures.pop(uid, None)
+            self.database.clear_event_failure(uid)
+        self.database.finish_operation(uid, applied)
+        return applied
+    
+    def _check_write_guard(self) -> None:
+        """寫入 Google Calendar 前的檢查，未通過時中止整個同步週期"""
+        if self.write_guard is not None:
+            self.write_guard()
+    
+    def _apply_create(self, event: EventData, adopt: bool = False) -> bool:
+        """
+        建立單一事件並儲存映射（可在工作執行緒中呼叫）
+        adopt=True 時先尋找先前中斷的建立操作是否已在 Google 端產生事件
+        """
+        self._check_write_guard()
+        if self._uses_native_instance(event):
+            return self._apply_instance('create', event)
+        try:
+            if adopt and self._adopt_existing_event(event):
+                return True
+            
+            # 建立 Google Calendar 事件
+            google_event = self.google_client.create_event(event)
+            
+            # 儲存映射關係
+            unique_id = event.get_unique_event_id()
+            self.database.save_event_mapping(
+                unique_id,
+                google_event['id'],
+                self.config.google_calendar.calendar_id
+            )
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to create event {event.uid}: {e}")
+            self._record_failure('create', event.get_unique_event_id(), e, event.fingerprint)
+            return False
+    
+    def _adopt_existing_event(self, event: EventData) -> bool:
+        """接手先前中斷時已建立的事件，返回是否找到"""
+        unique_id = event.get_unique_event_id()
+        existing = self.google_client.find_events_by_unique_id(unique_id)
+        if not existing:
+            return False
+        
+        google_event_id = existing[0]['id']
+        self.google_client.update_event(google_event_id, event)
+        self.database.save_event_mapping(
+            unique_id,
+            google_event_id,
+            self.config.google_calendar.calendar_id
+        )
+        logger.info(f"Adopted event {google_event_id} created by an interrupted cycle for {unique_id}")
+        return True
+    
+    def _apply_update(self, event: EventData) -> bool:
+        """更新單一事件，找不到對應事件時改為建立（可在工作執行緒中呼叫）"""
+        self._check_write_guard()
+        if self._uses_native_instance(event):
+            return self._apply_instance('update', event)
+        try:
+            # 查找 Google Calendar 事件 ID
+            unique_id = event.get_unique_event_id()
+            mapping = self.database.get_event_mapping(
+                unique_id, 
+                self.config.google_calendar.calendar_id
+            )
+            
+            if mapping:
+                # 更新現有事件
+                self.google_client.update_event(
+                    mapping['google_event_id'],
+                    event
+                )
                 
-                # 儲存映射關係
-                unique_id = event.get_unique_event_id()
+                # 更新映射的同步時間
                 self.database.save_event_mapping(
                     unique_id,
-                    google_event['id'],
+                    mapping['google_event_id'],
                     self.config.google_calendar.calendar_id
                 )
                 
-                created_count += 1
-                
-            except Exception as e:
-                logger.error(f"Failed to create event {event.uid}: {e}")
-                continue
-        
-        return created_count
-    
-    async def _update_events(self, events: List[EventData]) -> int:
-        """更新事件"""
-        updated_count = 0
-        
-        for event in events:
-            try:
-                # 查找 Google Calendar 事件 ID
-                unique_id = event.get_unique_event_id()
-                mapping = self.database.get_event_mapping(
-                    unique_id, 
-                    self.config.google_calendar.calendar_id
-                )
+            else:
+                # 如果找不到映射，嘗試搜尋 Google Calendar
+                google_event_id = self._find_unmapped_event(event, unique_id)
                 
-                if mapping:
-                    # 更新現有事件
-                    google_event = self.google_client.update_event(
-                        mapping['google_event_id'],
+                if google_event_id:
+                    # 找到對應事件，更新並建立映射
+                    self.google_client.update_event(
+                        google_event_id,
                         event
                     )
                     
-                    # 更新映射的同步時間
                     self.database.save_event_mapping(
                         unique_id,
-                        mapping['google_event_id'],
+                        google_event_id,
                         self.config.google_calendar.calendar_id
                     )
                     
-                    updated_count += 1
-                    
                 else:
-                    # 如果找不到映射，嘗試搜尋 Google Calendar
-                    google_events = self.google_client.find_events_by_original_uid(event.uid)
+                    # 找不到對應事件，建立新事件
+                    logger.warning(f"Event {unique_id} not found in Google Calendar, creating new")
+                    google_event = self.google_client.create_event(event)
                     
-                    if google_events:
-                        # 找到對應事件，更新並建立映射
-                        google_event = self.google_client.update_event(
-                            google_events[0]['id'],
-                            event
-                        )
-                        
-                        self.database.save_event_mapping(
-                            unique_id,
-                            google_events[0]['id'],
-                            self.config.google_calendar.calendar_id
-                        )
-                        
-                        updated_count += 1
-                        
-                    else:
-                        # 找不到對應事件，建立新事件
-                        logger.warning(f"Event {unique_id} not found in Google Calendar, creating new")
-                        google_event = self.google_client.create_event(event)
-                        
-                        self.database.save_event_mapping(
-                            unique_id,
-                            google_event['id'],
-                            self.config.google_calendar.calendar_id
-                        )
-                        
-                        updated_count += 1
-                
-            except Exception as e:
-                logger.error(f"Failed to update event {event.uid}: {e}")
-                continue
-        
-        return updated_count
+                    self.database.save_event_mapping(
+                        unique_id,
+                        google_event['id'],
+                        self.config.google_calendar.calendar_id
+                    )
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to update event {event.uid}: {e}")
+            self._record_failure('update', event.get_unique_event_id(), e, event.fingerprint)
+            return False
     
-    async def _delete_events(self, deleted_uids: List[str]) -> int:
-        """刪除事件"""
-        deleted_count = 0
+    def _find_unmapped_event(self, event: EventData, unique_id: str) -> Optional[str]:
+        """
+        以 syncUniqueID 尋找沒有映射的事件，返回 Google 事件 ID
+        只帶 originalUID 的舊版事件才以 originalUID 比對：修改實例與主事件共用 originalUID，
+        因此修改實例只接受開始時間與原始或目前開始時間相同的單次事件，不會覆蓋週期主事件
+        """
+        existing = self.google_client.find_events_by_unique_id(unique_id)
+        if existing:
+            return existing[0]['id']
         
-        for uid in deleted_uids:
-            try:
-                # 查找 Google Calendar 事件 ID
-                mapping = self.database.get_event_mapping(
-                    uid, 
+        candidates = [
+            item for item in self.google_client.find_events_by_original_uid(event.uid)
+            if not item.get('extendedProperties', {}).get('private', {}).get('syncUniqueID')
+        ]
+        if event.is_modified_instance():
+            zone = ZoneInfo(event.timezone)
+            original_start = event.recurrence_id.dt if hasattr(event.recurrence_id, 'dt') else event.recurrence_id
+            starts = {event._to_epoch(original_start), event.get_epoch_range()[0]}
+            candidates = [
+                item for item in candidates
+                if not item.get('recurrence') and google_time_epoch(item.get('start', {}), zone) in starts
+            ]
+        else:
+            candidates = [item for item in candidates if bool(item.get('recurrence')) == event.is_recurring()]
+        return candidates[0]['id'] if candidates else None
+    
+    def _uses_native_instance(self, event: EventData) -> bool:
+        """修改實例是否以 Google 週期事件的原生實例同步（exception_mode: instance）"""
+        return self.config.processing.exception_mode == "instance" and event.is_modified_instance()
+    
+    def _apply_instance(self, operation: str, event: EventData) -> bool:
+        """
+        將修改實例套用到 Google 週期事件的對應實例（可在工作執行緒中呼叫）
+        主事件尚未建立時不記錄失敗，下次同步重新偵測後再套用
+        """
+        unique_id = event.get_unique_event_id()
+        calendar_id = self.config.google_calendar.calendar_id
+        try:
+            master_mapping = self.database.get_event_mapping(event.uid, calendar_id)
+            if master_mapping is None:
+                # 主事件可能剛由其他工作者建立，映射仍在寫入佇列中
+                self.database.flush()
+                master_mapping = self.database.get_event_mapping(event.uid, calendar_id)
+            if master_mapping is None:
+                logger.info(f"Series {event.uid} is not synced yet, deferring instance {unique_id} to next cycle")
+                return False
+            
+            original_start = event.recurrence_id.dt if hasattr(event.recurrence_id, 'dt') else event.recurrence_id
+            if isinstance(original_start, datetime) and original_start.tzinfo is None:
+                original_start = original_start.replace(tzinfo=ZoneInfo(event.timezone))
+            
+            instance = self.google_client.patch_instance(
+                master_mapping['google_event_id'], event, original_start
+            )
+            self.database.save_event_mapping(unique_id, instance['id'], calendar_id)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to {operation} instance {unique_id}: {e}")
+            self._record_failure(operation, unique_id, e, event.fingerprint)
+            return False
+    
+    def _apply_delete(self, uid: str) -> bool:
+        """刪除單一事件及其映射與快照（可在工作執行緒中呼叫）"""
+        self._check_write_guard()
+        try:
+            # 查找 Google Calendar 事件 ID
+            mapping = self.database.get_event_mapping(
+                uid, 
+                self.config.google_calendar.calendar_id
+            )
+            
+            deleted = False
+            if mapping and self.config.processing.exception_mode == "instance" and '_RECUR_' in uid:
+                # 來源移除了修改實例：將 Google 端的實例還原為系列內容
+                master_mapping = self.database.get_event_mapping(
+                    uid.split('_RECUR_', 1)[0],
                     self.config.google_calendar.calendar_id
                 )
-                
-                if mapping:
-                    # 刪除 Google Calendar 事件
-                    self.google_client.delete_event(mapping['google_event_id'])
-                    
-                    # 刪除映射關係
-                    self.database.delete_event_mapping(
-                        uid,
-                        self.config.google_calendar.calendar_id
+                if master_mapping:
+                    self.google_client.reset_instance(
+                        master_mapping['google_event_id'], mapping['google_event_id']
                     )
-                    
-                    deleted_count += 1
-                    
-                else:
-                    logger.warning(f"No mapping found for deleted event {uid}")
+                self.database.delete_event_mapping(
+                    uid,
+                    self.config.google_calendar.calendar_id
+                )
+                deleted = True
                 
-                # 刪除事件快照（無論是否有映射）
-                # 這個操作需要在 database.py 中添加相應方法
+            elif mapping:
+                # 刪除 Google Calendar 事件
+                self.google_client.delete_event(mapping['google_event_id'])
                 
-            except Exception as e:
-                logger.error(f"Failed to delete event {uid}: {e}")
-                continue
-        
-        return deleted_count
+                # 刪除映射關係
+                self.database.delete_event_mapping(
+                    uid,
+                    self.config.google_calendar.calendar_id
+                )
+                
+                deleted = True
+                
+            else:
+                logger.warning(f"No mapping found for deleted event {uid}")
+            
+            # 刪除事件快照（無論是否有映射）
+            self.database.delete_event_snapshot(uid)
+            
+            return deleted
+            
+        except Exception as e:
+            logger.error(f"Failed to delete event {uid}: {e}")
+            self._record_failure('delete', uid, e)
+            return False
     
     def get_sync_status(self) -> Dict[str, Any]:
         """取得同步狀態"""
@@ -0,0 +1,197 @@
+"""
+租約分片
+多個 CalendarBridge 節點透過共用的租約儲存分配租戶，
+以心跳維持租約、逾期自動接手，並在節點加入或離開時重新平衡
+"""
+import hashlib
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLostError(RuntimeError):
+    """節點已不再持有租戶的租約，不可繼續寫入"""
+
+
+class LeaseStore:
+    """
+    以 SQLite 檔案實作的租約儲存
+    每次操作都在 BEGIN IMMEDIATE 交易中進行，由檔案鎖保證多個節點之間互斥
+    """
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_seconds
+
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS lease_nodes (
+                    node_id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tenant_leases (
+                    tenant_id TEXT PRIMARY KEY,
+                    node_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """取得寫入鎖並在單一交易中執行"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, node_id: str, now: float) -> List[str]:
+        """更新節點心跳並移除逾時的節點，返回存活節點清單"""
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT INTO lease_nodes (node_id, heartbeat_at) VALUES (?, ?)
+                ON CONFLICT(node_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+            ''', (node_id, now))
+            conn.execute('DELETE FROM lease_nodes WHERE heartbeat_at <= ?', (now - self.ttl,))
+            rows = conn.execute('SELECT node_id FROM lease_nodes ORDER BY node_id').fetchall()
+        return [row[0] for row in rows]
+
+    def renew(self, node_id: str, tenant_ids: Iterable[str], now: float) -> Dict[str, float]:
+        """延長仍有效的租約，返回成功延長的租戶及新的到期時間"""
+        expires_at = now + self.ttl
+        renewed = {}
+        with self._transaction() as conn:
+            for tenant_id in tenant_ids:
+                cursor = conn.execute('''
+                    UPDATE tenant_leases SET expires_at = ?
+                    WHERE tenant_id = ? AND node_id = ? AND expires_at > ?
+                ''', (expires_at, tenant_id, node_id, now))
+                if cursor.rowcount:
+                    renewed[tenant_id] = expires_at
+        return renewed
+
+    def acquire(self, node_id: str, tenant_ids: Iterable[str], now: float) -> Dict[str, float]:
+        """取得未被持有或已逾期的租約，返回成功取得的租戶及到期時間"""
+        expires_at = now + self.ttl
+        acquired = {}
+        with self._transaction() as conn:
+            for tenant_id in tenant_ids:
+                cursor = conn.execute('''
+                    INSERT INTO tenant_leases (tenant_id, node_id, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(tenant_id) DO UPDATE
+                    SET node_id = excluded.node_id, expires_at = excluded.expires_at
+                    WHERE tenant_leases.node_id = excluded.node_id OR tenant_leases.expires_at <= ?
+                ''', (tenant_id, node_id, expires_at, now))
+                if cursor.rowcount:
+                    acquired[tenant_id] = expires_at
+        return acquired
+
+    def release(self, node_id: str, tenant_ids: Iterable[str]) -> None:
+        """釋放指定的租約"""
+        with self._transaction() as conn:
+            conn.executemany(
+                'DELETE FROM tenant_leases WHERE tenant_id = ? AND node_id = ?',
+                [(tenant_id, node_id) for tenant_id in tenant_ids]
+            )
+
+    def leave(self, node_id: str) -> None:
+        """節點離開：移除心跳並釋放所有租約，讓其他節點立即接手"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM tenant_leases WHERE node_id = ?', (node_id,))
+            conn.execute('DELETE FROM lease_nodes WHERE node_id = ?', (node_id,))
+
+    def get_leases(self) -> Dict[str, Dict[str, float]]:
+        """取得所有租約（監控用）"""
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT tenant_id, node_id, expires_at FROM tenant_leases').fetchall()
+        return {row[0]: {'node_id': row[1], 'expires_at': row[2]} for row in rows}
+
+
+class LeaseCoordinator:
+    """
+    單一節點的租約協調器
+    以 rendezvous hashing 決定每個租戶應由哪個存活節點負責，
+    節點增減時只有少數租戶需要移轉
+    """
+
+    def __init__(self, store: LeaseStore, node_id: str, tenant_ids: Iterable[str],
+                 safety_margin_seconds: float = 5.0):
+        self.store = store
+        self.node_id = node_id
+        self.tenant_ids = list(tenant_ids)
+        self.safety_margin = safety_margin_seconds
+        self._expires: Dict[str, float] = {}  # 持有的租約 -> 到期時間
+
+    @staticmethod
+    def _owner(tenant_id: str, nodes: List[str]) -> str:
+        """計算租戶應由哪個節點負責（權重最高者）"""
+        return max(
+            nodes,
+            key=lambda node: hashlib.sha256(f"{node}:{tenant_id}".encode('utf-8')).digest()
+        )
+
+    def rebalance(self, busy: Set[str] = frozenset()) -> Set[str]:
+        """
+        送出心跳、延長租約並依存活節點重新分配
+        正在同步中的租戶不會被釋放，待下次重新平衡時再移交
+        返回目前持有的租戶
+        """
+        now = time.time()
+        nodes = self.store.heartbeat(self.node_id, now)
+        if self.node_id not in nodes:
+            nodes.append(self.node_id)
+        desired = {tenant_id for tenant_id in self.tenant_ids if self._owner(tenant_id, nodes) == self.node_id}
+
+        held = self.store.renew(self.node_id, list(self._expires), now)
+        lost = set(self._expires) - set(held)
+        if lost:
+            logger.warning(f"Lost leases for tenants: {', '.join(sorted(lost))}")
+
+        releasing = [tenant_id for tenant_id in held if tenant_id not in desired and tenant_id not in busy]
+        if releasing:
+            self.store.release(self.node_id, releasing)
+            for tenant_id in releasing:
+                del held[tenant_id]
+            logger.info(f"Released leases for rebalancing: {', '.join(sorted(releasing))}")
+
+        acquired = self.store.acquire(
+            self.node_id, [tenant_id for tenant_id in desired if tenant_id not in held], now
+        )
+        if acquired:
+            logger.info(f"Acquired leases: {', '.join(sorted(acquired))}")
+        held.update(acquired)
+
+        self._expires = held
+        logger.debug(f"Node {self.node_id} holds {len(held)}/{len(self.tenant_ids)} tenants "
+                     f"({len(nodes)} live nodes)")
+        return set(held)
+
+    def holds(self, tenant_id: str) -> bool:
+        """判斷本節點是否仍安全地持有租約（預留時鐘誤差）"""
+        expires_at = self._expires.get(tenant_id)
+        return expires_at is not None and time.time() < expires_at - self.safety_margin
+
+    def check(self, tenant_id: str) -> None:
+        """寫入前檢查租約，失去租約時拋出 LeaseLostError"""
+        if not self.holds(tenant_id):
+            raise LeaseLostError(f"Node {self.node_id} no longer holds the lease for tenant {tenant_id}")
+
+    def leave(self) -> None:
+        """釋放所有租約並離開叢集"""
+        self.store.leave(self.node_id)
+        self._expires = {}
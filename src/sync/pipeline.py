@@ -0,0 +1,261 @@
+"""
+管線化同步
+解析、變更偵測與 API 派送三個階段以有界佇列串接，同時進行
+"""
+import asyncio
+import itertools
+import logging
+import math
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from typing import Dict, Any, List, Set, Tuple, TYPE_CHECKING
+
+from src.parsers.ics_parser import EventData
+from src.sync.priority import epoch_priority, event_priority, is_far_future
+from src.sync.reconcile import list_unmatched_remote_events
+
+if TYPE_CHECKING:
+    from src.sync.engine import SyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+# 階段之間傳遞的結束標記
+_DONE = object()
+_FAILED = object()
+
+_STAT_KEYS = {
+    'create': 'events_created',
+    'update': 'events_updated',
+    'delete': 'events_deleted'
+}
+
+
+class SyncPipeline:
+    """以有界 asyncio 佇列串接的同步管線"""
+
+    def __init__(self, engine: 'SyncEngine'):
+        self.engine = engine
+        self.database = engine.database
+        self.queue_size = max(1, engine.config.sync.pipeline_queue_size)
+        self.worker_count = max(1, engine.config.sync.pipeline_workers)
+        self.tiers_hours = engine.config.sync.priority_tiers_hours
+        self.max_far_future = engine.config.sync.max_far_future_changes_per_cycle
+        # source 以外的衝突策略需要完整的新事件與刪除清單，新事件在來源解析完後才派送
+        self.hold_creates = engine.conflict_resolver.policy != 'source'
+        self._sequence = itertools.count()
+
+        self.stats = {
+            'events_processed': 0,
+            'events_created': 0,
+            'events_updated': 0,
+            'events_deleted': 0
+        }
+        self._aborted = False
+        self._started_at = 0.0
+        self._first_change_logged = False
+
+    async def run(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
+        """執行一次管線化同步，返回統計資料"""
+        loop = asyncio.get_running_loop()
+        parsed_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        # 派送佇列依緊急程度排序，近期事件優先送出
+        dispatch_queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self._started_at = time.monotonic()
+
+        # 解析在執行緒中進行，透過有界佇列產生背壓
+        producer = loop.run_in_executor(
+            None, self._produce, loop, parsed_queue, start_date, end_date
+        )
+        detector = asyncio.create_task(self._detect(parsed_queue, dispatch_queue, start_date, end_date))
+        workers = [
+            asyncio.create_task(self._dispatch(dispatch_queue))
+            for _ in range(self.worker_count)
+        ]
+
+        try:
+            await asyncio.gather(producer, detector, *workers)
+        except BaseException:
+            await self._abort(producer, parsed_queue, [detector, *workers])
+            raise
+
+        elapsed = time.monotonic() - self._started_at
+        logger.info(f"Pipelined sync finished in {elapsed:.2f}s: {self.stats}")
+        return self.stats
+
+    async def _abort(self, producer: asyncio.Future, parsed_queue: asyncio.Queue,
+                     tasks: List[asyncio.Task]) -> None:
+        """中止管線：取消各階段並清空佇列讓解析執行緒結束"""
+        self._aborted = True
+        for task in tasks:
+            task.cancel()
+        while not producer.done():
+            while not parsed_queue.empty():
+                parsed_queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+    def _produce(self, loop: asyncio.AbstractEventLoop, parsed_queue: asyncio.Queue,
+                 start_date: datetime, end_date: datetime) -> None:
+        """階段一：串流解析 ICS，逐一送入解析佇列（執行於工作執行緒）"""
+        def put(item) -> None:
+            asyncio.run_coroutine_threadsafe(parsed_queue.put(item), loop).result()
+
+        try:
+            for event in self.engine.ics_parser.iter_events(start_date, end_date):
+                if self._aborted:
+                    return
+                put(event)
+        except Exception:
+            # 解析失敗時不可進行刪除判斷
+            if not self._aborted:
+                put(_FAILED)
+            raise
+        if not self._aborted:
+            put(_DONE)
+
+    async def _detect(self, parsed_queue: asyncio.Queue, dispatch_queue: asyncio.Queue,
+                      start_date: datetime, end_date: datetime) -> None:
+        """階段二：逐一比對快照，將需要的操作送入派送佇列"""
+        snapshots = {
+            snapshot['original_uid']: snapshot
+            for snapshot in await asyncio.to_thread(self.database.get_all_event_snapshots)
+        }
+        seen_uids = set()
+        recurring_events: List[EventData] = []
+        held_creates: List[Tuple[Any, EventData]] = []
+        deleted_uids: List[str] = []
+        counts = {'create': 0, 'update': 0, 'delete': 0, 'skipped': 0}
+        now = datetime.now(ZoneInfo(self.engine.config.processing.timezone))
+        now_epoch = int(now.timestamp())
+        far_future_count = 0
+
+        try:
+            while True:
+                item = await parsed_queue.get()
+                if item is _FAILED:
+                    return
+                if item is _DONE:
+                    break
+
+                self.stats['events_processed'] += 1
+                unique_id = item.get_unique_event_id()
+                seen_uids.add(unique_id)
+                if item.is_recurring():
+                    recurring_events.append(item)
+
+                change = self.database.classify_change(item, snapshots.get(unique_id))
+                if change and self.engine._in_backoff(unique_id, item.fingerprint):
+                    # 仍在失敗重試的退避期間
+                    counts['skipped'] += 1
+                    continue
+                if change:
+                    priority = event_priority(item, now, self.tiers_hours)
+                    if self.max_far_future > 0 and is_far_future(priority, self.tiers_hours):
+                        # 超過遠期上限的變更不派送也不記錄快照，留待之後的週期
+                        far_future_count += 1
+                        if far_future_count > self.max_far_future:
+                            continue
+                    if change == 'create' and self.hold_creates:
+                        held_creates.append((priority, item))
+                        continue
+                    counts[change] += 1
+                    await self._enqueue(dispatch_queue, priority, (change, item))
+
+            await asyncio.to_thread(self.engine._prune_failures, seen_uids)
+
+            # 來源已完整解析，才能判斷刪除
+            if self.engine.config.sync.enable_delete:
+                # 快照在解析前載入，補上解析時才得知結束時間的系列
+                for uid, end_epoch in self.engine.ics_parser.ended_series.items():
+                    if uid in snapshots and snapshots[uid]['end_epoch'] is None:
+                        snapshots[uid]['end_epoch'] = end_epoch
+                deleted_uids, expired_count = self.database.split_missing_snapshots(
+                    snapshots, seen_uids, start_date
+                )
+                orphaned_uids = await asyncio.to_thread(
+                    self.database.get_orphaned_series_events, recurring_events, start_date
+                )
+                missing_uids = deleted_uids
+                deleted_uids = []
+                for uid in dict.fromkeys(missing_uids + orphaned_uids):
+                    if self.engine._in_backoff(uid):
+                        counts['skipped'] += 1
+                        continue
+                    deleted_uids.append(uid)
+                if expired_count:
+                    logger.info(f"{expired_count} events aged out of the sync window")
+
+            if held_creates:
+                held_creates, replaced_events, deleted_uids = await self._resolve_conflicts(
+                    held_creates, deleted_uids, seen_uids, start_date, end_date
+                )
+                for event in replaced_events:
+                    counts['update'] += 1
+                    await self._enqueue(dispatch_queue, event_priority(event, now, self.tiers_hours),
+                                        ('update', event))
+            for priority, event in held_creates:
+                counts['create'] += 1
+                await self._enqueue(dispatch_queue, priority, ('create', event))
+
+            for uid in deleted_uids:
+                counts['delete'] += 1
+                snapshot = snapshots.get(uid) or {}
+                priority = epoch_priority(
+                    snapshot.get('start_epoch'), bool(snapshot.get('series_uid')),
+                    now_epoch, self.tiers_hours
+                )
+                await self._enqueue(dispatch_queue, priority, ('delete', uid))
+
+            logger.info(f"Change detection: {counts['create']} new, {counts['update']} updated, "
+                        f"{counts['delete']} deleted")
+            if counts['skipped']:
+                logger.info(f"Skipping {counts['skipped']} failing events still in retry backoff")
+            if self.max_far_future > 0 and far_future_count > self.max_far_future:
+                logger.info(f"Deferring {far_future_count - self.max_far_future} far-future changes to later cycles")
+
+        finally:
+            if not self._aborted:
+                for _ in range(self.worker_count):
+                    await self._enqueue(dispatch_queue, (math.inf, 0), _DONE)
+
+    async def _resolve_conflicts(self, held_creates: List[Tuple[Any, EventData]], deleted_uids: List[str],
+                                 seen_uids: Set[str], start_date: datetime,
+                                 end_date: datetime) -> Tuple[List[Tuple[Any, EventData]], List[EventData], List[str]]:
+        """依 conflict_resolution 處理暫存的新事件，返回 (仍需建立的新事件, 改為更新的事件, 刪除)"""
+        events = [event for _, event in held_creates]
+        remote_events = await asyncio.to_thread(
+            list_unmatched_remote_events, self.engine, events, seen_uids, start_date, end_date
+        )
+        events, replaced_events, deleted_uids = await asyncio.to_thread(
+            self.engine.conflict_resolver.resolve_replacements, events, [], deleted_uids, remote_events
+        )
+        remaining = {id(event) for event in events}
+        return [held for held in held_creates if id(held[1]) in remaining], replaced_events, deleted_uids
+
+    async def _enqueue(self, dispatch_queue: asyncio.PriorityQueue, priority, item) -> None:
+        """依優先順序放入派送佇列，同優先順序維持先進先出"""
+        await dispatch_queue.put((priority, next(self._sequence), item))
+
+    async def _dispatch(self, dispatch_queue: asyncio.PriorityQueue) -> None:
+        """階段三：API 派送工作者，於執行緒中呼叫 Google Calendar"""
+        while True:
+            _, _, item = await dispatch_queue.get()
+            if item is _DONE:
+                return
+
+            if self.engine._deadline_passed():
+                # 超出時間預算：剩餘操作不派送，下次同步接續
+                continue
+
+            operation, payload = item
+            applied = await asyncio.to_thread(self.engine._run_operation, operation, payload)
+            if not applied:
+                continue
+
+            # 快照已隨操作依序記錄，失敗的事件下次同步會重新偵測
+            self.stats[_STAT_KEYS[operation]] += 1
+
+            if not self._first_change_logged:
+                self._first_change_logged = True
+                logger.info(f"First change applied {time.monotonic() - self._started_at:.2f}s into the cycle")
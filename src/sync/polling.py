@@ -0,0 +1,56 @@
+"""
+自適應輪詢排程
+依觀察到的變更頻率調整同步間隔，失敗時使用帶抖動的指數退避
+"""
+import logging
+import random
+from typing import Dict, Any
+
+from src.utils.config import SyncConfig
+
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePollScheduler:
+    """計算下一次同步前的等待秒數"""
+
+    def __init__(self, config: SyncConfig):
+        self.config = config
+        self.min_interval = config.min_interval_minutes * 60
+        self.max_interval = max(config.max_interval_minutes * 60, self.min_interval)
+        self.current_interval = self._clamp(config.interval_minutes * 60)
+        self.consecutive_failures = 0
+
+    def _clamp(self, seconds: float) -> float:
+        """限制在最小與最大間隔之間"""
+        return min(max(seconds, self.min_interval), self.max_interval)
+
+    def next_delay(self, stats: Dict[str, Any]) -> float:
+        """同步成功後的等待秒數：有變更時加快輪詢，沒有變更時逐步放慢"""
+        self.consecutive_failures = 0
+
+        if not self.config.adaptive_polling:
+            return self.config.interval_minutes * 60
+
+        changes = (stats.get('events_created', 0) + stats.get('events_updated', 0) +
+                   stats.get('events_deleted', 0))
+        if changes > 0:
+            self.current_interval = self._clamp(self.current_interval / 2)
+        else:
+            self.current_interval = self._clamp(self.current_interval * 1.5)
+
+        logger.info(f"Next sync in {self.current_interval / 60:.1f} minutes ({changes} changes last cycle)")
+        return self.current_interval
+
+    def failure_delay(self) -> float:
+        """同步失敗後的等待秒數：指數退避並加入抖動，避免同時重試"""
+        self.consecutive_failures += 1
+        base = self.config.failure_backoff_seconds
+        cap = self.config.failure_backoff_max_minutes * 60
+
+        delay = min(cap, base * (2 ** (self.consecutive_failures - 1)))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+
+        logger.info(f"Retrying in {delay:.0f}s after {self.consecutive_failures} consecutive failures")
+        return delay
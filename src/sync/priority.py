@@ -0,0 +1,85 @@
+"""
+變更優先順序排程
+依事件開始時間的緊急程度排序待同步的變更，近期事件優先
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from src.parsers.ics_parser import EventData
+
+
+def epoch_priority(start_epoch: Optional[int], is_series: bool, now_epoch: int,
+                   tiers_hours: Sequence[int]) -> Tuple[int, int]:
+    """
+    依開始時間計算優先順序 (層級, 開始時間)，數值越小越優先
+    層級依序為 tiers_hours 的各個時段，之後是更遠的未來，最後是已過去的單次事件
+    """
+    far_tier = len(tiers_hours)
+    past_tier = far_tier + 1
+
+    if start_epoch is None:
+        return far_tier, 0
+
+    delta = start_epoch - now_epoch
+    if delta < 0:
+        # 已開始的週期系列仍有即將到來的實例，視為最緊急
+        if is_series:
+            return 0, start_epoch
+        return past_tier, -start_epoch
+
+    for tier, hours in enumerate(tiers_hours):
+        if delta <= hours * 3600:
+            return tier, start_epoch
+    return far_tier, start_epoch
+
+
+def event_priority(event: EventData, now: datetime, tiers_hours: Sequence[int]) -> Tuple[int, int]:
+    """計算單一事件的優先順序"""
+    start_epoch, _ = event.get_epoch_range()
+    return epoch_priority(start_epoch, event.is_recurring(), int(now.timestamp()), tiers_hours)
+
+
+def is_far_future(priority: Tuple[int, int], tiers_hours: Sequence[int]) -> bool:
+    """判斷優先順序是否落在所有層級之外的遠期未來"""
+    return priority[0] == len(tiers_hours)
+
+
+def prioritize_changes(changes: List[Tuple[str, EventData]], now: datetime,
+                       tiers_hours: Sequence[int],
+                       max_far_future: int = 0) -> Tuple[List[Tuple[str, EventData]], List[Tuple[str, EventData]]]:
+    """
+    依緊急程度排序變更 (操作, 事件)
+    max_far_future > 0 時，每次同步只處理這麼多筆遠期變更，其餘延到之後的週期
+    返回: (本次要處理的變更, 延後的變更)
+    """
+    keyed = sorted(
+        ((event_priority(change[1], now, tiers_hours), index, change)
+         for index, change in enumerate(changes)),
+        key=lambda item: (item[0], item[1])
+    )
+
+    scheduled = []
+    deferred = []
+    far_count = 0
+    for priority, _, change in keyed:
+        if max_far_future > 0 and is_far_future(priority, tiers_hours):
+            far_count += 1
+            if far_count > max_far_future:
+                deferred.append(change)
+                continue
+        scheduled.append(change)
+
+    return scheduled, deferred
+
+
+def prioritize_deletes(uids: List[str], snapshots: Dict[str, Dict[str, Any]], now: datetime,
+                       tiers_hours: Sequence[int]) -> List[str]:
+    """依快照記錄的開始時間排序待刪除事件，與管線模式相同的緊急程度；沒有快照者視為遠期"""
+    now_epoch = int(now.timestamp())
+
+    def priority(uid: str) -> Tuple[int, int]:
+        snapshot = snapshots.get(uid) or {}
+        return epoch_priority(snapshot.get('start_epoch'), bool(snapshot.get('series_uid')),
+                              now_epoch, tiers_hours)
+
+    return sorted(uids, key=priority)
@@ -0,0 +1,477 @@
+"""
+遠端比對
+以分頁列出 Google 端由本工具管理的事件（只讀取必要欄位），用於：
+- 強制完整比對：與來源完整比對後只執行必要的建立、更新與刪除
+- 漂移檢查：定期找出在 Google 端被手動修改或刪除的事件並標記修復
+- 重複事件清理：每個來源事件只保留一筆 Google 事件
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set, TYPE_CHECKING
+from zoneinfo import ZoneInfo
+
+from src.parsers.ics_parser import EventData
+from src.storage.state_store import StateStore
+from src.sync.conflicts import RemoteEvent, google_time_epoch
+from src.sync.priority import prioritize_changes, prioritize_deletes
+
+if TYPE_CHECKING:
+    from src.sync.engine import SyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+
+def managed_event_key(item: Dict[str, Any], mapped_uids: Dict[str, str]) -> Optional[str]:
+    """
+    取得 Google 事件對應的來源唯一 ID
+    優先使用本地映射，其次是 syncUniqueID，較舊的事件退回 originalUID
+    """
+    if item['id'] in mapped_uids:
+        return mapped_uids[item['id']]
+    private = item.get('extendedProperties', {}).get('private', {})
+    return private.get('syncUniqueID') or private.get('originalUID')
+
+
+def is_legacy_instance(item: Dict[str, Any], mapped_uids: Dict[str, str]) -> bool:
+    """
+    是否為未映射、只帶 originalUID 的舊版單次事件
+    舊版以 exdate 模式同步的修改實例與主事件共用 originalUID，無法只靠屬性區分
+    """
+    if item['id'] in mapped_uids or item.get('recurrence'):
+        return False
+    return not item.get('extendedProperties', {}).get('private', {}).get('syncUniqueID')
+
+
+def legacy_instance_key(item: Dict[str, Any]) -> str:
+    """舊版修改實例的分組鍵：originalUID 加上實例的開始時間（與引擎的 _RECUR_ 格式相同）"""
+    private = item.get('extendedProperties', {}).get('private', {})
+    start = item.get('start', {})
+    return f"{private.get('originalUID')}_RECUR_{start.get('dateTime') or start.get('date')}"
+
+
+def is_generated_instance(item: Dict[str, Any]) -> bool:
+    """
+    判斷是否為 Google 依週期規則產生（或使用者在 Google 端修改）的實例
+    由修改實例 (exception_mode: instance) 同步的實例帶有自己的 syncUniqueID，需個別追蹤
+    """
+    if not item.get('recurringEventId'):
+        return False
+    private = item.get('extendedProperties', {}).get('private', {})
+    unique_id = private.get('syncUniqueID')
+    return not unique_id or unique_id == private.get('originalUID')
+
+
+def index_managed_events(engine: 'SyncEngine') -> Dict[str, List[Dict[str, Any]]]:
+    """
+    一次分頁掃描行事曆，將受管理事件依來源唯一 ID 分組
+    週期事件在 Google 端產生的例外實例屬於主事件，不單獨列入；由修改實例同步的實例則各自列入。
+    舊版事件只有 originalUID，週期主事件與其修改實例會落在同一組，此時修改實例依開始時間另外分組
+    """
+    calendar_id = engine.config.google_calendar.calendar_id
+    mapped_uids = {
+        mapping['google_event_id']: mapping['original_uid']
+        for mapping in engine.database.get_all_event_mappings(calendar_id)
+    }
+
+    index: Dict[str, List[Dict[str, Any]]] = {}
+    count = 0
+    for item in engine.google_client.list_managed_events():
+        if is_generated_instance(item):
+            continue
+        key = managed_event_key(item, mapped_uids)
+        index.setdefault(key, []).append(item)
+        count += 1
+
+    for key, items in list(index.items()):
+        if len(items) < 2 or not any(item.get('recurrence') for item in items):
+            continue
+        # 週期主事件不與單次事件同組
+        index[key] = [item for item in items if not is_legacy_instance(item, mapped_uids)]
+        for item in items:
+            if is_legacy_instance(item, mapped_uids):
+                index.setdefault(legacy_instance_key(item), []).append(item)
+
+    logger.info(f"Indexed {count} managed Google events ({len(index)} distinct source events)")
+    return index
+
+
+def list_unmatched_remote_events(engine: 'SyncEngine', events: List[EventData], tracked_uids: Set[str],
+                                 window_start: datetime, window_end: datetime) -> List[RemoteEvent]:
+    """
+    列出與 events 時間範圍重疊、但已不對應任何目前來源事件（tracked_uids 以外）的受管理 Google 事件
+    只查詢 events 涵蓋的時段，以 Google 端的實際時間建立衝突偵測用的紀錄
+    """
+    start_epochs, end_epochs = [], []
+    for event in events:
+        start_epoch, end_epoch = event.get_epoch_range()
+        if start_epoch is not None:
+            start_epochs.append(start_epoch)
+            end_epochs.append(end_epoch if end_epoch is not None else int(window_end.timestamp()))
+    if not start_epochs:
+        return []
+
+    zone = ZoneInfo(engine.config.processing.timezone)
+    time_min = datetime.fromtimestamp(max(min(start_epochs), int(window_start.timestamp())), zone)
+    time_max = datetime.fromtimestamp(min(max(end_epochs), int(window_end.timestamp())) + 1, zone)
+    calendar_id = engine.config.google_calendar.calendar_id
+    mapped_uids = {
+        mapping['google_event_id']: mapping['original_uid']
+        for mapping in engine.database.get_all_event_mappings(calendar_id)
+    }
+
+    remote_events = []
+    for item in engine.google_client.list_managed_events(time_min=time_min, time_max=time_max):
+        if is_generated_instance(item):
+            continue
+        key = managed_event_key(item, mapped_uids)
+        if key not in tracked_uids:
+            remote_events.append(RemoteEvent.from_item(item, key, zone))
+    return remote_events
+
+
+def remote_fingerprint(item: Dict[str, Any]) -> Optional[str]:
+    """取得 Google 事件上記錄的同步指紋"""
+    return item.get('extendedProperties', {}).get('private', {}).get('syncFingerprint')
+
+
+def pick_primary(items: List[Dict[str, Any]], mapped_id: Optional[str],
+                 recurring: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    同一來源事件有多筆 Google 事件時，保留映射指向的那一筆，
+    否則保留週期性與來源事件相同（recurring）的第一筆，最後才是最早建立的
+    """
+    for item in items:
+        if item['id'] == mapped_id:
+            return item
+    if recurring is not None:
+        for item in items:
+            if bool(item.get('recurrence')) == recurring:
+                return item
+    return items[0]
+
+
+class Reconciler:
+    """以遠端實際狀態為準的完整比對（--force）"""
+
+    def __init__(self, engine: 'SyncEngine'):
+        self.engine = engine
+        self.database = engine.database
+        self.config = engine.config
+        self.calendar_id = engine.config.google_calendar.calendar_id
+
+    async def run(self, start_date: datetime, end_date: datetime,
+                  stats: Dict[str, Any], dry_run: bool) -> None:
+        """執行完整比對並只套用必要的變更"""
+        logger.info("Force mode: reconciling the full source against Google Calendar...")
+        current_events, _ = self.engine.ics_parser.parse_and_expand(start_date, end_date)
+        stats['events_processed'] = len(current_events)
+
+        remote = index_managed_events(self.engine)
+        mapped_ids = {
+            mapping['original_uid']: mapping['google_event_id']
+            for mapping in self.database.get_all_event_mappings(self.calendar_id)
+        }
+        snapshots = {
+            snapshot['original_uid']: snapshot
+            for snapshot in self.database.get_all_event_snapshots()
+        }
+
+        # 舊版修改實例以開始時間分組（見 index_managed_events），依 (UID, 開始時間) 重新認領
+        legacy_instances = {
+            (items[0]['extendedProperties']['private'].get('originalUID'), self._remote_start_epoch(items[0])): key
+            for key, items in remote.items()
+            if key not in mapped_ids and key == legacy_instance_key(items[0])
+        }
+
+        creates: List[EventData] = []
+        updates: List[EventData] = []
+        mapping_fixes: Dict[str, str] = {}
+        duplicate_count = 0
+
+        for event in current_events:
+            unique_id = event.get_unique_event_id()
+            candidates = remote.pop(unique_id, [])
+            if not candidates and event.is_modified_instance():
+                legacy_key = legacy_instances.pop((event.uid, event.get_epoch_range()[0]), None)
+                if legacy_key is not None:
+                    candidates = remote.pop(legacy_key)
+            if not candidates:
+                creates.append(event)
+                continue
+
+            primary = pick_primary(candidates, mapped_ids.get(unique_id), event.is_recurring())
+            duplicate_count += len(candidates) - 1
+            if mapped_ids.get(unique_id) != primary['id']:
+                mapping_fixes[unique_id] = primary['id']
+            if remote_fingerprint(primary) != event.fingerprint:
+                updates.append(event)
+
+        # 來源中已不存在的受管理事件
+        deletes: List[str] = []
+        if self.config.sync.enable_delete:
+            for unique_id, items in remote.items():
+                primary = pick_primary(items, mapped_ids.get(unique_id))
+                if self._is_deletable(primary, snapshots.get(unique_id), start_date):
+                    deletes.append(unique_id)
+                    if mapped_ids.get(unique_id) != primary['id']:
+                        mapping_fixes[unique_id] = primary['id']
+
+        # 來源以新 UID 重新發出、與來源中已不存在的 Google 端事件衝突，依 conflict_resolution 處理
+        if remote and creates:
+            zone = ZoneInfo(self.config.processing.timezone)
+            remote_events = [
+                RemoteEvent.from_item(pick_primary(items, mapped_ids.get(unique_id)), unique_id, zone)
+                for unique_id, items in remote.items()
+            ]
+            planned_deletes = set(deletes)
+            creates, updates, deletes = self.engine.conflict_resolver.resolve_replacements(
+                creates, updates, deletes, remote_events, dry_run=dry_run
+            )
+            for unique_id in planned_deletes.difference(deletes):
+                mapping_fixes.pop(unique_id, None)
+
+        logger.info(f"Reconciliation plan: {len(creates)} creates, {len(updates)} updates, "
+                    f"{len(deletes)} deletes, {len(mapping_fixes)} mapping repairs")
+        if duplicate_count:
+            logger.warning(f"Found {duplicate_count} duplicate Google events; run with --dedupe to remove them")
+
+        if dry_run:
+            logger.info("DRY RUN - Would perform the following actions:")
+            for event in creates[:5]:
+                logger.info(f"    NEW: {event.summary} ({event.start_datetime})")
+            for event in updates[:5]:
+                logger.info(f"    UPDATE: {event.summary} ({event.start_datetime})")
+            for unique_id in deletes[:5]:
+                logger.info(f"    DELETE: {unique_id}")
+            return
+
+        # 先修正映射，讓後續的更新與刪除指向實際存在的 Google 事件
+        for unique_id, google_event_id in mapping_fixes.items():
+            self.database.save_event_mapping(unique_id, google_event_id, self.calendar_id)
+        self.database.flush()
+
+        now = datetime.now(ZoneInfo(self.config.processing.timezone))
+        scheduled, _ = prioritize_changes(
+            [('create', event) for event in creates] + [('update', event) for event in updates],
+            now,
+            self.config.sync.priority_tiers_hours
+        )
+        deletes = prioritize_deletes(deletes, snapshots, now, self.config.sync.priority_tiers_hours)
+        self.database.plan_operations(
+            [(operation, event.get_unique_event_id()) for operation, event in scheduled] +
+            [('delete', unique_id) for unique_id in deletes]
+        )
+
+        if scheduled:
+            created_count, updated_count = await self.engine._apply_changes(scheduled)
+            stats['events_created'] = created_count
+            stats['events_updated'] = updated_count
+        if deletes:
+            stats['events_deleted'] = await self.engine._delete_events(deletes)
+
+        # 已一致的事件重建快照；變更的事件在操作成功時已各自記錄
+        changed_events = {id(event) for event in creates + updates}
+        for event in current_events:
+            if id(event) not in changed_events:
+                self.database.save_event_snapshot(event)
+
+        self.database.prune_expired_snapshots(start_date)
+
+    def _is_deletable(self, item: Dict[str, Any], snapshot: Optional[Dict[str, Any]],
+                      window_start: datetime) -> bool:
+        """
+        判斷來源中已不存在的 Google 事件是否可刪除
+        已滑出同步窗口的事件保留；沒有快照的週期系列無法確認是否仍在窗口內，也保留
+        """
+        cutoff_epoch = int(window_start.timestamp())
+        if snapshot is not None:
+            return not StateStore._is_expired(snapshot, cutoff_epoch)
+        if item.get('recurrence'):
+            return False
+        start_epoch = self._remote_start_epoch(item)
+        return start_epoch is not None and start_epoch >= cutoff_epoch
+
+    def _remote_start_epoch(self, item: Dict[str, Any]) -> Optional[int]:
+        """取得 Google 事件開始時間的 epoch 秒數"""
+        start_epoch = google_time_epoch(item.get('start', {}), ZoneInfo(self.config.processing.timezone))
+        if start_epoch is None:
+            logger.debug(f"Unparseable start time on Google event {item.get('id')}: {item.get('start')}")
+        return start_epoch
+
+
+class DriftChecker:
+    """
+    低頻率的漂移檢查
+    將遠端的同步指紋與事件內容和本地快照比對，並在完整掃描一輪後找出被刪除的事件。
+    修復方式是讓快照失效，由一般同步週期重新送出，不直接呼叫寫入 API；
+    在 Google 端被手動修改的事件依 conflict_resolution 決定是否覆蓋
+    """
+
+    def __init__(self, engine: 'SyncEngine'):
+        self.engine = engine
+        self.database = engine.database
+        self.config = engine.config
+        self.calendar_id = engine.config.google_calendar.calendar_id
+
+        # 跨次執行的掃描進度
+        self._page_token: Optional[str] = None
+        self._seen_ids: Set[str] = set()
+        self._scan_started_at: Optional[str] = None
+
+    def run(self) -> Dict[str, int]:
+        """執行一次有預算限制的漂移檢查（阻塞，請在工作執行緒中呼叫）"""
+        sync_config = self.config.sync
+        mappings = {
+            mapping['google_event_id']: mapping
+            for mapping in self.database.get_all_event_mappings(self.calendar_id)
+        }
+        mapped_uids = {google_id: mapping['original_uid'] for google_id, mapping in mappings.items()}
+        snapshots = {
+            snapshot['original_uid']: snapshot
+            for snapshot in self.database.get_all_event_snapshots()
+        }
+        if self._page_token is None:
+            self._seen_ids = set()
+            self._scan_started_at = datetime.now().isoformat()
+
+        result = {'pages': 0, 'checked': 0, 'changed': 0, 'edited': 0, 'deleted': 0, 'kept': 0}
+        repairs: Dict[str, str] = {}
+
+        while result['pages'] < max(1, sync_config.drift_check_max_pages):
+            items, self._page_token = self.engine.google_client.list_managed_events_page(self._page_token)
+            result['pages'] += 1
+
+            for item in items:
+                if is_generated_instance(item):
+                    continue
+                self._seen_ids.add(item['id'])
+                key = managed_event_key(item, mapped_uids)
+                snapshot = snapshots.get(key)
+                mapping = mappings.get(item['id'])
+                if snapshot is None or mapping is None:
+                    # 未追蹤或非映射中的事件（重複事件）不在此處理
+                    continue
+
+                result['checked'] += 1
+                if remote_fingerprint(item) != snapshot['fingerprint']:
+                    repairs.setdefault(key, 'changed')
+                elif self._edited_after_sync(item, snapshot):
+                    repairs.setdefault(key, 'edited')
+
+            if self._page_token is None:
+                break
+
+        scan_complete = self._page_token is None
+        if scan_complete:
+            # 完整掃描一輪後，映射指向但遠端已不存在的事件視為被手動刪除
+            for google_id, mapping in mappings.items():
+                if google_id in self._seen_ids or mapping['original_uid'] not in snapshots:
+                    continue
+                # 掃描開始後才同步的事件可能不在已讀取的頁面中
+                if mapping['last_sync_at'] and mapping['last_sync_at'] >= self._scan_started_at:
+                    continue
+                repairs.setdefault(mapping['original_uid'], 'deleted')
+
+        self._apply_repairs(repairs, result)
+        logger.info(f"Drift check: {result['checked']} events checked in {result['pages']} pages, "
+                    f"{result['changed']} changed, {result['edited']} edited, {result['deleted']} deleted remotely, "
+                    f"{result['kept']} remote edits kept"
+                    f"{'' if scan_complete else ' (scan continues next run)'}")
+        return result
+
+    def _edited_after_sync(self, item: Dict[str, Any], snapshot: Dict[str, Any]) -> bool:
+        """
+        判斷遠端事件的內容（標題、開始與結束時間）是否與最後一次同步的快照不同
+        只比對本工具寫入的欄位，回覆邀請等不影響內容的更新不視為手動修改
+        """
+        event_data = snapshot.get('event_data') or {}
+        if 'summary' in event_data and (item.get('summary') or '') != (event_data['summary'] or ''):
+            return True
+        zone = ZoneInfo(self.config.processing.timezone)
+        if google_time_epoch(item.get('start', {}), zone) != snapshot['start_epoch']:
+            return True
+        # 週期事件快照的結束時間是整個系列的結束時間，無法與主事件比對
+        if not item.get('recurrence') and google_time_epoch(item.get('end', {}), zone) != snapshot['end_epoch']:
+            return True
+        return False
+
+    def _apply_repairs(self, repairs: Dict[str, str], result: Dict[str, int]) -> None:
+        """讓偏離的事件快照失效，交由一般同步修復"""
+        limit = self.config.sync.drift_max_repairs
+        for count, (original_uid, reason) in enumerate(repairs.items()):
+            if limit > 0 and count >= limit:
+                logger.info(f"Drift repair budget reached, {len(repairs) - limit} events left for a later check")
+                break
+            if reason == 'deleted':
+                # 移除映射後，下次同步找不到遠端事件時會重新建立
+                self.database.delete_event_mapping(original_uid, self.calendar_id)
+            elif reason == 'edited' and self.engine.conflict_resolver.policy != 'source':
+                # 依 conflict_resolution 保留 Google 端的修改
+                self.engine.conflict_resolver.keep_remote_edit(original_uid)
+                result['kept'] += 1
+                continue
+            self.database.invalidate_event_snapshot(original_uid)
+            result[reason] += 1
+            logger.debug(f"Drift detected for {original_uid}: {reason}")
+
+
+class Deduplicator:
+    """
+    重複事件清理（--dedupe）
+    一次分頁掃描後，每個來源事件保留映射指向的 Google 事件，其餘以批次請求刪除
+    """
+
+    def __init__(self, engine: 'SyncEngine'):
+        self.engine = engine
+        self.database = engine.database
+        self.calendar_id = engine.config.google_calendar.calendar_id
+
+    def run(self, dry_run: bool = False) -> Dict[str, Any]:
+        """找出並刪除重複事件，返回清理報告（阻塞）"""
+        remote = index_managed_events(self.engine)
+        mapped_ids = {
+            mapping['original_uid']: mapping['google_event_id']
+            for mapping in self.database.get_all_event_mappings(self.calendar_id)
+        }
+
+        duplicates: Dict[str, List[Dict[str, Any]]] = {}
+        kept: Dict[str, str] = {}
+        for unique_id, items in remote.items():
+            if len(items) < 2:
+                continue
+            primary = pick_primary(items, mapped_ids.get(unique_id))
+            kept[unique_id] = primary['id']
+            duplicates[unique_id] = [item for item in items if item['id'] != primary['id']]
+
+        report = {
+            'groups': len(duplicates),
+            'duplicates': sum(len(items) for items in duplicates.values()),
+            'deleted': 0,
+            'failed': {},
+            'details': [
+                {'unique_id': unique_id, 'kept': kept[unique_id],
+                 'removed': [item['id'] for item in items]}
+                for unique_id, items in duplicates.items()
+            ]
+        }
+        logger.info(f"Found {report['duplicates']} duplicate Google events "
+                    f"across {report['groups']} source events")
+        if dry_run or not duplicates:
+            return report
+
+        self.engine._check_write_guard()
+        # 沒有映射的來源事件改為指向保留的那一筆，避免下次同步再建立
+        for unique_id, google_event_id in kept.items():
+            if mapped_ids.get(unique_id) != google_event_id:
+                self.database.save_event_mapping(unique_id, google_event_id, self.calendar_id)
+        self.database.flush()
+
+        deleted, failed = self.engine.google_client.batch_delete_events(
+            [item['id'] for items in duplicates.values() for item in items]
+        )
+        report['deleted'] = len(deleted)
+        report['failed'] = failed
+        if failed:
+            logger.warning(f"Failed to delete {len(failed)} duplicate events; run --dedupe again to retry")
+        return report
@@ -0,0 +1,260 @@
+"""
+多租戶執行器
+在單一程序中執行多組「來源 ICS → 目標行事曆」同步，
+共用排程器、HTTP 連線池、Google 認證與同步工作者額度
+"""
+import asyncio
+import functools
+import heapq
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.clients.google_calendar import GoogleCalendarClient
+from src.sync.engine import SyncEngine
+from src.sync.leases import LeaseCoordinator, LeaseStore
+from src.sync.polling import AdaptivePollScheduler
+from src.utils.config import Config, TenantConfig
+
+
+logger = logging.getLogger(__name__)
+
+
+class MultiTenantRunner:
+    """以共用排程器與工作者額度執行多個租戶的同步"""
+
+    def __init__(self, config: Config, tenants: List[TenantConfig]):
+        self.config = config
+        self.max_concurrent = max(1, config.runner.max_concurrent_syncs)
+        self.http_session = self._create_http_session(config.runner.http_pool_size)
+        # 工作者額度：同時進行的租戶同步各佔一個執行緒
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent, thread_name_prefix='tenant-sync'
+        )
+
+        # 每個租戶有獨立的引擎與狀態資料庫，其餘資源共用
+        self.engines: Dict[str, SyncEngine] = {}
+        self.schedulers: Dict[str, AdaptivePollScheduler] = {}
+        for tenant in tenants:
+            tenant_config = config.for_tenant(tenant)
+            self.engines[tenant.id] = SyncEngine(tenant_config, http_session=self.http_session)
+            self.schedulers[tenant.id] = AdaptivePollScheduler(tenant_config.sync)
+
+        self._credentials: Dict[Tuple[str, str], Any] = {}
+        self._credentials_lock: Optional[asyncio.Lock] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._queue: List[Tuple[float, str]] = []  # (下次同步時間, 租戶 ID)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.last_stats: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.is_running = False
+
+        # 分片模式：多個節點透過租約分配租戶，只同步本節點持有的租戶
+        self.leases: Optional[LeaseCoordinator] = None
+        sharding = config.runner.sharding
+        if sharding.enabled:
+            node_id = sharding.node_id or f"{socket.gethostname()}-{os.getpid()}"
+            self.leases = LeaseCoordinator(
+                LeaseStore(sharding.lease_store_path, sharding.lease_ttl_seconds),
+                node_id,
+                self.engines
+            )
+            for tenant_id, engine in self.engines.items():
+                engine.write_guard = functools.partial(self.leases.check, tenant_id)
+            logger.info(f"Lease sharding enabled (node {node_id})")
+
+        logger.info(f"Multi-tenant runner initialized with {len(self.engines)} tenants "
+                    f"(max {self.max_concurrent} concurrent syncs)")
+
+    @staticmethod
+    def _create_http_session(pool_size: int) -> requests.Session:
+        """建立所有租戶共用的 HTTP 連線池"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _init_primitives(self) -> None:
+        """在事件迴圈內建立同步原語"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._credentials_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+
+    async def run_once(self, force: bool = False, dry_run: bool = False) -> Dict[str, Optional[Dict[str, Any]]]:
+        """每個租戶各執行一次同步，返回各租戶的統計資料（失敗者為 None）"""
+        self._init_primitives()
+        tenant_ids = list(self.engines)
+        if self.leases is not None:
+            held = await asyncio.to_thread(self.leases.rebalance)
+            tenant_ids = [tenant_id for tenant_id in tenant_ids if tenant_id in held]
+        results = await asyncio.gather(
+            *(self._sync_tenant(tenant_id, force=force, dry_run=dry_run) for tenant_id in tenant_ids)
+        )
+        return dict(zip(tenant_ids, results))
+
+    async def start(self) -> None:
+        """開始持續同步：所有租戶共用一個依到期時間排序的排程佇列"""
+        self._init_primitives()
+        self.is_running = True
+
+        lease_task = None
+        if self.leases is not None:
+            await asyncio.to_thread(self.leases.rebalance)
+            lease_task = asyncio.create_task(self._maintain_leases())
+
+        now = time.monotonic()
+        self._queue = [(now, tenant_id) for tenant_id in self.engines]
+        heapq.heapify(self._queue)
+
+        try:
+            while self.is_running:
+                if not self._queue:
+                    await self._wait_for_wakeup(None)
+                    continue
+
+                due_at, tenant_id = self._queue[0]
+                delay = due_at - time.monotonic()
+                if delay > 0:
+                    # 有租戶重新排入佇列時提早醒來，重新檢查最早到期者
+                    await self._wait_for_wakeup(delay)
+                    continue
+
+                heapq.heappop(self._queue)
+                self._tasks[tenant_id] = asyncio.create_task(self._run_cycle(tenant_id))
+        finally:
+            tasks = list(self._tasks.values())
+            if lease_task is not None:
+                tasks.append(lease_task)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._tasks.clear()
+
+            if self.leases is not None:
+                await asyncio.to_thread(self.leases.leave)
+
+    async def _maintain_leases(self) -> None:
+        """定期送出心跳、延長租約並重新平衡"""
+        interval = self.config.runner.sharding.heartbeat_interval_seconds
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.leases.rebalance, set(self._tasks))
+            except Exception as e:
+                # 無法延長時租約會自然逾期，寫入檢查會阻止繼續同步
+                logger.error(f"Lease heartbeat failed: {e}")
+
+    def stop(self) -> None:
+        """停止持續同步"""
+        logger.info("Stopping multi-tenant runner...")
+        self.is_running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def close(self) -> None:
+        """關閉所有租戶的狀態儲存與共用連線池"""
+        self._executor.shutdown(wait=True)
+        for engine in self.engines.values():
+            engine.database.close()
+        self.http_session.close()
+
+    async def _wait_for_wakeup(self, timeout: Optional[float]) -> None:
+        """等待到期或被喚醒"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run_cycle(self, tenant_id: str) -> None:
+        """執行單一租戶的一個週期，完成後依結果重新排程"""
+        engine = self.engines[tenant_id]
+        scheduler = self.schedulers[tenant_id]
+
+        if self.leases is not None and not self.leases.holds(tenant_id):
+            # 由其他節點負責，下次心跳後再檢查
+            self._reschedule(tenant_id, self.config.runner.sharding.heartbeat_interval_seconds)
+            return
+
+        stats = await self._sync_tenant(tenant_id)
+        if stats is not None:
+            await engine.run_housekeeping()
+            delay = scheduler.next_delay(stats)
+        else:
+            delay = scheduler.failure_delay()
+
+        self._reschedule(tenant_id, delay)
+
+    def _reschedule(self, tenant_id: str, delay: float) -> None:
+        """將租戶重新排入排程佇列並喚醒排程器"""
+        self._tasks.pop(tenant_id, None)
+        if self.is_running:
+            heapq.heappush(self._queue, (time.monotonic() + delay, tenant_id))
+            self._wakeup.set()
+
+    async def _sync_tenant(self, tenant_id: str, force: bool = False,
+                           dry_run: bool = False) -> Optional[Dict[str, Any]]:
+        """在工作者額度內執行單一租戶的同步"""
+        engine = self.engines[tenant_id]
+
+        async with self._semaphore:
+            logger.info(f"[{tenant_id}] Starting tenant sync")
+            try:
+                if not dry_run:
+                    await self._share_credentials(engine.google_client)
+                stats = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._run_sync, engine, force, dry_run
+                )
+            except Exception as e:
+                logger.error(f"[{tenant_id}] Tenant sync failed: {e}")
+                stats = None
+
+        self.last_stats[tenant_id] = stats
+        return stats
+
+    @staticmethod
+    def _run_sync(engine: SyncEngine, force: bool, dry_run: bool) -> Dict[str, Any]:
+        """在工作者執行緒中以獨立事件迴圈執行同步，避免阻塞排程器"""
+        try:
+            return asyncio.run(engine.sync_once(force=force, dry_run=dry_run))
+        finally:
+            # 閒置租戶不保留 API service 物件，維持低常駐記憶體
+            engine.google_client.release_service()
+
+    async def _share_credentials(self, client: GoogleCalendarClient) -> None:
+        """同一組憑證檔只認證一次，取得的認證資料由所有租戶共用"""
+        google_config = client.config
+        if google_config.auth_type == "service_account":
+            key = (google_config.auth_type, google_config.service_account_file)
+        else:
+            key = (google_config.auth_type, google_config.token_file)
+
+        async with self._credentials_lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                auth_client = GoogleCalendarClient(google_config)
+                await asyncio.to_thread(auth_client.authenticate)
+                credentials = auth_client.credentials
+                self._credentials[key] = credentials
+
+        client.share_credentials(credentials)
+
+    def get_sync_status(self) -> Dict[str, Any]:
+        """取得所有租戶的同步狀態"""
+        return {
+            tenant_id: {
+                'last_stats': self.last_stats.get(tenant_id),
+                'running': tenant_id in self._tasks,
+                'lease_held': self.leases.holds(tenant_id) if self.leases is not None else None,
+                'database_stats': engine.database.get_database_stats()
+            }
+            for tenant_id, engine in self.engines.items()
+        }
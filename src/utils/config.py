@@ -2,7 +2,7 @@
 設定管理模組
 """
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 import yaml
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
@@ -33,13 +33,39 @@ class SyncConfig(BaseModel):
     lookahead_days: int = 365
     lookbehind_days: int = 30
     enable_delete: bool = True
-    conflict_resolution: str = "latest"
+    conflict_resolution: str = "source"  # "source"、"latest" 或 "manual"，見 src/sync/conflicts.py
+    pipeline_enabled: bool = False  # 解析、偵測與 API 派送以有界佇列管線化進行
+    pipeline_queue_size: int = 100  # 管線各階段之間的佇列上限
+    pipeline_workers: int = 4  # 管線模式下並行的 API 工作者數量
+    priority_tiers_hours: List[int] = [24, 168]  # 優先處理的時段（小時），越前面越優先
+    max_far_future_changes_per_cycle: int = 0  # 每次同步最多處理的遠期變更數，0 表示不限
+    adaptive_polling: bool = False  # 依變更頻率自動調整同步間隔
+    min_interval_minutes: int = 5  # 自適應輪詢的最短間隔
+    max_interval_minutes: int = 120  # 自適應輪詢的最長間隔
+    failure_backoff_seconds: int = 300  # 失敗後第一次重試的等待秒數（之後指數增加）
+    failure_backoff_max_minutes: int = 60  # 失敗重試的最長等待時間
+    cycle_time_budget_seconds: int = 0  # 每次同步週期的時間上限，0 表示不限，未完成的操作下次接續
+    event_retry_backoff_minutes: int = 30  # 單一事件失敗後第一次重試的等待時間（之後指數增加）
+    event_retry_max_hours: int = 24  # 單一事件重試的最長等待時間
+    drift_check_interval_hours: int = 0  # 比對 Google 端是否被手動修改或刪除的間隔（小時），0 表示停用
+    drift_check_max_pages: int = 2  # 每次比對最多讀取的事件列表頁數（每頁一次 API 呼叫），未完成的下次接續
+    drift_max_repairs: int = 50  # 每次比對最多標記修復的事件數，0 表示不限制
 
 
 class DatabaseConfig(BaseModel):
     """資料庫設定"""
+    backend: str = "sqlite"  # "sqlite" 或 "memory"
     path: str = "data/sync_state.db"
     backup_count: int = 5
+    write_batch_size: int = 100  # 群組提交：每 N 筆寫入提交一次
+    write_flush_interval_ms: int = 50  # 群組提交：最長等待毫秒數
+    history_retention_days: int = 90  # 同步歷史保留天數
+    maintenance_interval_hours: int = 24  # 背景維護（清理、VACUUM、optimize）間隔
+    vacuum_pages_per_step: int = 256  # 每一步增量 VACUUM 回收的頁面數
+    vacuum_max_steps: int = 100  # 每次維護最多執行的 VACUUM 步數
+    backup_interval_hours: int = 24  # 線上備份間隔，0 表示停用
+    backup_pages_per_step: int = 256  # 線上備份每步複製的頁面數
+    backup_step_sleep_ms: int = 10  # 線上備份每步之間的等待毫秒數
 
 
 class LoggingConfig(BaseModel):
@@ -57,19 +83,72 @@ class ProcessingConfig(BaseModel):
     event_prefix: str = ""
     description_suffix: str = "\n\n--- 由 CalendarBridge 同步 ---"
     max_description_length: int = 8000
+    # 週期事件的修改實例 (RECURRENCE-ID) 同步方式：
+    # exdate 在主事件加入 EXDATE 並建立獨立事件；instance 直接修改 Google 週期事件中的對應實例
+    exception_mode: str = "exdate"
 
 
-class Config(BaseSettings):
-    """主設定類別"""
+class ControlConfig(BaseModel):
+    """本機同步控制端點設定"""
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 8765
+    unix_socket: Optional[str] = None  # 設定後改用 Unix socket，不開 TCP 埠
+    debounce_seconds: float = 2.0  # 連續觸發合併為一次同步的等待時間
+
+
+class TenantConfig(BaseModel):
+    """租戶設定：一組來源 ICS 與目標行事曆，未指定的區塊沿用主設定"""
+    id: str = Field(pattern=r'^[A-Za-z0-9_.-]+$')
     source: SourceConfig
     google_calendar: GoogleCalendarConfig
+    sync: Optional[SyncConfig] = None
+    processing: Optional[ProcessingConfig] = None
+
+
+class ShardingConfig(BaseModel):
+    """多節點租約分片設定"""
+    enabled: bool = False
+    node_id: Optional[str] = None  # 預設為 主機名稱-PID
+    lease_store_path: str = "data/leases.db"  # 所有節點共用的租約檔案
+    lease_ttl_seconds: int = 60
+    heartbeat_interval_seconds: int = 15
+
+
+class RunnerConfig(BaseModel):
+    """多租戶執行設定"""
+    tenants_dir: Optional[str] = None  # 每個 YAML 檔為一個租戶設定
+    max_concurrent_syncs: int = 4  # 同時進行的同步數量上限
+    http_pool_size: int = 20  # 所有租戶共用的 HTTP 連線池大小
+    sharding: ShardingConfig = ShardingConfig()
+
+
+class Config(BaseSettings):
+    """主設定類別"""
+    source: Optional[SourceConfig] = None
+    google_calendar: GoogleCalendarConfig = GoogleCalendarConfig()
     sync: SyncConfig
     database: DatabaseConfig
     logging: LoggingConfig
     processing: ProcessingConfig
+    tenants: List[TenantConfig] = []
+    runner: RunnerConfig = RunnerConfig()
+    control: ControlConfig = ControlConfig()
     
     class Config:
         env_nested_delimiter = '__'
+    
+    def for_tenant(self, tenant: TenantConfig) -> 'Config':
+        """建立租戶專用的設定，狀態資料庫放在各自的命名空間"""
+        db_path = Path(self.database.path).parent / 'tenants' / f'{tenant.id}.db'
+        return self.model_copy(update={
+            'source': tenant.source,
+            'google_calendar': tenant.google_calendar,
+            'sync': tenant.sync or self.sync,
+            'processing': tenant.processing or self.processing,
+            'database': self.database.model_copy(update={'path': str(db_path)}),
+            'tenants': []
+        })
 
 
 def load_config(config_path: str) -> Config:
@@ -82,4 +161,32 @@ def load_config(config_path: str) -> Config:
     with open(config_file, 'r', encoding='utf-8') as f:
         config_data = yaml.safe_load(f)
     
-    return Config(**config_data)
\ No newline at end of file
+    config = Config(**config_data)
+    
+    if config.source is None and not load_tenants(config):
+        raise ValueError("Configuration must define 'source' or at least one tenant")
+    
+    return config
+
+
+def load_tenants(config: Config) -> List[TenantConfig]:
+    """取得所有租戶設定（設定檔中的 tenants 加上 tenants_dir 目錄下的 YAML 檔）"""
+    tenants = list(config.tenants)
+    
+    if config.runner.tenants_dir:
+        tenants_dir = Path(config.runner.tenants_dir)
+        if not tenants_dir.is_dir():
+            raise FileNotFoundError(f"Tenants directory not found: {tenants_dir}")
+        
+        for tenant_file in sorted(tenants_dir.glob('*.yaml')):
+            with open(tenant_file, 'r', encoding='utf-8') as f:
+                tenant_data = yaml.safe_load(f) or {}
+            tenant_data.setdefault('id', tenant_file.stem)
+            tenants.append(TenantConfig(**tenant_data))
+    
+    tenant_ids = [tenant.id for tenant in tenants]
+    duplicates = {tenant_id for tenant_id in tenant_ids if tenant_ids.count(tenant_id) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate tenant ids: {', '.join(sorted(duplicates))}")
+    
+    return tenants
\ No newline at end of file
@@ -19,7 +19,7 @@ def main():
         config = load_config("config/settings.yaml")
         
         # 建立資料庫連線
-        database = SyncDatabase(config.database)
+        database = SyncDatabase(config.database, config.processing.timezone)
         
         # 清理所有資料
         with database._get_connection() as conn:
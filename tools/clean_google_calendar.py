@@ -1,23 +1,199 @@
 #!/usr/bin/env python3
 """
-清理 Google Calendar 腳本 - 刪除所有已同步的事件
+清理 Google Calendar 腳本 - 刪除目標日曆中的事件
 警告：此腳本會直接刪除事件，不會提示確認
+
+流程：
+1. 分頁列出事件 ID（只讀取必要欄位），寫入檢查點檔案
+2. 以批次請求（每批最多 50 個刪除）並行刪除，限制每秒送出的批次數
+3. 持續更新檢查點，中斷後重新執行會從剩餘的事件繼續
 """
+import argparse
+import json
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Tuple
 
 # 添加 src 到 Python 路徑
 sys.path.append(str(Path(__file__).parent / "src"))
 
-from src.clients.google_calendar import GoogleCalendarClient
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from src.clients.google_calendar import BATCH_LIMIT, GoogleCalendarClient
 from src.utils.config import load_config
 
+# 可重試的錯誤（速率限制與暫時性錯誤）
+RETRYABLE_STATUS = {403, 429, 500, 503}
+MAX_RETRIES = 5
+
+
+class RateLimiter:
+    """限制每秒送出的請求數（跨執行緒共用）"""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """
+    記錄待刪除事件與進度的檢查點檔案
+    最多每隔 SAVE_INTERVAL 秒寫回一次；中斷時少記錄的事件重新刪除會得到 404，視為成功
+    """
+
+    SAVE_INTERVAL = 2.0
+
+    def __init__(self, path: Path, calendar_id: str):
+        self.path = path
+        self.calendar_id = calendar_id
+        self.pending: Dict[str, None] = {}  # 保持順序的待刪除集合
+        self.deleted_count = 0
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def load(self) -> bool:
+        """載入同一日曆的未完成檢查點，返回是否成功"""
+        if not self.path.exists():
+            return False
+        data = json.loads(self.path.read_text(encoding='utf-8'))
+        if data.get('calendar_id') != self.calendar_id:
+            print(f"⚠️ 檢查點屬於其他日曆 ({data.get('calendar_id')})，重新開始")
+            return False
+        self.pending = dict.fromkeys(data['pending'])
+        self.deleted_count = data.get('deleted_count', 0)
+        return True
+
+    def start(self, event_ids: List[str]) -> None:
+        self.pending = dict.fromkeys(event_ids)
+        self.deleted_count = 0
+        self.save()
+
+    def complete(self, event_ids: List[str]) -> None:
+        """標記一批事件已刪除"""
+        with self._lock:
+            for event_id in event_ids:
+                self.pending.pop(event_id, None)
+            self.deleted_count += len(event_ids)
+            if time.monotonic() - self._saved_at >= self.SAVE_INTERVAL:
+                self._write()
+
+    def save(self) -> None:
+        with self._lock:
+            self._write()
+
+    def _write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps({
+            'calendar_id': self.calendar_id,
+            'deleted_count': self.deleted_count,
+            'pending': list(self.pending)
+        }), encoding='utf-8')
+        temp_path.replace(self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def list_event_ids(client: GoogleCalendarClient, calendar_id: str, managed_only: bool) -> List[str]:
+    """分頁列出事件 ID；managed_only 時只包含帶有 originalUID 私有屬性的事件"""
+    event_ids = []
+    page_token = None
+    while True:
+        if managed_only:
+            items, page_token = client.list_managed_events_page(page_token, fields='id,extendedProperties/private')
+        else:
+            result = client.service.events().list(
+                calendarId=calendar_id,
+                pageToken=page_token,
+                maxResults=2500,
+                singleEvents=False,  # 週期事件只列出主事件，刪除主事件即刪除整個系列
+                showDeleted=False,
+                fields='nextPageToken,items(id)'
+            ).execute()
+            items, page_token = result.get('items', []), result.get('nextPageToken')
+
+        event_ids.extend(item['id'] for item in items)
+        print(f"  已列出 {len(event_ids)} 個事件...")
+        if not page_token:
+            return event_ids
+
+
+def delete_batch(service_factory, calendar_id: str, event_ids: List[str],
+                 limiter: RateLimiter) -> Tuple[List[str], Dict[str, str]]:
+    """
+    以單一批次請求刪除一組事件，遇到速率限制時以指數退避重試
+    已不存在的事件視為刪除成功，返回 (已處理的 ID, 失敗的 ID -> 錯誤訊息)
+    """
+    service = service_factory()
+    remaining = list(event_ids)
+    done: List[str] = []
+    failed: Dict[str, str] = {}
+
+    for attempt in range(MAX_RETRIES + 1):
+        retry: List[str] = []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                done.append(request_id)
+            elif isinstance(exception, HttpError) and exception.resp.status in (404, 410):
+                done.append(request_id)
+            elif (isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUS
+                  and attempt < MAX_RETRIES):
+                retry.append(request_id)
+            else:
+                failed[request_id] = str(exception)
+
+        limiter.wait()
+        batch = service.new_batch_http_request(callback=on_response)
+        for event_id in remaining:
+            batch.add(service.events().delete(calendarId=calendar_id, eventId=event_id), request_id=event_id)
+        batch.execute()
+
+        if not retry:
+            break
+        remaining = retry
+        time.sleep(min(2 ** attempt, 30))
+
+    return done, failed
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Delete events from the target Google Calendar")
+    parser.add_argument("--config", "-c", default="config/settings.yaml",
+                        help="Configuration file path")
+    parser.add_argument("--managed-only", action="store_true",
+                        help="Only delete events created by CalendarBridge (originalUID private property)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of batches deleted concurrently")
+    parser.add_argument("--batches-per-second", type=float, default=2.0,
+                        help="Maximum batch requests sent per second across all workers")
+    parser.add_argument("--checkpoint", default="data/clean_google_calendar.checkpoint.json",
+                        help="Checkpoint file used to resume an interrupted cleanup")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore an existing checkpoint and list events again")
+    args = parser.parse_args()
+
     print("開始清理 Google Calendar 事件...")
 
     try:
         # 載入設定
-        config = load_config("config/settings.yaml")
+        config = load_config(args.config)
+        calendar_id = config.google_calendar.calendar_id
 
         # 建立 Google Calendar 客戶端
         client = GoogleCalendarClient(config.google_calendar)
@@ -26,46 +202,66 @@ def main():
         # 取得日曆資訊
         calendar_info = client.get_calendar_info()
         print(f"目標日曆: {calendar_info.get('summary', 'Unknown')}")
+        print(f"範圍: {'僅 CalendarBridge 建立的事件' if args.managed_only else '所有事件'}")
 
-        # 列出所有事件
-        print("正在獲取所有事件...")
-        events = client.service.events().list(
-            calendarId=config.google_calendar.calendar_id,
-            maxResults=2500,
-            singleEvents=False  # 包含週期事件
-        ).execute()
-
-        items = events.get('items', [])
-        print(f"找到 {len(items)} 個事件")
+        checkpoint = Checkpoint(Path(args.checkpoint), calendar_id)
+        if not args.restart and checkpoint.load():
+            print(f"從檢查點繼續：已刪除 {checkpoint.deleted_count} 個，剩餘 {len(checkpoint.pending)} 個")
+        else:
+            print("正在列出事件...")
+            checkpoint.start(list_event_ids(client, calendar_id, args.managed_only))
+            print(f"找到 {len(checkpoint.pending)} 個事件")
 
-        if not items:
+        if not checkpoint.pending:
             print("沒有事件需要清理")
+            checkpoint.remove()
             return
 
-        # 刪除所有事件
-        deleted_count = 0
-        failed_count = 0
+        # API service 物件不是執行緒安全的，每個工作執行緒各自建立
+        local = threading.local()
 
-        for event in items:
-            event_id = event.get('id')
-            summary = event.get('summary', '(無標題)')
+        def service_factory():
+            if not hasattr(local, 'service'):
+                local.service = build('calendar', 'v3', credentials=client.credentials, cache_discovery=False)
+            return local.service
 
-            try:
-                client.service.events().delete(
-                    calendarId=config.google_calendar.calendar_id,
-                    eventId=event_id
-                ).execute()
-                deleted_count += 1
-                print(f"✓ 已刪除: {summary} (ID: {event_id})")
+        limiter = RateLimiter(args.batches_per_second)
+        pending = list(checkpoint.pending)
+        batches = [pending[i:i + BATCH_LIMIT] for i in range(0, len(pending), BATCH_LIMIT)]
+        failures: Dict[str, str] = {}
+        started_at = time.monotonic()
 
-            except Exception as e:
-                failed_count += 1
-                print(f"✗ 刪除失敗: {summary} (ID: {event_id}) - {e}")
+        executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+        try:
+            futures = [
+                executor.submit(delete_batch, service_factory, calendar_id, batch, limiter)
+                for batch in batches
+            ]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                done, failed = future.result()
+                checkpoint.complete(done)
+                failures.update(failed)
+                if completed % 10 == 0 or completed == len(batches):
+                    print(f"  進度: {completed}/{len(batches)} 批，已刪除 {checkpoint.deleted_count} 個事件 "
+                          f"({time.monotonic() - started_at:.0f} 秒)")
+        finally:
+            # 中斷時取消尚未開始的批次，並記錄目前進度
+            executor.shutdown(wait=True, cancel_futures=True)
+            checkpoint.save()
 
         print(f"\n清理完成:")
-        print(f"  - 成功刪除: {deleted_count} 個事件")
-        print(f"  - 刪除失敗: {failed_count} 個事件")
+        print(f"  - 成功刪除: {checkpoint.deleted_count} 個事件")
+        print(f"  - 刪除失敗: {len(failures)} 個事件")
+        for event_id, error in list(failures.items())[:10]:
+            print(f"    ✗ {event_id}: {error}")
+
+        if failures:
+            print(f"失敗的事件保留在檢查點 {checkpoint.path}，重新執行即可重試")
+        else:
+            checkpoint.remove()
 
+    except KeyboardInterrupt:
+        print("\n已中斷，重新執行即可從檢查點繼續")
     except Exception as e:
         print(f"❌ 清理失敗: {e}")
         import traceback